@@ -0,0 +1,23 @@
+#!/bin/bash
+
+# Define paths
+PYTHON_SCRIPT="../src/data/build_corpus.py"
+REPORTS_PATH="../data_msc_project/physionet.org/files/mimic-cxr/2.0.0"
+STUDY_LIST_PATH="../data_msc_project/eval_set/test-set-destinations.csv"
+CHEXPERT_PATH="../data_msc_project/cheXpert"
+CHEXBERT_PATH="../data_msc_project/cheXbert"
+VISUALCHEXBERT_PATH="../data_msc_project/VisualCheXbert"
+EVAL_PATH="../data_msc_project/eval_set"
+WORKERS=1
+
+# Set DEDUP=1 to also write each distinct report once, for the labelling
+# scripts run with DEDUP=1
+DEDUP_ARGS=""
+if [ -n "$DEDUP" ]; then
+    DEDUP_ARGS="--dedup"
+fi
+
+# Section every report once and write all the labeller and evaluation inputs
+python $PYTHON_SCRIPT --reports_path $REPORTS_PATH --study_list $STUDY_LIST_PATH --chexpert_path $CHEXPERT_PATH --chexbert_path $CHEXBERT_PATH --visualchexbert_path $VISUALCHEXBERT_PATH --eval_path $EVAL_PATH --workers $WORKERS $DEDUP_ARGS
+
+echo "Script execution completed. Outputs saved to $CHEXPERT_PATH, $CHEXBERT_PATH, $VISUALCHEXBERT_PATH and $EVAL_PATH."
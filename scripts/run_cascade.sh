@@ -0,0 +1,30 @@
+#!/bin/bash
+
+# Define paths
+CASCADE_PATH="../src/labeller/cascade.py"
+CHEXPERT_PATH="../models/chexpert-labeler"
+INPUT_PATH="../data_msc_project/cheXbert/input_chexbert.csv"
+OUTPUT_PATH="../data_msc_project/cascade"
+MODEL_PATH="../models/CheXbert/model_path/chexbert.pth"
+TRUE_LABELS="../data_msc_project/physionet.org/files/mimic-cxr-jpg/2.1.0/mimic-cxr-2.1.0-test-set-labeled.csv"
+TEST_REPORT_PATH="../data_msc_project/cheXpert/input_chexpert.csv"
+CACHE_DIR="../data_msc_project/token_cache"
+THRESHOLD=0.9
+
+DEFERRED_FILE="${OUTPUT_PATH}/cascade_deferred.csv"
+EXPENSIVE_FILE="${OUTPUT_PATH}/chexpert_deferred_labeled.csv"
+FIRST_STAGE_FILE="${OUTPUT_PATH}/cascade_first_stage.npz"
+
+# CheXbert labels every report, and writes the reports with a head below
+# the confidence threshold, and the test set, for the rule-based labeller.
+# Its classes and confidences are saved to $FIRST_STAGE_FILE
+python $CASCADE_PATH -d=$INPUT_PATH -o=$OUTPUT_PATH -c=$MODEL_PATH --thresholds $THRESHOLD --deferred_format chexpert --cache_dir $CACHE_DIR --true_labels $TRUE_LABELS --test_report_path $TEST_REPORT_PATH
+
+# Run the CheXpert labeler on those reports only
+python $CHEXPERT_PATH/label.py --verbose --reports_path $DEFERRED_FILE --output_path $EXPENSIVE_FILE --mention_phrases_dir $CHEXPERT_PATH/phrases/mention --unmention_phrases_dir $CHEXPERT_PATH/phrases/unmention --pre_negation_uncertainty_path $CHEXPERT_PATH/patterns/pre_negation_uncertainty.txt --negation_path $CHEXPERT_PATH/patterns/negation.txt --post_negation_uncertainty_path $CHEXPERT_PATH/patterns/post_negation_uncertainty.txt
+
+# Merge the labels with the saved first stage, without running CheXbert
+# again, and compute the cost/accuracy curve on the test set
+python $CASCADE_PATH -d=$INPUT_PATH -o=$OUTPUT_PATH --first_stage $FIRST_STAGE_FILE --thresholds $THRESHOLD --deferred_format chexpert --expensive_labels $EXPENSIVE_FILE --true_labels $TRUE_LABELS --test_report_path $TEST_REPORT_PATH
+
+echo "Script execution completed. Output saved to $OUTPUT_PATH."
@@ -9,16 +9,36 @@ fi
 # Define paths
 CHEXPERT_PATH="../models/chexpert-labeler"
 REPORT_PATH="../data_msc_project/cheXpert/input_chexpert.csv"
+# Written by generate_input_chexpert.py --dedup
+UNIQUE_REPORT_PATH="../data_msc_project/cheXpert/input_chexpert_unique.csv"
+MAP_PATH="../data_msc_project/cheXpert/input_chexpert_map.csv"
 OUTPUT_PATH="../data_msc_project/cheXpert"
 
+FAN_OUT_PATH="../src/data/fan_out_labels.py"
+
 # Get the number of runs from the command-line argument
 NUM_RUNS=$1
 
+# Set DEDUP=1 to label each distinct report of the input once, from the
+# files written by generate_input_chexpert.py --dedup, and copy the labels
+# to every study
+if [ -n "$DEDUP" ] && { [ ! -f "$UNIQUE_REPORT_PATH" ] || [ ! -f "$MAP_PATH" ]; }; then
+    echo "DEDUP is set, but $UNIQUE_REPORT_PATH or $MAP_PATH does not exist."
+    exit 1
+fi
+
 # Run the CheXpert labeler the specified number of times
 for ((i=1; i<=NUM_RUNS; i++))
 do
     OUTPUT_FILE="${OUTPUT_PATH}/chexpert_labeled_${i}.csv"
-    python $CHEXPERT_PATH/label.py --verbose --reports_path $REPORT_PATH --output_path $OUTPUT_FILE --mention_phrases_dir $CHEXPERT_PATH/phrases/mention --unmention_phrases_dir $CHEXPERT_PATH/phrases/unmention --pre_negation_uncertainty_path $CHEXPERT_PATH/patterns/pre_negation_uncertainty.txt --negation_path $CHEXPERT_PATH/patterns/negation.txt --post_negation_uncertainty_path $CHEXPERT_PATH/patterns/post_negation_uncertainty.txt
+    if [ -n "$DEDUP" ]; then
+        # Label each distinct report once, then copy the labels to every study
+        UNIQUE_OUTPUT_FILE="${OUTPUT_PATH}/unique_chexpert_labeled_${i}.csv"
+        python $CHEXPERT_PATH/label.py --verbose --reports_path $UNIQUE_REPORT_PATH --output_path $UNIQUE_OUTPUT_FILE --mention_phrases_dir $CHEXPERT_PATH/phrases/mention --unmention_phrases_dir $CHEXPERT_PATH/phrases/unmention --pre_negation_uncertainty_path $CHEXPERT_PATH/patterns/pre_negation_uncertainty.txt --negation_path $CHEXPERT_PATH/patterns/negation.txt --post_negation_uncertainty_path $CHEXPERT_PATH/patterns/post_negation_uncertainty.txt
+        python $FAN_OUT_PATH --labeled_file $UNIQUE_OUTPUT_FILE --map_file $MAP_PATH --output_file $OUTPUT_FILE --input_file $REPORT_PATH || exit 1
+    else
+        python $CHEXPERT_PATH/label.py --verbose --reports_path $REPORT_PATH --output_path $OUTPUT_FILE --mention_phrases_dir $CHEXPERT_PATH/phrases/mention --unmention_phrases_dir $CHEXPERT_PATH/phrases/unmention --pre_negation_uncertainty_path $CHEXPERT_PATH/patterns/pre_negation_uncertainty.txt --negation_path $CHEXPERT_PATH/patterns/negation.txt --post_negation_uncertainty_path $CHEXPERT_PATH/patterns/post_negation_uncertainty.txt
+    fi
     echo "Run $i completed. Output saved to $OUTPUT_FILE."
 done
 
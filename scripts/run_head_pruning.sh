@@ -0,0 +1,32 @@
+#!/bin/bash
+
+# Define paths
+PYTHON_SCRIPT="../src/labeller/head_pruning.py"
+GENERATE_INPUT_PATH="../src/data/generate_input_chexbert.py"
+REPORTS_PATH="../data_msc_project/physionet.org/files/mimic-cxr/2.0.0"
+STUDY_LIST_FILE="../data_msc_project/physionet.org/files/mimic-cxr/2.0.0/cxr-study-list.csv"
+# Impressions of every MIMIC-CXR study, shared with run_distill.sh
+CORPUS_PATH="../data_msc_project/cheXbert/corpus"
+INPUT_PATH="${CORPUS_PATH}/input_chexbert.csv"
+MODEL_PATH="../models/CheXbert/model_path/chexbert.pth"
+PRUNED_PATH="../models/CheXbert/model_path/chexbert_pruned.safetensors"
+IMPORTANCE_FILE="../data_msc_project/cheXbert/head_importance.csv"
+TRUE_LABELS="../data_msc_project/physionet.org/files/mimic-cxr-jpg/2.1.0/mimic-cxr-2.1.0-test-set-labeled.csv"
+TEST_REPORT_PATH="../data_msc_project/cheXpert/input_chexpert.csv"
+CACHE_DIR="../data_msc_project/token_cache"
+PRUNE_FRACTION=0.25
+WORKERS=1
+# auto is cuda where available, else cpu
+DEVICE="${DEVICE:-auto}"
+
+# Write the impressions of the whole corpus once, to score heads on
+if [ ! -f "$INPUT_PATH" ]; then
+    python $GENERATE_INPUT_PATH --reports_path $REPORTS_PATH --output_path $CORPUS_PATH --no_split --study_list $STUDY_LIST_FILE --workers $WORKERS || exit 1
+fi
+
+# Remove the least important attention heads of CheXbert, fine-tune briefly,
+# leaving out the test set reports, then report the latency gain and
+# per-condition F1 change on the test set
+python $PYTHON_SCRIPT -d=$INPUT_PATH -c=$MODEL_PATH -o=$PRUNED_PATH --prune_fraction $PRUNE_FRACTION --finetune_epochs 1 --importance_file $IMPORTANCE_FILE --true_labels $TRUE_LABELS --test_report_path $TEST_REPORT_PATH --cache_dir $CACHE_DIR --device $DEVICE
+
+echo "Script execution completed. Pruned model saved to $PRUNED_PATH."
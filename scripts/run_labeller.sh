@@ -0,0 +1,30 @@
+#!/bin/bash
+
+# Check if the number of runs is provided as an argument
+if [ $# -ne 1 ]; then
+    echo "Usage: $0 <number_of_runs>"
+    exit 1
+fi
+
+# Define paths
+RUNNER_PATH="../src/labeller/label_runner.py"
+# Tokenized inputs, shared by the labellers and reused across runs
+CACHE_DIR="../data_msc_project/token_cache"
+INPUT_PATH="../data_msc_project/cheXbert/input_chexbert.csv"
+OUTPUT_PATH="../data_msc_project/labeller"
+MODEL_PATH="../data_msc_project/bertdata/model_path/model.pth"
+
+# Get the number of runs from the command-line argument
+NUM_RUNS=$1
+
+# Set MC_DROPOUT=heads or MC_DROPOUT=full to compute the runs together as
+# Monte-Carlo dropout passes, which also saves a per-report disagreement score
+MC_ARGS=""
+if [ -n "$MC_DROPOUT" ]; then
+    MC_ARGS="--mc_dropout $MC_DROPOUT --seed 0"
+fi
+
+# Load the project model once and label the input the specified number of times
+python $RUNNER_PATH -d=$INPUT_PATH -o=$OUTPUT_PATH -c=$MODEL_PATH --prefix labeller --num_runs $NUM_RUNS --cache_dir $CACHE_DIR $MC_ARGS
+
+echo "All runs completed."
@@ -0,0 +1,15 @@
+#!/bin/bash
+
+# Define paths
+PYTHON_SCRIPT="../src/data/near_duplicates.py"
+INPUT_FILE="../data_msc_project/cheXpert/input_chexpert.csv"
+OUTPUT_PATH="../data_msc_project/cheXbert"
+CLUSTERS_FILE="../data_msc_project/cheXbert/near_duplicate_clusters.csv"
+THRESHOLD=0.9
+
+# Write one representative impression per cluster of near-duplicates, as
+# input_chexbert_neardup_unique.csv and input_chexbert_neardup_map.csv,
+# which run_chexbert.sh only uses when run with NEAR_DUP=1
+python $PYTHON_SCRIPT --input_files $INPUT_FILE --output_path $OUTPUT_PATH --stem input_chexbert_neardup --format chexbert --threshold $THRESHOLD --clusters_file $CLUSTERS_FILE
+
+echo "Script execution completed. Output saved to $OUTPUT_PATH."
@@ -7,21 +7,49 @@ if [ $# -ne 1 ]; then
 fi
 
 # Define paths
-VISUALCHEXBERT_PATH="../models/VisualCheXbert/src"
 INPUT_PATH="../data_msc_project/VisualCheXbert/input_visualchexbert.csv"
+# Written by generate_input_visualchexbert.py --dedup
+UNIQUE_INPUT_PATH="../data_msc_project/VisualCheXbert/input_visualchexbert_unique.csv"
+MAP_PATH="../data_msc_project/VisualCheXbert/input_visualchexbert_map.csv"
 OUTPUT_PATH="../data_msc_project/VisualCheXbert"
 MODEL_PATH="../models/VisualCheXbert/model_path/checkpoint"
 
+RUNNER_PATH="../src/labeller/label_runner.py"
+# Tokenized inputs, shared by the labellers and reused across runs
+CACHE_DIR="../data_msc_project/token_cache"
+FAN_OUT_PATH="../src/data/fan_out_labels.py"
+
 # Get the number of runs from the command-line argument
 NUM_RUNS=$1
 
-# Run the CheXbert labeler the specified number of times
-for ((i=1; i<=NUM_RUNS; i++))
-do
-    OUTPUT_FILE="${OUTPUT_PATH}/visualchexbert_labeled_${i}.csv"
-    python $VISUALCHEXBERT_PATH/label.py -d=$INPUT_PATH -o=$OUTPUT_FILE -c=$MODEL_PATH
-    echo "Run $i completed. Output saved to $OUTPUT_FILE."
-done
+# Set MC_DROPOUT=heads or MC_DROPOUT=full to compute the runs together as
+# Monte-Carlo dropout passes, which also saves a per-report disagreement score
+MC_ARGS=""
+if [ -n "$MC_DROPOUT" ]; then
+    MC_ARGS="--mc_dropout $MC_DROPOUT --seed 0"
+fi
+
+# Set DEDUP=1 to label each distinct report of the input once, from the
+# files written by generate_input_visualchexbert.py --dedup, and copy the labels
+# to every study
+if [ -n "$DEDUP" ] && { [ ! -f "$UNIQUE_INPUT_PATH" ] || [ ! -f "$MAP_PATH" ]; }; then
+    echo "DEDUP is set, but $UNIQUE_INPUT_PATH or $MAP_PATH does not exist."
+    exit 1
+fi
+
+# Load the model once and label the input the specified number of times
+if [ -n "$DEDUP" ]; then
+    # Label each distinct report, then copy the labels to every study
+    python $RUNNER_PATH -d=$UNIQUE_INPUT_PATH -o=$OUTPUT_PATH -c=$MODEL_PATH --prefix unique_visualchexbert --num_runs $NUM_RUNS --cache_dir $CACHE_DIR $MC_ARGS
+    for ((i=1; i<=NUM_RUNS; i++))
+    do
+        OUTPUT_FILE="${OUTPUT_PATH}/visualchexbert_labeled_${i}.csv"
+        python $FAN_OUT_PATH --labeled_file "${OUTPUT_PATH}/unique_visualchexbert_labeled_${i}.csv" --map_file $MAP_PATH --output_file $OUTPUT_FILE --input_file $INPUT_PATH --input_header --text_column "Report Impression" || exit 1
+        echo "Run $i completed. Output saved to $OUTPUT_FILE."
+    done
+else
+    python $RUNNER_PATH -d=$INPUT_PATH -o=$OUTPUT_PATH -c=$MODEL_PATH --prefix visualchexbert --num_runs $NUM_RUNS --cache_dir $CACHE_DIR $MC_ARGS
+fi
 
 echo "All runs completed."
 
@@ -0,0 +1,63 @@
+import sys
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+# local folder import
+import report_extraction as rx
+from benchmark_section_parser import synthetic_report
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_reports', type=int, default=50000,
+                    help='Number of synthetic reports to write and extract.')
+parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16],
+                    help='Worker counts to time.')
+parser.add_argument('--chunksize', type=int, default=64,
+                    help='Number of reports sent to a worker at a time.')
+parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed for the synthetic corpus.')
+
+
+def write_synthetic_tree(reports_path, num_reports, seed):
+    """Writes reports in the files/pXX/pYYYYYYYY/sZZZZZZZZ.txt layout."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(num_reports):
+        subject = f'p1{rng.randint(0, 9)}{rng.randint(0, 999999):06d}'
+        path = Path('files') / subject[:3] / subject / f's5{i:07d}.txt'
+        (reports_path / path).parent.mkdir(parents=True, exist_ok=True)
+        with open(reports_path / path, 'w') as fp:
+            fp.write(synthetic_report(rng))
+        paths.append(str(path))
+    return paths
+
+
+def main(args):
+    args = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        reports_path = Path(tmp)
+        paths = write_synthetic_tree(reports_path, args.num_reports, args.seed)
+
+        expected = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            rows = list(rx.extract_reports(reports_path, paths,
+                                           workers=workers,
+                                           chunksize=args.chunksize))
+            elapsed = time.perf_counter() - start
+
+            # the parallel path must match the serial one row for row
+            if expected is None:
+                expected = rows
+            elif rows != expected:
+                raise ValueError(f'output with {workers} workers differs')
+
+            print(f'workers={workers:<3d} {elapsed:.2f}s '
+                  f'({len(paths) / elapsed:,.0f} reports/s)')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,309 @@
+import sys
+import argparse
+import random
+import re
+import time
+
+# local folder import
+import section_parser as sp
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_reports', type=int, default=227835,
+                    help='Number of synthetic reports to section.')
+parser.add_argument('--num_headers', type=int, default=5000000,
+                    help='Number of section headers to normalize.')
+parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed for the synthetic corpus.')
+
+HEADERS = [
+    'EXAMINATION', 'INDICATION', 'HISTORY', 'TECHNIQUE', 'COMPARISON',
+    'FINDINGS', 'IMPRESSION', 'CLINICAL HISTORY', 'REASON FOR EXAM',
+    'CHEST, PA AND LATERAL', 'RECOMMENDATION(S)', 'NOTIFICATION',
+    'FINDINGS/IMPRESSION', 'WET READ', 'ADDENDUM'
+]
+
+SENTENCES = [
+    'The lungs are clear without focal consolidation.',
+    'No pleural effusion or pneumothorax is seen.',
+    'Heart size is normal.',
+    'Mediastinal and hilar contours are unremarkable.',
+    'Moderate cardiomegaly is again noted.',
+    'There is mild pulmonary vascular congestion.',
+    'Chest radiograph dated ___.',
+    '___ year old woman with shortness of breath.',
+    'No acute cardiopulmonary process.',
+]
+
+
+def legacy_section_text(text):
+    """Reference copy of section_text before it was built on section_spans."""
+    p_section = re.compile(
+        r'\n ([A-Z ()/,-]+):\s', re.DOTALL)
+
+    sections = list()
+    section_names = list()
+    section_idx = list()
+
+    idx = 0
+    s = p_section.search(text, idx)
+
+    if s:
+        sections.append(text[0:s.start(1)])
+        section_names.append('preamble')
+        section_idx.append(0)
+
+        while s:
+            current_section = s.group(1).lower()
+            idx_start = s.end()
+            idx_skip = text[idx_start:].find('\n')
+            if idx_skip == -1:
+                idx_skip = 0
+
+            s = p_section.search(text, idx_start + idx_skip)
+
+            if s is None:
+                idx_end = len(text)
+            else:
+                idx_end = s.start()
+
+            sections.append(text[idx_start:idx_end])
+            section_names.append(current_section)
+            section_idx.append(idx_start)
+
+    else:
+        sections.append(text)
+        section_names.append('full report')
+        section_idx.append(0)
+
+    section_names = legacy_normalize_section_names(section_names)
+
+    for i in reversed(range(len(section_names))):
+        if section_names[i] in ('impression', 'findings'):
+            if sections[i].strip() == '':
+                sections.pop(i)
+                section_names.pop(i)
+                section_idx.pop(i)
+
+    if ('impression' not in section_names) & ('findings' not in section_names):
+        if '\n \n' in sections[-1]:
+            sections.append('\n \n'.join(sections[-1].split('\n \n')[1:]))
+            sections[-2] = sections[-2].split('\n \n')[0]
+            section_names.append('last_paragraph')
+            section_idx.append(section_idx[-1] + len(sections[-2]))
+
+    return sections, section_names, section_idx
+
+
+def legacy_normalize_section_names(section_names):
+    """Reference copy of normalize_section_names before it was memoized."""
+    # first, lower case all
+    section_names = [s.lower().strip() for s in section_names]
+
+    frequent_sections = {
+        "preamble": "preamble",  # 227885
+        "impression": "impression",  # 187759
+        "comparison": "comparison",  # 154647
+        "indication": "indication",  # 153730
+        "findings": "findings",  # 149842
+        "examination": "examination",  # 94094
+        "technique": "technique",  # 81402
+        "history": "history",  # 45624
+        "comparisons": "comparison",  # 8686
+        "clinical history": "history",  # 7121
+        "reason for examination": "indication",  # 5845
+        "notification": "notification",  # 5749
+        "reason for exam": "indication",  # 4430
+        "clinical information": "history",  # 4024
+        "exam": "examination",  # 3907
+        "clinical indication": "indication",  # 1945
+        "conclusion": "impression",  # 1802
+        "chest, two views": "findings",  # 1735
+        "recommendation(s)": "recommendations",  # 1700
+        "type of examination": "examination",  # 1678
+        "reference exam": "comparison",  # 347
+        "patient history": "history",  # 251
+        "addendum": "addendum",  # 183
+        "comparison exam": "comparison",  # 163
+        "date": "date",  # 108
+        "comment": "comment",  # 88
+        "findings and impression": "impression",  # 87
+        "wet read": "wet read",  # 83
+        "comparison film": "comparison",  # 79
+        "recommendations": "recommendations",  # 72
+        "findings/impression": "impression",  # 47
+        "pfi": "history",
+        'recommendation': 'recommendations',
+        'wetread': 'wet read',
+        'ndication': 'impression',  # 1
+        'impresson': 'impression',  # 2
+        'imprression': 'impression',  # 1
+        'imoression': 'impression',  # 1
+        'impressoin': 'impression',  # 1
+        'imprssion': 'impression',  # 1
+        'impresion': 'impression',  # 1
+        'imperssion': 'impression',  # 1
+        'mpression': 'impression',  # 1
+        'impession': 'impression',  # 3
+        'findings/ impression': 'impression',  # ,1
+        'finding': 'findings',  # ,8
+        'findins': 'findings',
+        'findindgs': 'findings',  # ,1
+        'findgings': 'findings',  # ,1
+        'findngs': 'findings',  # ,1
+        'findnings': 'findings',  # ,1
+        'finidngs': 'findings',  # ,2
+        'idication': 'indication',  # ,1
+        'reference findings': 'findings',  # ,1
+        'comparision': 'comparison',  # ,2
+        'comparsion': 'comparison',  # ,1
+        'comparrison': 'comparison',  # ,1
+        'comparisions': 'comparison'  # ,1
+    }
+
+    p_findings = [
+        'chest',
+        'portable',
+        'pa and lateral',
+        'lateral and pa',
+        'ap and lateral',
+        'lateral and ap',
+        'frontal and',
+        'two views',
+        'frontal view',
+        'pa view',
+        'ap view',
+        'one view',
+        'lateral view',
+        'bone window',
+        'frontal upright',
+        'frontal semi-upright',
+        'ribs',
+        'pa and lat'
+    ]
+    p_findings = re.compile('({})'.format('|'.join(p_findings)))
+
+    main_sections = [
+        'impression', 'findings', 'history', 'comparison',
+        'addendum'
+    ]
+    for i, s in enumerate(section_names):
+        if s in frequent_sections:
+            section_names[i] = frequent_sections[s]
+            continue
+
+        main_flag = False
+        for m in main_sections:
+            if m in s:
+                section_names[i] = m
+                main_flag = True
+                break
+        if main_flag:
+            continue
+
+        m = p_findings.search(s)
+        if m is not None:
+            section_names[i] = 'findings'
+
+        # if it looks like it is describing the entire study
+        # it's equivalent to findings
+        # group similar phrasings for impression
+
+    return section_names
+
+
+def paragraph(rng):
+    """Random paragraph wrapped the way MIMIC-CXR wraps report lines."""
+    words = ' '.join(rng.choice(SENTENCES)
+                     for _ in range(rng.randint(1, 6))).split(' ')
+    lines, line = [], ''
+    for w in words:
+        if len(line) + len(w) > 70:
+            lines.append(line)
+            line = ''
+        line = (line + ' ' + w).strip()
+    lines.append(line)
+    return '\n '.join(lines)
+
+
+def synthetic_header(rng):
+    """Random header, mostly common ones with the odd typo or variant."""
+    header = rng.choice(HEADERS)
+    if rng.random() < 0.05:
+        i = rng.randrange(len(header))
+        header = header[:i] + header[i + 1:]
+    if rng.random() < 0.05:
+        header = rng.choice(['PORTABLE ', 'FRONTAL AND ', 'FINAL ']) + header
+    return header
+
+
+def synthetic_report(rng):
+    """Random report in the MIMIC-CXR layout, including odd corner cases."""
+    text = '                                 FINAL REPORT\n'
+    headers = rng.sample(HEADERS, rng.randint(0, 6))
+    for header in headers:
+        body = paragraph(rng)
+        if rng.random() < 0.1:
+            # empty section
+            body = ''
+        elif rng.random() < 0.3:
+            body += '\n \n ' + paragraph(rng)
+        text += f' {header}:  {body}\n \n'
+    if not headers or rng.random() < 0.2:
+        text += ' ' + paragraph(rng) + '\n \n ' + paragraph(rng) + '\n'
+    return text
+
+
+def time_it(fn, corpus):
+    start = time.perf_counter()
+    for text in corpus:
+        fn(text)
+    return time.perf_counter() - start
+
+
+def main(args):
+    args = parser.parse_args(args)
+
+    rng = random.Random(args.seed)
+    corpus = [synthetic_report(rng) for _ in range(args.num_reports)]
+    n_chars = sum(len(t) for t in corpus)
+    print(f'{len(corpus)} reports, {n_chars / 1e6:.1f}M characters')
+
+    # check the new implementation before timing it
+    for text in corpus:
+        if sp.section_text(text) != legacy_section_text(text):
+            raise ValueError(f'section_text mismatch for report:\n{text}')
+
+    t_legacy = time_it(legacy_section_text, corpus)
+    t_text = time_it(sp.section_text, corpus)
+    t_spans = time_it(sp.section_spans, corpus)
+
+    print(f'legacy section_text: {t_legacy:.2f}s '
+          f'({len(corpus) / t_legacy:,.0f} reports/s)')
+    print(f'section_text:        {t_text:.2f}s '
+          f'({len(corpus) / t_text:,.0f} reports/s, '
+          f'{t_legacy / t_text:.2f}x)')
+    print(f'section_spans:       {t_spans:.2f}s '
+          f'({len(corpus) / t_spans:,.0f} reports/s, '
+          f'{t_legacy / t_spans:.2f}x)')
+
+    headers = [synthetic_header(rng) for _ in range(args.num_headers)]
+    print(f'{len(headers)} headers, {len(set(headers))} distinct')
+
+    if sp.normalize_section_names(headers) != \
+            legacy_normalize_section_names(headers):
+        raise ValueError('normalize_section_names mismatch')
+
+    # one report's worth of headers at a time, as section_spans does
+    batches = [headers[i:i + 6] for i in range(0, len(headers), 6)]
+    t_legacy = time_it(legacy_normalize_section_names, batches)
+    t_norm = time_it(sp.normalize_section_names, batches)
+
+    print(f'legacy normalize_section_names: {t_legacy:.2f}s '
+          f'({len(headers) / t_legacy:,.0f} headers/s)')
+    print(f'normalize_section_names:        {t_norm:.2f}s '
+          f'({len(headers) / t_norm:,.0f} headers/s, '
+          f'{t_legacy / t_norm:.2f}x)')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,153 @@
+import sys
+import argparse
+import csv
+from contextlib import ExitStack
+from pathlib import Path
+
+# local folder import
+import report_extraction as rx
+import output_writers as ow
+from sections_parquet import SectionsParquetWriter
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--reports_path',
+                    required=True,
+                    help=('Path to file with radiology reports,'
+                          ' e.g. /data/mimic-cxr/files, or a .zip or .tar'
+                          ' of them'))
+parser.add_argument('--study_list',
+                    required=True,
+                    help='Path to the CSV file containing the list of studies to process.')
+parser.add_argument('--chexpert_path',
+                    help='Output folder for input_chexpert.csv.')
+parser.add_argument('--chexbert_path',
+                    help='Output folder for input_chexbert.csv.')
+parser.add_argument('--visualchexbert_path',
+                    help='Output folder for input_visualchexbert.csv.')
+parser.add_argument('--eval_path',
+                    help=('Output folder for test_set_reports.csv'
+                          ' and ordered_test_ids.csv.'))
+parser.add_argument('--workers', type=int, default=1,
+                    help='Number of processes used to read and section reports.')
+parser.add_argument('--chunksize', type=int, default=64,
+                    help='Number of reports sent to a worker at a time.')
+parser.add_argument('--prefetch', type=int, default=0,
+                    help=('Number of threads reading reports ahead,'
+                          ' when not using --workers.'))
+parser.add_argument('--manifest',
+                    help=('Path to a manifest of extracted sections, used to'
+                          ' skip reading reports which are unchanged since a'
+                          ' previous or interrupted run. The outputs are still'
+                          ' written in full.'))
+parser.add_argument('--compression', default='none',
+                    choices=sorted(ow.COMPRESSION_SUFFIXES),
+                    help='Compression of the output CSV files.')
+parser.add_argument('--dedup', action='store_true',
+                    help=('Also write each distinct text once to a *_unique.csv'
+                          ' file, with a *_map.csv from studies to texts.'))
+parser.add_argument('--sections_parquet',
+                    help=('Path to a Parquet file to write the sections of'
+                          ' each study to.'))
+parser.add_argument('--row_group_size', type=int, default=10000,
+                    help='Number of studies per Parquet row group.')
+
+
+def open_csv(stack, folder, file_name, header=None, compression='none'):
+    """Opens a streaming CSV writer on folder / file_name, creating the folder."""
+    folder = Path(folder)
+    if not folder.exists():
+        folder.mkdir(parents=True)
+    return stack.enter_context(ow.CSVRowWriter(folder, file_name,
+                                               header=header,
+                                               compression=compression))
+
+
+def main(args):
+    """Sections every report once and writes all downstream inputs.
+
+    Replaces separate runs of generate_input_chexpert.py,
+    generate_input_chexbert.py, generate_input_visualchexbert.py,
+    test_set_reports.py and evaluation/ordered_test_ids.py over the same
+    study list, producing the same files. Only the outputs whose folder
+    is given are written.
+    """
+    args = parser.parse_args(args)
+
+    # Read the study list CSV
+    study_list = {}
+    with open(args.study_list, 'r') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            study_list[row['path']] = row
+
+    with ExitStack() as stack:
+        # rows of [study, text], as read by the CheXpert labeler
+        chexpert = []
+        # rows of [text], under the header the CheXbert labelers expect
+        chexbert = []
+        # each distinct text once, see output_writers.UniqueTextWriter
+        unique = []
+        sectioned = None
+        ordered_ids = None
+
+        if args.chexpert_path is not None:
+            chexpert.append(open_csv(stack, args.chexpert_path,
+                                     'input_chexpert.csv',
+                                     compression=args.compression))
+        if args.chexbert_path is not None:
+            chexbert.append(open_csv(stack, args.chexbert_path,
+                                     'input_chexbert.csv',
+                                     ['Report Impression'],
+                                     args.compression))
+        if args.visualchexbert_path is not None:
+            chexbert.append(open_csv(stack, args.visualchexbert_path,
+                                     'input_visualchexbert.csv',
+                                     ['Report Impression'],
+                                     args.compression))
+        if args.dedup:
+            if args.chexpert_path is not None:
+                unique.append(stack.enter_context(ow.UniqueTextWriter(
+                    Path(args.chexpert_path), 'input_chexpert', with_id=True,
+                    compression=args.compression)))
+            for folder, stem in [(args.chexbert_path, 'input_chexbert'),
+                                 (args.visualchexbert_path,
+                                  'input_visualchexbert')]:
+                if folder is not None:
+                    unique.append(stack.enter_context(ow.UniqueTextWriter(
+                        Path(folder), stem, header=['Report Impression'],
+                        compression=args.compression)))
+        if args.eval_path is not None:
+            sectioned = open_csv(stack, args.eval_path,
+                                 'test_set_reports.csv',
+                                 ['study'] + list(rx.SECTION_ORDER),
+                                 args.compression)
+            ordered_ids = open_csv(stack, args.eval_path,
+                                   'ordered_test_ids.csv', ['study_id'],
+                                   args.compression)
+        if args.sections_parquet is not None:
+            sectioned_parquet = stack.enter_context(SectionsParquetWriter(
+                args.sections_parquet, row_group_size=args.row_group_size))
+        else:
+            sectioned_parquet = None
+
+        for s_stem, impression, study_sectioned in rx.extract_reports(
+                args.reports_path, study_list, workers=args.workers,
+                chunksize=args.chunksize, manifest_path=args.manifest,
+                prefetch=args.prefetch):
+            for csvwriter in chexpert:
+                csvwriter.writerow([s_stem, impression])
+            for csvwriter in chexbert:
+                csvwriter.writerow([impression])
+            for dedup_writer in unique:
+                dedup_writer.writerow(s_stem, impression)
+            if sectioned is not None and study_sectioned is not None:
+                sectioned.writerow(study_sectioned)
+            if sectioned_parquet is not None and study_sectioned is not None:
+                sectioned_parquet.writerow(study_sectioned)
+            if ordered_ids is not None:
+                # study id without the leading 's'
+                ordered_ids.writerow([s_stem[1:]])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
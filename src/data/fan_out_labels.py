@@ -0,0 +1,78 @@
+import sys
+import argparse
+import csv
+
+parser = argparse.ArgumentParser(description=(
+    'Copy the labels of each distinct report back to every study,'
+    ' see output_writers.UniqueTextWriter.'))
+parser.add_argument('--labeled_file', required=True,
+                    help='Labeller output for the *_unique.csv input.')
+parser.add_argument('--map_file', required=True,
+                    help='The *_map.csv file written with the unique input.')
+parser.add_argument('--output_file', required=True,
+                    help='Path to the per-study labeled CSV file.')
+parser.add_argument('--input_file',
+                    help=('Per-study labeller input the map was written with,'
+                          ' e.g. input_chexbert.csv. The map is checked to'
+                          ' have a row per report in it.'))
+parser.add_argument('--input_header', action='store_true',
+                    help='The first row of --input_file is a header.')
+parser.add_argument('--text_column',
+                    help=('Column of the labeled file holding the report, e.g.'
+                          ' "Report Impression". With --input_file, it is set'
+                          ' to the text of each study, the last column of its'
+                          ' input row.'))
+
+
+def read_input_texts(input_file, header=False):
+    """Text of each report of per-study labeller input, in order."""
+    with open(input_file, 'r', newline='') as fp:
+        reader = csv.reader(fp)
+        if header:
+            next(reader, None)
+        return [row[-1] if row else '' for row in reader]
+
+
+def main(args):
+    args = parser.parse_args(args)
+
+    # rows are written back unchanged, in the labeller's own CSV format
+    with open(args.labeled_file, 'r', newline='') as fp:
+        reader = csv.reader(fp)
+        header = next(reader)
+        labeled = list(reader)
+
+    with open(args.map_file, 'r', newline='') as fp:
+        text_ids = [int(row['text_id']) for row in csv.DictReader(fp)]
+
+    if text_ids and max(text_ids) + 1 != len(labeled):
+        raise ValueError(f'{args.map_file} maps to {max(text_ids) + 1} texts,'
+                         f' but {args.labeled_file} has {len(labeled)} rows')
+    if args.input_file is not None:
+        texts = read_input_texts(args.input_file, args.input_header)
+        if len(texts) != len(text_ids):
+            raise ValueError(f'{args.map_file} has {len(text_ids)} studies,'
+                             f' but {args.input_file} has {len(texts)}; it was'
+                             f' written for another input')
+    else:
+        texts = None
+    if args.text_column is not None:
+        text_column = header.index(args.text_column)
+
+    with open(args.output_file, 'w', newline='') as out:
+        csvwriter = csv.writer(out, lineterminator='\n')
+        csvwriter.writerow(header)
+        for i, text_id in enumerate(text_ids):
+            row = labeled[text_id]
+            if texts is not None and args.text_column is not None:
+                # the study's own report, next to the labels of its text
+                row = list(row)
+                row[text_column] = texts[i]
+            csvwriter.writerow(row)
+
+    print(f'{len(labeled)} labeled reports fanned out to {len(text_ids)}'
+          f' studies in {args.output_file}.')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,19 +2,20 @@ import sys
 import os
 import argparse
 import csv
-import re
+from contextlib import ExitStack
 from pathlib import Path
 
-from tqdm import tqdm
-
 # local folder import
-import section_parser as sp
+import report_extraction as rx
+import output_writers as ow
+from sections_parquet import SectionsParquetWriter
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--reports_path',
                     required=True,
                     help=('Path to file with radiology reports,'
-                          ' e.g. /data/mimic-cxr/files'))
+                          ' e.g. /data/mimic-cxr/files, or a .zip or .tar'
+                          ' of them'))
 parser.add_argument('--output_path',
                     required=True,
                     help='Path to output CSV files.')
@@ -23,32 +24,35 @@ parser.add_argument('--no_split', action='store_true',
 parser.add_argument('--study_list',
                     required=True,
                     help='Path to the CSV file containing the list of studies to process.')
-
-def clean_csv(file_name, pattern_str):
-    # Compile the pattern to remove
-    pattern = re.compile(pattern_str)
-
-    # Read the input CSV file into memory
-    with open(file_name, 'r') as infile:
-        reader = csv.reader(infile)
-        rows = list(reader)
-
-    # Process the rows
-    cleaned_rows = [['Report Impression']]
-    for row in rows:
-        # Combine the row into a single string and remove the pattern
-        cleaned_text = re.sub(pattern, '', ','.join(row))
-        cleaned_rows.append([cleaned_text])
-
-    # Write the cleaned rows back to the same file
-    with open(file_name, 'w', newline='') as outfile:
-        writer = csv.writer(outfile)
-        writer.writerows(cleaned_rows)
-
-def list_rindex(l, s):
-    """Helper function: *last* matching element in a list"""
-    return len(l) - l[-1::-1].index(s) - 1
-
+parser.add_argument('--workers', type=int, default=1,
+                    help='Number of processes used to read and section reports.')
+parser.add_argument('--chunksize', type=int, default=64,
+                    help='Number of reports sent to a worker at a time.')
+parser.add_argument('--prefetch', type=int, default=0,
+                    help=('Number of threads reading reports ahead,'
+                          ' when not using --workers.'))
+parser.add_argument('--manifest',
+                    help=('Path to a manifest of extracted sections, used to'
+                          ' skip reading reports which are unchanged since a'
+                          ' previous or interrupted run. The outputs are still'
+                          ' written in full.'))
+parser.add_argument('--compression', default='none',
+                    choices=sorted(ow.COMPRESSION_SUFFIXES),
+                    help='Compression of the output CSV files.')
+parser.add_argument('--dedup', action='store_true',
+                    help=('Also write each distinct text once to a *_unique.csv'
+                          ' file, with a *_map.csv from studies to texts.'))
+parser.add_argument('--shard_rows', type=int, default=10000,
+                    help='Maximum number of reports per batched CSV file.')
+parser.add_argument('--shard_bytes', type=int,
+                    help='Maximum size in bytes of each batched CSV file.')
+parser.add_argument('--shard_workers', type=int, default=4,
+                    help='Number of threads writing batched CSV files.')
+parser.add_argument('--sections_parquet',
+                    help=('Path to a Parquet file to write the sections of'
+                          ' each study to.'))
+parser.add_argument('--row_group_size', type=int, default=10000,
+                    help='Number of studies per Parquet row group.')
 
 def main(args):
     args = parser.parse_args(args)
@@ -60,10 +64,6 @@ def main(args):
     if not output_path.exists():
         output_path.mkdir()
 
-    # not all reports can be automatically sectioned
-    # we load in some dictionaries which have manually determined sections
-    custom_section_names, custom_indices = sp.custom_mimic_cxr_rules()
-
     # Read the study list CSV
     study_list = {}
     with open(study_list_path, 'r') as csvfile:
@@ -71,107 +71,51 @@ def main(args):
         for row in reader:
             study_list[row['path']] = row
 
-    # patient_studies will hold the text for use in NLP labeling
-    patient_studies = []
-
-    # study_sections will have an element for each study
-    # this element will be a list, each element having text for a specific section
-    study_sections = []
-
-    # Iterate over the study list
-    for path, study_info in tqdm(study_list.items()):
-        report_path = reports_path / Path(path)
-
-        # Load in the free-text report
-        with open(report_path, 'r') as fp:
-            text = ''.join(fp.readlines())
-
-        # Get study string name without the txt extension
-        s_stem = report_path.stem
-
-        # Custom rules for some poorly formatted reports
-        if s_stem in custom_indices:
-            idx = custom_indices[s_stem]
-            patient_studies.append([s_stem, text[idx[0]:idx[1]]])
-            continue
-
-        # Split text into sections
-        sections, section_names, section_idx = sp.section_text(text)
-
-        # Check to see if this has mis-named sections
-        # e.g. sometimes the impression is in the comparison section
-        if s_stem in custom_section_names:
-            sn = custom_section_names[s_stem]
-            idx = list_rindex(section_names, sn)
-            patient_studies.append([s_stem, sections[idx].strip()])
-            continue
-
-        # Grab the *last* section with the given title
-        # prioritizes impression > findings, etc.
-        idx = -1
-        for sn in ('impression', 'findings', 'last_paragraph', 'comparison'):
-            if sn in section_names:
-                idx = list_rindex(section_names, sn)
-                break
-
-        if idx == -1:
-            # We didn't find any sections we can use :(
-            patient_studies.append([s_stem, ''])
-            print(f'no impression/findings: {report_path}')
-        else:
-            # Store the text of the conclusion section
-            patient_studies.append([s_stem, sections[idx].strip()])
-
-        study_sectioned = [s_stem]
-        for sn in ('impression', 'findings', 'last_paragraph', 'comparison'):
-            if sn in section_names:
-                idx = list_rindex(section_names, sn)
-                study_sectioned.append(sections[idx].strip())
-            else:
-                study_sectioned.append(None)
-        study_sections.append(study_sectioned)
-
-    # Write distinct files to facilitate modular processing
-    if len(patient_studies) > 0:
-        # Write out a single CSV with the sections
-        # with open(output_path / 'mimic_cxr_sectioned.csv', 'w') as fp:
-        #     csvwriter = csv.writer(fp)
-        #     # Write header
-        #     csvwriter.writerow(['study', 'impression', 'findings',
-        #                         'last_paragraph', 'comparison'])
-        #     for row in study_sections:
-        #         csvwriter.writerow(row)
-
-        # if args.no_split:
-        #     # Write all the reports out to a single file
-        #     with open(output_path / f'input_chexbert.csv', 'w') as fp:
-        #         csvwriter = csv.writer(fp)
-        #         for row in patient_studies:
-        #             csvwriter.writerow(row)
-
+    # Rows are written as each report is extracted, and every writer is
+    # closed, or left incomplete, even if extraction fails
+    with ExitStack() as stack:
         if args.no_split:
-                # Write all the reports out to a single file
-                output_file = output_path / 'input_chexbert.csv'
-                with open(output_file, 'w', newline='') as fp:
-                    csvwriter = csv.writer(fp)
-                    for row in patient_studies:
-                        csvwriter.writerow(row)
-
-                # Clean the output CSV file
-                clean_csv(output_file, r'^s\d+,')
-
+            # Write all the reports out to a single file,
+            # with only the text to label under the header the labeller expects
+            writer = stack.enter_context(ow.CSVRowWriter(
+                output_path, 'input_chexbert.csv',
+                header=['Report Impression'], compression=args.compression))
         else:
-            # Write ~22 files with ~10k reports each
-            n = 0
-            jmp = 10000
+            # Write ~22 files with ~10k reports each, listed in shards.json
+            writer = stack.enter_context(ow.ShardedCSVWriter(
+                output_path, 'mimic_cxr_{:02d}.csv',
+                shard_rows=args.shard_rows, shard_bytes=args.shard_bytes,
+                compression=args.compression, workers=args.shard_workers))
+
+        # study_sections will have a row for each study
+        # each row having the text for a specific section
+        if args.sections_parquet is not None:
+            sections_writer = stack.enter_context(SectionsParquetWriter(
+                args.sections_parquet, row_group_size=args.row_group_size))
+        else:
+            sections_writer = None
 
-            while n < len(patient_studies):
-                n_fn = n // jmp
-                with open(output_path / f'mimic_cxr_{n_fn:02d}.csv', 'w') as fp:
-                    csvwriter = csv.writer(fp)
-                    for row in patient_studies[n:n+jmp]:
-                        csvwriter.writerow(row)
-                n += jmp
+        # Each distinct text is also written once, for labelling
+        if args.dedup:
+            dedup_writer = stack.enter_context(ow.UniqueTextWriter(
+                output_path, 'input_chexbert',
+                header=['Report Impression'], compression=args.compression))
+        else:
+            dedup_writer = None
+
+        # Iterate over the study list
+        for s_stem, impression, study_sectioned in rx.extract_reports(
+                reports_path, study_list, workers=args.workers,
+                chunksize=args.chunksize, manifest_path=args.manifest,
+                prefetch=args.prefetch):
+            if args.no_split:
+                writer.writerow([impression])
+            else:
+                writer.writerow([s_stem, impression])
+            if dedup_writer is not None:
+                dedup_writer.writerow(s_stem, impression)
+            if sections_writer is not None and study_sectioned is not None:
+                sections_writer.writerow(study_sectioned)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,337 @@
+import sys
+import argparse
+import csv
+import re
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+# local folder import
+import output_writers as ow
+
+# MIMIC wraps report lines with a newline and a leading space
+_P_WHITESPACE = re.compile(r'\s+')
+# de-identified spans, e.g. ___ or ____
+_P_PLACEHOLDER = re.compile(r'_{2,}')
+_P_PUNCTUATION = re.compile(r'[^\w\s]')
+
+# multiply-shift hashing, all arithmetic is modulo 2**64
+_MASK32 = np.uint64(0xFFFFFFFF)
+_SHIFT32 = np.uint64(32)
+
+
+def canonical_text(text):
+    """Canonical form of a text for near-duplicate detection.
+
+    Lower case, with de-identification placeholders replaced by a single
+    token, punctuation dropped and all whitespace, including the wrapped
+    line breaks, collapsed to single spaces.
+    """
+    text = _P_PLACEHOLDER.sub(' deid ', text.lower())
+    text = _P_PUNCTUATION.sub(' ', text)
+    return _P_WHITESPACE.sub(' ', text).strip()
+
+
+def lsh_params(num_perm, threshold):
+    """Bands and rows per band whose LSH S-curve crosses closest to threshold.
+
+    Pairs with Jaccard similarity s share at least one band with
+    probability 1 - (1 - s**rows)**bands, which rises most steeply near
+    (1 / bands) ** (1 / rows).
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHasher:
+    """MinHash signatures of word shingles, computed in batches with numpy.
+
+    Each word is hashed to 32 bits once, shingles of shingle_size words are
+    hashed by combining their word hashes, and each of the num_perm hash
+    functions is a multiply-shift hash of the shingle hashes.
+    """
+
+    def __init__(self, num_perm=128, shingle_size=3, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # odd multipliers and 64-bit offsets, one per hash function
+        self.a = rng.randint(0, 2 ** 62, num_perm, dtype=np.int64) \
+            .astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.randint(0, 2 ** 62, num_perm, dtype=np.int64) \
+            .astype(np.uint64)
+        self.shingle_mult = rng.randint(0, 2 ** 62, shingle_size,
+                                        dtype=np.int64) \
+            .astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.word_hashes = {}
+
+    def _words(self, text):
+        hashes = self.word_hashes
+        ids = []
+        for word in text.split():
+            h = hashes.get(word)
+            if h is None:
+                h = hashes[word] = zlib.crc32(word.encode('utf-8'))
+            ids.append(h)
+        return ids
+
+    def _shingles(self, texts):
+        """Shingle hashes of all texts, concatenated, and each text's count."""
+        k = self.shingle_size
+        all_words = []
+        starts = []
+        counts = []
+        for text in texts:
+            words = self._words(text)
+            if not words:
+                # a single shingle, shared by every empty text
+                words = [0]
+            # texts shorter than a shingle are a single shorter shingle
+            n_shingles = max(len(words) - k + 1, 1)
+            starts.append(len(all_words))
+            counts.append(n_shingles)
+            all_words.extend(words)
+            # pad, so that every shingle has k words
+            all_words.extend([0] * (k - 1))
+
+        words = np.array(all_words, dtype=np.uint64)
+        counts = np.array(counts, dtype=np.int64)
+        # index of the first word of every shingle
+        first = np.repeat(np.array(starts, dtype=np.int64) - np.cumsum(counts)
+                          + counts, counts) + np.arange(counts.sum())
+        shingles = np.zeros(len(first), dtype=np.uint64)
+        for j in range(k):
+            shingles += words[first + j] * self.shingle_mult[j]
+        return shingles >> _SHIFT32, counts
+
+    def signatures(self, texts, perm_block=16):
+        """num_perm uint32 MinHash values for each text, as a 2D array."""
+        shingles, counts = self._shingles(texts)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sig = np.empty((len(counts), self.num_perm), dtype=np.uint32)
+        for p in range(0, self.num_perm, perm_block):
+            a = self.a[p:p + perm_block, None]
+            b = self.b[p:p + perm_block, None]
+            hashed = ((shingles[None, :] ^ b) * a) >> _SHIFT32
+            sig[:, p:p + perm_block] = \
+                np.minimum.reduceat(hashed, offsets, axis=1).T
+        return sig
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def cluster_signatures(sig, threshold, bands, rows, batch_size=100000):
+    """Cluster id of each signature, grouping those estimated to be at
+    least threshold similar.
+
+    In each band, every signature is compared to the first signature of
+    its LSH bucket, and merged with it when the fraction of equal MinHash
+    values reaches threshold. Clusters are the connected components of
+    these merges, numbered in order of their first member.
+    """
+    n = len(sig)
+    parent = list(range(n))
+    rng = np.random.RandomState(0)
+    mult = rng.randint(0, 2 ** 62, rows, dtype=np.int64) \
+        .astype(np.uint64) * np.uint64(2) + np.uint64(1)
+
+    for band in range(bands):
+        # bucket key of each signature in this band
+        keys = (sig[:, band * rows:(band + 1) * rows].astype(np.uint64)
+                * mult).sum(axis=1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        new_bucket = np.ones(n, dtype=bool)
+        new_bucket[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        leaders = order[np.flatnonzero(new_bucket)[np.cumsum(new_bucket) - 1]]
+
+        candidates = np.flatnonzero(leaders != order)
+        for start in range(0, len(candidates), batch_size):
+            idx = candidates[start:start + batch_size]
+            members, heads = order[idx], leaders[idx]
+            similarity = (sig[members] == sig[heads]).mean(axis=1)
+            for i, j in zip(members[similarity >= threshold],
+                            heads[similarity >= threshold]):
+                ri, rj = _find(parent, i), _find(parent, j)
+                if ri != rj:
+                    parent[max(ri, rj)] = min(ri, rj)
+
+    roots = [_find(parent, i) for i in range(n)]
+    cluster_ids = {}
+    return np.array([cluster_ids.setdefault(r, len(cluster_ids))
+                     for r in roots], dtype=np.int64)
+
+
+def split_chained(sig, cluster, leaders, threshold, batch_size=100000):
+    """Cluster ids with every member at least threshold similar to the
+    leader of its cluster.
+
+    cluster_signatures merges transitively, so a cluster can chain
+    signatures which are not similar to each other. leaders holds the
+    index of the signature representing each cluster, and members
+    estimated to be less than threshold similar to it are split off into
+    clusters of their own. Clusters are renumbered in order of their
+    first member.
+    """
+    cluster = cluster.copy()
+    similarity = np.empty(len(sig))
+    for start in range(0, len(sig), batch_size):
+        heads = leaders[cluster[start:start + batch_size]]
+        similarity[start:start + batch_size] = \
+            (sig[start:start + batch_size] == sig[heads]).mean(axis=1)
+    split = np.flatnonzero(similarity < threshold)
+    cluster[split] = cluster.max() + 1 + np.arange(len(split))
+
+    _, first, inverse = np.unique(cluster, return_index=True,
+                                  return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    return order[inverse]
+
+
+def representatives(texts, text_cluster, text_counts):
+    """The most frequent text of each cluster, by cluster id."""
+    representative = {}
+    for text, cluster in zip(texts, text_cluster):
+        best = representative.get(cluster)
+        if best is None or text_counts[text] > text_counts[best]:
+            representative[cluster] = text
+    return representative
+
+
+def read_studies(input_files):
+    """(study, text) rows of generator output, e.g. input_chexpert.csv or
+    the batched mimic_cxr_*.csv files."""
+    for input_file in input_files:
+        with open(input_file, 'r', newline='') as fp:
+            for row in csv.reader(fp):
+                yield row[0], row[1]
+
+
+parser = argparse.ArgumentParser(description=(
+    'Cluster near-duplicate impressions, so that each cluster is only'
+    ' labelled once.'))
+parser.add_argument('--input_files', nargs='+', required=True,
+                    help=('Generator output with [study, text] rows, e.g.'
+                          ' input_chexpert.csv or mimic_cxr_*.csv.'))
+parser.add_argument('--output_path', required=True,
+                    help='Output folder for the unique and map files.')
+parser.add_argument('--stem', default='input_near',
+                    help='Output files are <stem>_unique.csv and <stem>_map.csv.')
+parser.add_argument('--format', default='chexbert',
+                    choices=['chexbert', 'chexpert'],
+                    help='Labeller input format of the unique file.')
+parser.add_argument('--threshold', type=float, default=0.9,
+                    help='Estimated Jaccard similarity to merge two texts.')
+parser.add_argument('--num_perm', type=int, default=128,
+                    help='Number of MinHash values per text.')
+parser.add_argument('--shingle_size', type=int, default=3,
+                    help='Number of words per shingle.')
+parser.add_argument('--batch_size', type=int, default=10000,
+                    help='Number of texts hashed at a time.')
+parser.add_argument('--clusters_file',
+                    help=('Optional CSV listing the cluster of each distinct'
+                          ' text, for review.'))
+
+
+def main(args):
+    """Writes labeller input with one representative text per cluster of
+    near-duplicates, and a map from studies to them.
+
+    Texts are first grouped by their canonical form, then the canonical
+    forms are clustered with MinHash/LSH. Each cluster is represented by
+    its most frequent text, and members which are not estimated to be
+    threshold similar to it are split off, see split_chained. The outputs
+    have the format of output_writers.UniqueTextWriter, so labels are
+    copied back to every study with fan_out_labels.py. Pass it the input
+    file and --text_column, so that each study keeps its own text next
+    to the labels of its representative.
+    """
+    args = parser.parse_args(args)
+    output_path = Path(args.output_path)
+    if not output_path.exists():
+        output_path.mkdir(parents=True)
+
+    studies = list(read_studies(args.input_files))
+    text_counts = Counter(text for _, text in studies)
+    texts = list(text_counts)
+
+    # exact duplicates after normalization
+    canonical_ids = {}
+    text_canonical = [canonical_ids.setdefault(canonical_text(t),
+                                               len(canonical_ids))
+                      for t in texts]
+    canonicals = list(canonical_ids)
+
+    hasher = MinHasher(args.num_perm, args.shingle_size)
+    sig = np.empty((len(canonicals), args.num_perm), dtype=np.uint32)
+    for start in range(0, len(canonicals), args.batch_size):
+        sig[start:start + args.batch_size] = hasher.signatures(
+            canonicals[start:start + args.batch_size])
+
+    bands, rows = lsh_params(args.num_perm, args.threshold)
+    canonical_cluster = cluster_signatures(sig, args.threshold, bands, rows)
+
+    # the most frequent text of each cluster labels the whole cluster,
+    # so every member must be similar to it
+    representative = representatives(
+        texts, canonical_cluster[text_canonical], text_counts)
+    leaders = np.empty(len(representative), dtype=np.int64)
+    for cluster, text in representative.items():
+        leaders[cluster] = canonical_ids[canonical_text(text)]
+    n_split = len(representative)
+    canonical_cluster = split_chained(sig, canonical_cluster, leaders,
+                                      args.threshold)
+    text_cluster = canonical_cluster[text_canonical]
+    representative = representatives(texts, text_cluster, text_counts)
+    n_split = len(representative) - n_split
+
+    text_representative = dict(zip(texts, (representative[c]
+                                            for c in text_cluster)))
+
+    if args.format == 'chexbert':
+        writer = ow.UniqueTextWriter(output_path, args.stem,
+                                     header=['Report Impression'])
+    else:
+        writer = ow.UniqueTextWriter(output_path, args.stem, with_id=True)
+    with writer:
+        for s_stem, text in studies:
+            writer.writerow(s_stem, text_representative[text])
+
+    if args.clusters_file is not None:
+        with open(args.clusters_file, 'w', newline='') as fp:
+            csvwriter = csv.writer(fp, lineterminator='\n')
+            csvwriter.writerow(['cluster', 'studies', 'representative', 'text'])
+            for text, cluster in sorted(zip(texts, text_cluster),
+                                        key=lambda x: x[1]):
+                csvwriter.writerow([cluster, text_counts[text],
+                                    int(representative[cluster] == text), text])
+
+    # How much labelling is saved
+    n_clusters = len(representative)
+    sizes = Counter(text_cluster.tolist())
+    print(f'LSH with {bands} bands of {rows} rows, threshold {args.threshold}.')
+    print(f'{len(studies)} studies, {len(texts)} distinct texts,'
+          f' {len(canonicals)} after normalization, {n_clusters} clusters,'
+          f' {n_split} of them split off chained clusters.')
+    print(f'Texts to label: {n_clusters}, {n_clusters / len(studies):.1%} of'
+          f' studies, {n_clusters / len(texts):.1%} of distinct texts.')
+    print(f'Largest clusters (distinct texts): '
+          f'{[size for _, size in sizes.most_common(5)]}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,274 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+COMPRESSION_SUFFIXES = {
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+def open_text(path, compression='none'):
+    """Opens path for writing CSV text, optionally compressed."""
+    if compression == 'none':
+        return open(path, 'w', newline='')
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', newline='')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression requires the zstandard package,'
+                              ' e.g. pip install zstandard')
+        fp = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+        return io.TextIOWrapper(fp, newline='')
+    raise ValueError(f'Unrecognized compression {compression}')
+
+
+class CSVRowWriter:
+    """Streams CSV rows to a single file.
+
+    Rows are written as they arrive, so memory use does not grow with the
+    number of rows. The header, if given, is written first. The file is
+    only created once it has a row.
+    """
+
+    def __init__(self, output_path, file_name, header=None,
+                 compression='none'):
+        self.path = output_path / (file_name +
+                                   COMPRESSION_SUFFIXES[compression])
+        self.header = header
+        self.compression = compression
+        self.fp = None
+        self.csvwriter = None
+
+    def writerow(self, row):
+        if self.fp is None:
+            self.fp = open_text(self.path, self.compression)
+            self.csvwriter = csv.writer(self.fp)
+            if self.header is not None:
+                self.csvwriter.writerow(self.header)
+        self.csvwriter.writerow(row)
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compress(data, compression='none'):
+    """Compresses bytes in memory, reproducibly for a given input."""
+    if compression == 'none':
+        return data
+    if compression == 'gzip':
+        buf = io.BytesIO()
+        # fixed mtime, so that the checksum only depends on the contents
+        with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as fp:
+            fp.write(data)
+        return buf.getvalue()
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression requires the zstandard package,'
+                              ' e.g. pip install zstandard')
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError(f'Unrecognized compression {compression}')
+
+
+def _write_shard(path, text, compression):
+    """Writes one shard atomically, returning its size and checksum."""
+    data = compress(text.encode('utf-8'), compression)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as fp:
+        fp.write(data)
+    os.replace(tmp_path, path)
+    return len(data), hashlib.sha256(data).hexdigest()
+
+
+class ShardedCSVWriter:
+    """Streams CSV rows into numbered shards, written in parallel.
+
+    A new shard is started once the current one has shard_rows rows, or
+    once adding a row would take it over shard_bytes bytes of CSV text.
+    file_name must contain a format field for the shard number, e.g.
+    'mimic_cxr_{:02d}.csv'. The first column of each row is taken to be
+    the study id.
+
+    Complete shards are encoded, compressed, checksummed and written by a
+    pool of `workers` threads, with at most 2 * workers shards held in
+    memory. On close, a JSON manifest listing each shard's file, row
+    range, study id range, size and sha256 checksum is written to
+    output_path / manifest_name, so shards can be consumed and verified
+    independently.
+
+    Shards and the manifest left in output_path by a previous run are
+    removed when the writer is created, and the manifest is written
+    atomically, last. When the writer is left with an exception, no
+    manifest is written, so a missing manifest marks an incomplete run.
+    """
+
+    def __init__(self, output_path, file_name, shard_rows=10000,
+                 shard_bytes=None, compression='none', workers=4,
+                 manifest_name='shards.json'):
+        self.output_path = output_path
+        self.file_name = file_name
+        self.shard_rows = shard_rows
+        self.shard_bytes = shard_bytes
+        self.compression = compression
+        self.manifest_name = manifest_name
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers)
+        self.futures = []
+        self.shards = []
+        self.n_rows = 0
+        # each row is encoded on its own, to measure its size
+        self.line_buf = io.StringIO()
+        self.line_writer = csv.writer(self.line_buf)
+        # the shard being filled
+        self.lines = []
+        self.rows = []
+        self.n_bytes = 0
+        self._remove_stale()
+
+    def _remove_stale(self):
+        """Removes the manifest and the shards of a previous run, which
+        may have had more shards or a different compression."""
+        before, _, after = re.split(r'(\{[^}]*\})', self.file_name, 1)
+        p_shard = re.compile(re.escape(before) + r'\d+' + re.escape(after) +
+                             r'(\.gz|\.zst)?(\.tmp)?$')
+        for path in [self.output_path / self.manifest_name] + [
+                path for path in self.output_path.iterdir()
+                if p_shard.match(path.name)]:
+            if path.exists():
+                path.unlink()
+
+    def writerow(self, row):
+        self.line_buf.seek(0)
+        self.line_buf.truncate()
+        self.line_writer.writerow(row)
+        line = self.line_buf.getvalue()
+        row_bytes = len(line.encode('utf-8'))
+
+        if self.rows and (
+                len(self.rows) == self.shard_rows or
+                (self.shard_bytes is not None and
+                 self.n_bytes + row_bytes > self.shard_bytes)):
+            self._flush()
+
+        self.lines.append(line)
+        self.rows.append(row[0])
+        self.n_bytes += row_bytes
+
+    def _flush(self):
+        n_shard = len(self.shards)
+        path = self.output_path / (self.file_name.format(n_shard) +
+                                   COMPRESSION_SUFFIXES[self.compression])
+        self.shards.append({
+            'file': path.name,
+            'rows': [self.n_rows, self.n_rows + len(self.rows)],
+            'min_study': min(self.rows),
+            'max_study': max(self.rows),
+        })
+        self.futures.append(self.executor.submit(
+            _write_shard, path, ''.join(self.lines), self.compression))
+        self.n_rows += len(self.rows)
+
+        # bound the number of shards held in memory
+        pending = [f for f in self.futures if not f.done()]
+        if len(pending) >= 2 * self.workers:
+            pending[0].result()
+
+        self.lines = []
+        self.rows = []
+        self.n_bytes = 0
+
+    def close(self, complete=True):
+        """Writes the last shard and the manifest. With complete False,
+        e.g. after an error, only waits for the shards being written."""
+        if self.executor is None:
+            return
+        if not complete:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+            return
+
+        if self.rows:
+            self._flush()
+        for shard, future in zip(self.shards, self.futures):
+            shard['bytes'], shard['sha256'] = future.result()
+        self.executor.shutdown()
+        self.executor = None
+
+        if self.shards:
+            manifest = {
+                'compression': self.compression,
+                'total_rows': self.n_rows,
+                'shards': self.shards,
+            }
+            path = self.output_path / self.manifest_name
+            tmp_path = path.with_name(path.name + '.tmp')
+            with open(tmp_path, 'w') as fp:
+                json.dump(manifest, fp, indent=2)
+            os.replace(tmp_path, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(complete=exc[0] is None)
+
+
+class UniqueTextWriter:
+    """Streams labeller input with each distinct text written only once.
+
+    Writes two files:
+        <stem>_unique.csv - each distinct text, in order of first
+            appearance, as [text] under header (if given), or as
+            [text_id, text] rows when with_id is set
+        <stem>_map.csv - [study, text_id] for every study, in input order,
+            where text_id is the row of the study's text in the unique file
+
+    Labelling the unique file and fanning the labels out with the map
+    (see fan_out_labels.py) gives the same per-study labels as labelling
+    every study, while only labelling each text once.
+    """
+
+    def __init__(self, output_path, stem, header=None, with_id=False,
+                 compression='none'):
+        self.unique = CSVRowWriter(output_path, f'{stem}_unique.csv',
+                                   header=header, compression=compression)
+        self.map = CSVRowWriter(output_path, f'{stem}_map.csv',
+                                header=['study', 'text_id'],
+                                compression=compression)
+        self.with_id = with_id
+        self.text_ids = {}
+
+    def writerow(self, s_stem, text):
+        text_id = self.text_ids.get(text)
+        if text_id is None:
+            text_id = self.text_ids[text] = len(self.text_ids)
+            self.unique.writerow([text_id, text] if self.with_id else [text])
+        self.map.writerow([s_stem, text_id])
+
+    def close(self):
+        self.unique.close()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,196 @@
+import json
+from multiprocessing import Pool
+from pathlib import Path
+
+from tqdm import tqdm
+
+# local folder import
+import section_parser as sp
+import report_source as rs
+from report_manifest import ReportManifest, content_hash
+
+# sections used for labelling, in order of priority
+SECTION_ORDER = ('impression', 'findings', 'last_paragraph', 'comparison')
+
+# not all reports can be automatically sectioned
+# we load in some dictionaries which have manually determined sections
+custom_section_names, custom_indices = sp.custom_mimic_cxr_rules()
+
+# text extracted under other rules is not reused from a manifest
+RULES_HASH = content_hash(json.dumps(
+    [SECTION_ORDER, custom_section_names, custom_indices], sort_keys=True))
+
+
+def list_rindex(l, s):
+    """Helper function: *last* matching element in a list"""
+    return len(l) - l[-1::-1].index(s) - 1
+
+
+def extract_report(s_stem, text, spans=None):
+    """Extracts the text to label from a single report.
+
+    spans are the section spans of text, see section_parser.section_spans.
+    They are computed if not given.
+
+    Returns a two element tuple:
+        impression - text of the section used for labelling, '' if the
+            report has none of the sections in SECTION_ORDER
+        study_sectioned - [s_stem] followed by the text of each section in
+            SECTION_ORDER (None where missing), or None if the report was
+            handled by one of the custom rules
+    """
+    # Custom rules for some poorly formatted reports
+    if s_stem in custom_indices:
+        idx = custom_indices[s_stem]
+        return text[idx[0]:idx[1]], None
+
+    # Split text into sections
+    if spans is None:
+        spans = sp.section_spans(text)
+    section_names = [name for name, _, _ in spans]
+
+    def section(idx):
+        _, start, end = spans[idx]
+        return text[start:end].strip()
+
+    # Check to see if this has mis-named sections
+    # e.g. sometimes the impression is in the comparison section
+    if s_stem in custom_section_names:
+        sn = custom_section_names[s_stem]
+        return section(list_rindex(section_names, sn)), None
+
+    study_sectioned = [s_stem]
+    for sn in SECTION_ORDER:
+        if sn in section_names:
+            study_sectioned.append(section(list_rindex(section_names, sn)))
+        else:
+            study_sectioned.append(None)
+
+    # Grab the *last* section with the given title
+    # prioritizes impression > findings, etc.
+    impression = next((s for s in study_sectioned[1:] if s is not None), '')
+
+    return impression, study_sectioned
+
+
+# the report source of this process, see _init_source
+_source = None
+
+
+def _init_source(source):
+    global _source
+    _source = source
+
+
+def _extract_path(job):
+    path, cached, text = job
+    if text is None:
+        text = _source.read(path)
+
+    if cached is None:
+        # no manifest
+        digest, spans = None, None
+    else:
+        digest = content_hash(text)
+        spans = cached[1] if cached[0] == digest else None
+
+    if spans is None:
+        spans = sp.section_spans(text)
+
+    impression, study_sectioned = extract_report(Path(path).stem, text, spans)
+    return impression, study_sectioned, digest, spans
+
+
+def extract_reports(reports_path, paths, workers=1, chunksize=64,
+                    manifest_path=None, commit_every=1000, prefetch=0):
+    """Reads and extracts each report in paths, relative to reports_path.
+
+    reports_path is either the folder of reports, or a .zip or .tar
+    archive of them, see report_source.open_source.
+
+    With workers > 1, reports are read and sectioned in a process pool,
+    in chunks of chunksize reports. Otherwise, with prefetch > 0, reports
+    are read ahead by that many threads. Either way, results are yielded
+    in the order of paths as (s_stem, impression, study_sectioned) tuples,
+    see extract_report.
+
+    With a manifest_path, the extracted text of each report is cached in
+    a ReportManifest, committed every commit_every reports. On a rerun:
+
+    - reports whose size and modification time match the manifest, with
+      the same parser version and extraction rules, are not read at all,
+      their extracted text comes from the manifest
+    - other reports are read and hashed, and those whose content hash
+      matches are not sectioned again
+    - new or changed reports are read and sectioned
+
+    so an interrupted run resumes from its last committed chunk without
+    reading what it already extracted. Every report is still yielded, and
+    the outputs are written again in full.
+    """
+    reports_path = Path(reports_path)
+    paths = list(paths)
+    source = rs.open_source(reports_path)
+
+    if manifest_path is not None:
+        manifest = ReportManifest(manifest_path)
+        known = manifest.load(sp.PARSER_VERSION)
+        stats = [source.stat(path) for path in paths]
+        # ('', None) never matches a hash, so the report is sectioned
+        cached = [known.get(str(path), ('', None, None, None))
+                  for path in paths]
+        unchanged = [c[2] is not None and tuple(c[2]) == stat and
+                     c[3] == RULES_HASH for c, stat in zip(cached, stats)]
+    else:
+        manifest = None
+        stats = [None] * len(paths)
+        cached = [None] * len(paths)
+        unchanged = [False] * len(paths)
+
+    # only reports which may have changed are read
+    to_read = [(path, c) for path, c, u in zip(paths, cached, unchanged)
+               if not u]
+
+    if workers > 1:
+        # each worker reads its own reports
+        pool = Pool(workers, initializer=_init_source, initargs=(source,))
+        jobs = [(path, c, None) for path, c in to_read]
+        results = pool.imap(_extract_path, jobs, chunksize=chunksize)
+    else:
+        pool = None
+        _init_source(source)
+        if prefetch > 0:
+            texts = rs.prefetch(source, [path for path, _ in to_read],
+                                threads=prefetch)
+        else:
+            texts = [None] * len(to_read)
+        jobs = ((path, c, text) for (path, c), text in zip(to_read, texts))
+        results = map(_extract_path, jobs)
+
+    try:
+        for i, path in enumerate(tqdm(paths)):
+            if unchanged[i]:
+                impression, study_sectioned = manifest.extracted(path)
+            else:
+                impression, study_sectioned, digest, spans = next(results)
+                if manifest is not None:
+                    manifest.add(path, digest, sp.PARSER_VERSION, spans,
+                                 stats[i], RULES_HASH,
+                                 (impression, study_sectioned))
+            if manifest is not None and (i + 1) % commit_every == 0:
+                manifest.commit()
+
+            s_stem = Path(path).stem
+            if study_sectioned is not None and \
+                    all(s is None for s in study_sectioned[1:]):
+                # We didn't find any sections we can use :(
+                print(f'no impression/findings: {reports_path / Path(path)}')
+            yield s_stem, impression, study_sectioned
+
+        if manifest is not None:
+            manifest.commit()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if manifest is not None:
+            manifest.close()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import sqlite3
+
+# columns added after the first version of the manifest
+_NEW_COLUMNS = (('size', 'INTEGER'), ('mtime_ns', 'INTEGER'),
+                ('rules_hash', 'TEXT'), ('extracted', 'TEXT'))
+
+
+def content_hash(text):
+    """Hash of a report's text, used to detect changed reports."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ReportManifest:
+    """Persistent record of the section spans extracted from each report.
+
+    Entries are keyed by the report path relative to the reports folder,
+    and store the content hash of the report, the parser version used and
+    the section spans, see section_parser.section_spans. They also store
+    the size and modification time of the report file, and the text
+    extracted from it along with a hash of the extraction rules, so that
+    an unchanged report does not need to be read at all. Entries are
+    staged with `add` and written in a single SQLite transaction by
+    `commit`, so an interrupted run leaves the manifest as of the last
+    committed chunk.
+    """
+
+    def __init__(self, manifest_path):
+        self.conn = sqlite3.connect(str(manifest_path))
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS reports ('
+                ' path TEXT PRIMARY KEY,'
+                ' content_hash TEXT NOT NULL,'
+                ' parser_version INTEGER NOT NULL,'
+                ' spans TEXT NOT NULL)'
+            )
+            # manifests of older runs only have the columns above
+            columns = {row[1] for row in
+                       self.conn.execute('PRAGMA table_info(reports)')}
+            for name, kind in _NEW_COLUMNS:
+                if name not in columns:
+                    self.conn.execute(
+                        f'ALTER TABLE reports ADD COLUMN {name} {kind}')
+        self.pending = []
+
+    def load(self, parser_version):
+        """Returns {path: (content_hash, spans, stat, rules_hash)} for
+        entries which were extracted with the given parser version.
+
+        stat is the (size, mtime_ns) of the report when it was extracted,
+        or None for entries of older manifests, which also have no
+        extracted text.
+        """
+        entries = {}
+        cursor = self.conn.execute(
+            'SELECT path, content_hash, spans, size, mtime_ns, rules_hash'
+            ' FROM reports WHERE parser_version = ?', (parser_version,))
+        for path, digest, spans, size, mtime_ns, rules_hash in cursor:
+            stat = (size, mtime_ns) if size is not None else None
+            entries[path] = (digest, [tuple(s) for s in json.loads(spans)],
+                             stat, rules_hash)
+        return entries
+
+    def extracted(self, path):
+        """The (impression, study_sectioned) stored for path."""
+        row = self.conn.execute(
+            'SELECT extracted FROM reports WHERE path = ?',
+            (str(path),)).fetchone()
+        impression, study_sectioned = json.loads(row[0])
+        return impression, study_sectioned
+
+    def add(self, path, digest, parser_version, spans, stat=None,
+            rules_hash=None, extracted=None):
+        size, mtime_ns = stat if stat is not None else (None, None)
+        self.pending.append((str(path), digest, parser_version,
+                             json.dumps(spans), size, mtime_ns, rules_hash,
+                             json.dumps(extracted)
+                             if extracted is not None else None))
+
+    def commit(self):
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO reports'
+                ' (path, content_hash, parser_version, spans,'
+                '  size, mtime_ns, rules_hash, extracted)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self.pending)
+        self.pending = []
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,219 @@
+import io
+import json
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# bump when the index layout changes
+INDEX_VERSION = 1
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4s2x2xH4x4x4x4xHH')
+
+
+def decode_report(data):
+    """Decodes report bytes exactly as reading the file in text mode would,
+    with the default encoding and universal newlines."""
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+class DirectorySource:
+    """Reports unpacked under a folder, e.g. /data/mimic-cxr/2.0.0."""
+
+    def __init__(self, reports_path):
+        self.reports_path = Path(reports_path)
+
+    def clone(self):
+        return self
+
+    def read(self, path):
+        # Load in the free-text report
+        with open(self.reports_path / Path(path), 'r') as fp:
+            return fp.read()
+
+    def stat(self, path):
+        """(size, mtime_ns) of a report, to tell if it changed."""
+        st = os.stat(str(self.reports_path / Path(path)))
+        return st.st_size, st.st_mtime_ns
+
+
+class _ArchiveSource:
+    """Reports read by seeking into an archive, using a member index.
+
+    The index maps each member's path to where its data is stored. It is
+    built on first use and saved next to the archive as
+    <archive>.index.json, and rebuilt whenever the archive's size or
+    modification time change. Paths are looked up relative to the folder
+    of the archive that holds them, e.g. files/p10/... may be stored as
+    mimic-cxr-reports/files/p10/...
+    """
+
+    def __init__(self, archive_path, index_path=None):
+        self.archive_path = Path(archive_path)
+        if index_path is None:
+            index_path = self.archive_path.with_name(
+                self.archive_path.name + '.index.json')
+        self.index_path = Path(index_path)
+        self.stamp = self._stamp()
+        self.members = self._load_index()
+        self.prefix = None
+        self.fp = None
+
+    def __getstate__(self):
+        # file handles are per process
+        state = self.__dict__.copy()
+        state['fp'] = None
+        return state
+
+    def clone(self):
+        """Copy sharing the index, with its own file handle."""
+        source = self.__class__.__new__(self.__class__)
+        source.__dict__.update(self.__getstate__())
+        return source
+
+    def _stamp(self):
+        st = os.stat(str(self.archive_path))
+        return {'version': INDEX_VERSION, 'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns}
+
+    def _load_index(self):
+        stamp = self.stamp
+        if self.index_path.exists():
+            with open(self.index_path, 'r') as fp:
+                index = json.load(fp)
+            if index['stamp'] == stamp:
+                return index['members']
+
+        members = self._build_index()
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump({'stamp': stamp, 'members': members}, fp)
+        os.replace(str(tmp_path), str(self.index_path))
+        return members
+
+    def _file(self):
+        if self.fp is None:
+            self.fp = open(self.archive_path, 'rb')
+        return self.fp
+
+    def _find_prefix(self, key):
+        """Folder of the archive that paths are relative to."""
+        if key in self.members:
+            return ''
+        for name in self.members:
+            if name.endswith('/' + key):
+                return name[:-len(key)]
+        return None
+
+    def read(self, path):
+        key = Path(path).as_posix()
+        if self.prefix is None:
+            self.prefix = self._find_prefix(key)
+        if self.prefix is None or self.prefix + key not in self.members:
+            raise FileNotFoundError(f'{path} not in {self.archive_path}')
+        return decode_report(self._read_member(self.members[self.prefix + key]))
+
+    def stat(self, path):
+        """(size, mtime_ns) of the archive, so reports are taken to have
+        changed whenever the archive does."""
+        return self.stamp['size'], self.stamp['mtime_ns']
+
+
+class ZipSource(_ArchiveSource):
+    """Reports read directly from a zip archive, e.g. mimic-cxr-reports.zip."""
+
+    def _build_index(self):
+        members = {}
+        with zipfile.ZipFile(str(self.archive_path)) as zf:
+            for info in zf.infolist():
+                if info.filename.endswith('/'):
+                    continue
+                if info.compress_type not in (zipfile.ZIP_STORED,
+                                              zipfile.ZIP_DEFLATED):
+                    raise ValueError(f'Unsupported compression for '
+                                     f'{info.filename} in {self.archive_path}')
+                members[info.filename] = [info.header_offset,
+                                          info.compress_type,
+                                          info.compress_size]
+        return members
+
+    def _read_member(self, member):
+        header_offset, compress_type, compress_size = member
+        fp = self._file()
+        fp.seek(header_offset)
+        signature, _, name_len, extra_len = _ZIP_LOCAL_HEADER.unpack(
+            fp.read(_ZIP_LOCAL_HEADER.size))
+        if signature != b'PK\x03\x04':
+            raise ValueError(f'Bad zip member header in {self.archive_path}')
+        fp.seek(name_len + extra_len, os.SEEK_CUR)
+        data = fp.read(compress_size)
+        if compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -15)
+        return data
+
+
+class TarSource(_ArchiveSource):
+    """Reports read directly from an uncompressed tar archive.
+
+    Compressed tar archives can not be read at random, so they need to be
+    decompressed to .tar first.
+    """
+
+    def _build_index(self):
+        members = {}
+        with tarfile.open(str(self.archive_path), 'r:') as tf:
+            for info in tf:
+                if info.isfile():
+                    members[info.name] = [info.offset_data, info.size]
+        return members
+
+    def _read_member(self, member):
+        offset, size = member
+        fp = self._file()
+        fp.seek(offset)
+        return fp.read(size)
+
+
+def open_source(reports_path):
+    """Report source for a folder of reports, or a .zip or .tar of them."""
+    reports_path = Path(reports_path)
+    if reports_path.is_dir():
+        return DirectorySource(reports_path)
+    if reports_path.suffix == '.zip':
+        return ZipSource(reports_path)
+    if reports_path.suffix == '.tar':
+        return TarSource(reports_path)
+    raise ValueError(f'{reports_path} is not a folder, .zip or .tar')
+
+
+def prefetch(source, paths, threads=4, window=256):
+    """Yields the text of each report in paths, in order, read ahead by a
+    pool of threads.
+
+    Each thread reads from its own clone of the source, and at most window
+    reports are read ahead of the consumer.
+    """
+    local = threading.local()
+
+    def read(path):
+        if not hasattr(local, 'source'):
+            local.source = source.clone()
+        return local.source.read(path)
+
+    paths = iter(paths)
+    pending = deque()
+    with ThreadPoolExecutor(threads) as executor:
+        for path in paths:
+            pending.append(executor.submit(read, path))
+            if len(pending) >= window:
+                break
+        while pending:
+            yield pending.popleft().result()
+            for path in paths:
+                pending.append(executor.submit(read, path))
+                break
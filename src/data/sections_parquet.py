@@ -0,0 +1,164 @@
+import sys
+import argparse
+import os
+
+SECTION_COLUMNS = ['impression', 'findings', 'last_paragraph', 'comparison']
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet output requires the pyarrow package,'
+                          ' e.g. pip install pyarrow')
+    return pyarrow
+
+
+def _schema(pa):
+    return pa.schema(
+        [('study_id', pa.int64()), ('study', pa.string())] +
+        [(c, pa.string()) for c in SECTION_COLUMNS] +
+        # name of the section used for labelling, one of SECTION_COLUMNS
+        [('label_section', pa.dictionary(pa.int8(), pa.string()))]
+    )
+
+
+class SectionsParquetWriter:
+    """Streams study_sections rows to a Parquet file.
+
+    Rows are [study, impression, findings, last_paragraph, comparison], as
+    built by report_extraction.extract_report. Each row also gets an
+    integer study_id, for range queries, and a dictionary-encoded
+    label_section column naming the section used for labelling.
+
+    Rows are spilled to <path>.unsorted.tmp as they arrive, in chunks of
+    row_group_size rows. On close, that file is sorted by study_id and
+    written to path in row groups of row_group_size rows, so each row
+    group covers a narrow study_id range and read_sections can skip the
+    others. Sorting loads the spilled table into memory once, as Arrow
+    columns.
+    """
+
+    def __init__(self, path, row_group_size=10000):
+        self.pa = _import_pyarrow()
+        self.schema = _schema(self.pa)
+        self.path = path
+        self.tmp_path = f'{path}.unsorted.tmp'
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) == self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        pa = self.pa
+        columns = list(zip(*self.rows))
+        label_section = [
+            next((c for c, s in zip(SECTION_COLUMNS, row[1:]) if s is not None),
+                 None)
+            for row in self.rows
+        ]
+        table = pa.Table.from_arrays(
+            [pa.array([int(s[1:]) for s in columns[0]], pa.int64()),
+             pa.array(columns[0], pa.string())] +
+            [pa.array(c, pa.string()) for c in columns[1:]] +
+            [pa.array(label_section, pa.string()).dictionary_encode()
+             .cast(self.schema.field('label_section').type)],
+            schema=self.schema
+        )
+        if self.writer is None:
+            self.writer = pa.parquet.ParquetWriter(self.tmp_path, self.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows = []
+
+    def close(self, complete=True):
+        """Sorts and writes the file. With complete False, e.g. after an
+        error, only removes the spilled rows."""
+        if complete and self.rows:
+            self._flush()
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        if not complete:
+            os.remove(self.tmp_path)
+            return
+
+        pq = self.pa.parquet
+        table = pq.read_table(self.tmp_path, memory_map=True)
+        table = table.sort_by('study_id').cast(self.schema)
+        pq.write_table(table, str(self.path),
+                       row_group_size=self.row_group_size)
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(complete=exc[0] is None)
+
+
+def read_sections(path, columns=None, min_study_id=None, max_study_id=None):
+    """Reads columns of a sections Parquet file for a range of study ids.
+
+    Only the row groups whose study_id statistics overlap
+    [min_study_id, max_study_id] are read, and only the requested columns
+    (plus study_id) are decoded. Returns a pyarrow Table; use .to_pandas()
+    for a DataFrame.
+    """
+    pa = _import_pyarrow()
+    pf = pa.parquet.ParquetFile(str(path))
+
+    if columns is not None and 'study_id' not in columns:
+        columns = ['study_id'] + list(columns)
+
+    lo = float('-inf') if min_study_id is None else min_study_id
+    hi = float('inf') if max_study_id is None else max_study_id
+    id_column = pf.schema_arrow.get_field_index('study_id')
+
+    row_groups = []
+    for i in range(pf.metadata.num_row_groups):
+        stats = pf.metadata.row_group(i).column(id_column).statistics
+        if stats is None or not stats.has_min_max or \
+                (stats.max >= lo and stats.min <= hi):
+            row_groups.append(i)
+
+    if not row_groups:
+        return pf.schema_arrow.empty_table().select(
+            columns if columns is not None else pf.schema_arrow.names)
+
+    table = pf.read_row_groups(row_groups, columns=columns)
+    if min_study_id is not None or max_study_id is not None:
+        study_ids = table.column('study_id').to_pylist()
+        mask = pa.array([lo <= s <= hi for s in study_ids])
+        table = table.filter(mask)
+    return table
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sections_path', required=True,
+                    help='Path to the sections Parquet file.')
+parser.add_argument('--output_path', required=True,
+                    help='Path to the output CSV file.')
+parser.add_argument('--columns', nargs='+', default=['study', 'impression'],
+                    help='Columns to export.')
+parser.add_argument('--min_study_id', type=int,
+                    help='Smallest study id to export.')
+parser.add_argument('--max_study_id', type=int,
+                    help='Largest study id to export.')
+
+
+def main(args):
+    """Exports some columns of a sections Parquet file to CSV."""
+    args = parser.parse_args(args)
+    table = read_sections(args.sections_path, args.columns,
+                          args.min_study_id, args.max_study_id)
+    table.to_pandas()[args.columns].to_csv(args.output_path, index=False)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
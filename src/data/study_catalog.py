@@ -0,0 +1,192 @@
+import sys
+import argparse
+import csv
+import os
+import sqlite3
+from pathlib import Path
+
+COLUMNS = ['subject_id', 'study_id', 'path']
+
+
+class StudyCatalog:
+    """Persistent, indexed copy of a study list such as cxr-study-list.csv.
+
+    Studies are stored in a SQLite file with indices on study_id,
+    subject_id and path, so subsets can be looked up without loading the
+    whole list. Query results keep the order of the original study list.
+    The path, size and modification time of the study list loaded are
+    stored with it, see open_catalog.
+    """
+
+    def __init__(self, catalog_path):
+        self.conn = sqlite3.connect(str(catalog_path))
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS studies ('
+                ' subject_id INTEGER NOT NULL,'
+                ' study_id INTEGER NOT NULL,'
+                ' path TEXT NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS studies_study_id'
+                              ' ON studies (study_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS studies_subject_id'
+                              ' ON studies (subject_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS studies_path'
+                              ' ON studies (path)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS source ('
+                              ' key TEXT PRIMARY KEY,'
+                              ' value TEXT NOT NULL)')
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM studies').fetchone()[0]
+
+    def load(self, study_list_path):
+        """Replaces the catalog contents with the rows of a study list CSV."""
+        with open(study_list_path, 'r') as csvfile:
+            reader = csv.DictReader(csvfile)
+            rows = ((int(row['subject_id']), int(row['study_id']), row['path'])
+                    for row in reader)
+            with self.conn:
+                self.conn.execute('DELETE FROM studies')
+                self.conn.executemany(
+                    'INSERT INTO studies (subject_id, study_id, path)'
+                    ' VALUES (?, ?, ?)', rows)
+                self.conn.execute('DELETE FROM source')
+                self.conn.executemany(
+                    'INSERT INTO source (key, value) VALUES (?, ?)',
+                    source_stamp(study_list_path).items())
+
+    def stamp(self):
+        """The source_stamp of the study list loaded, {} if none was."""
+        return dict(self.conn.execute('SELECT key, value FROM source'))
+
+    def _select_in(self, column, values):
+        # join against a temporary table, so any number of values can be used
+        with self.conn:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS query_ids'
+                              ' (id INTEGER PRIMARY KEY)')
+            self.conn.execute('DELETE FROM query_ids')
+            self.conn.executemany('INSERT OR IGNORE INTO query_ids VALUES (?)',
+                                  ((int(v),) for v in values))
+        return self.conn.execute(
+            f'SELECT subject_id, study_id, path FROM studies'
+            f' WHERE {column} IN (SELECT id FROM query_ids)'
+            f' ORDER BY rowid').fetchall()
+
+    def by_study_ids(self, study_ids):
+        return self._select_in('study_id', study_ids)
+
+    def by_subject_ids(self, subject_ids):
+        return self._select_in('subject_id', subject_ids)
+
+    def by_path_prefix(self, prefix):
+        """Studies whose path starts with prefix, e.g. files/p10/."""
+        if not prefix:
+            return self.conn.execute(
+                'SELECT subject_id, study_id, path FROM studies'
+                ' ORDER BY rowid').fetchall()
+        # a range over the path index, rather than a LIKE scan
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self.conn.execute(
+            'SELECT subject_id, study_id, path FROM studies'
+            ' WHERE path >= ? AND path < ? ORDER BY rowid',
+            (prefix, upper)).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def source_stamp(study_list_path):
+    """Path, size and modification time of a study list, as strings."""
+    st = os.stat(study_list_path)
+    return {'path': str(Path(study_list_path).resolve()),
+            'size': str(st.st_size), 'mtime_ns': str(st.st_mtime_ns)}
+
+
+def open_catalog(catalog_path, study_list_path):
+    """Opens the catalog of a study list, building it first if it does not
+    exist or was built from another version of the study list.
+
+    The catalog is built in a temporary file which is then renamed into
+    place, so an interrupted build never leaves a partial catalog.
+    """
+    catalog_path = Path(catalog_path)
+    if catalog_path.exists():
+        catalog = StudyCatalog(catalog_path)
+        if catalog.stamp() == source_stamp(study_list_path):
+            return catalog
+        catalog.close()
+
+    tmp_path = catalog_path.with_name(catalog_path.name + '.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+    catalog = StudyCatalog(tmp_path)
+    catalog.load(study_list_path)
+    catalog.close()
+    os.replace(tmp_path, catalog_path)
+    return StudyCatalog(catalog_path)
+
+
+def write_study_list(rows, output_file):
+    """Writes catalog rows in the format of the study list,
+    e.g. test-set-destinations.csv."""
+    with open(output_file, 'w', newline='') as fp:
+        csvwriter = csv.writer(fp, lineterminator='\n')
+        csvwriter.writerow(COLUMNS)
+        csvwriter.writerows(rows)
+
+
+def read_ids(csv_path, column):
+    """Values of one column of a CSV file, e.g. study_id of a labeled set."""
+    with open(csv_path, 'r') as csvfile:
+        return [row[column] for row in csv.DictReader(csvfile)]
+
+
+parser = argparse.ArgumentParser(description='Build or query a study catalog.')
+parser.add_argument('--catalog', required=True,
+                    help='Path to the catalog SQLite file.')
+parser.add_argument('--study_list_file',
+                    help=('Study list CSV to build the catalog from, e.g.'
+                          ' cxr-study-list.csv. The catalog is rebuilt when'
+                          ' the study list changed since it was built.'))
+parser.add_argument('--study_ids_file',
+                    help=('CSV file with a study_id column, e.g. the labeled'
+                          ' test set, selecting those studies.'))
+parser.add_argument('--subject_ids_file',
+                    help='CSV file with a subject_id column, selecting those subjects.')
+parser.add_argument('--path_prefix',
+                    help='Select studies whose path starts with this prefix.')
+parser.add_argument('--output_file',
+                    help='Path to the output CSV file.')
+
+
+def main(args):
+    args = parser.parse_args(args)
+
+    if args.study_list_file is not None:
+        catalog = open_catalog(args.catalog, args.study_list_file)
+        print(f'Catalog of {len(catalog)} studies in {args.catalog}.')
+    else:
+        catalog = StudyCatalog(args.catalog)
+
+    if args.study_ids_file is not None:
+        rows = catalog.by_study_ids(read_ids(args.study_ids_file, 'study_id'))
+    elif args.subject_ids_file is not None:
+        rows = catalog.by_subject_ids(
+            read_ids(args.subject_ids_file, 'subject_id'))
+    elif args.path_prefix is not None:
+        rows = catalog.by_path_prefix(args.path_prefix)
+    else:
+        rows = None
+
+    if rows is not None:
+        if args.output_file is None:
+            raise ValueError('--output_file is required for queries')
+        write_study_list(rows, args.output_file)
+        print(f'{len(rows)} studies saved to {args.output_file}.')
+
+    catalog.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,16 +1,32 @@
 import pandas as pd
 import argparse
 
+# local folder import
+import study_catalog as sc
+
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Filter study list based on labeled test set")
     parser.add_argument('--labeled_file', required=True, help="Path to the labeled test set CSV file")
     parser.add_argument('--study_list_file', required=True, help="Path to the study list CSV file")
     parser.add_argument('--output_file', required=True, help="Path to the output CSV file")
+    parser.add_argument('--catalog', help="Path to a study catalog, built from the study list if it does not exist or is out of date")
 
     # Parse the arguments
     args = parser.parse_args()
 
+    if args.catalog is not None:
+        # Look the labeled studies up in the indexed catalog
+        catalog = sc.open_catalog(args.catalog, args.study_list_file)
+        rows = catalog.by_study_ids(sc.read_ids(args.labeled_file, 'study_id'))
+        catalog.close()
+        # no match points to a catalog of another study list
+        if not rows:
+            raise ValueError(f"None of the studies in {args.labeled_file} are in {args.study_list_file}")
+        sc.write_study_list(rows, args.output_file)
+        print(f"Filtered test-set report locations have been saved to {args.output_file}.")
+        return
+
     # Load the labeled test set and the study list
     labeled_df = pd.read_csv(args.labeled_file)
     list_df = pd.read_csv(args.study_list_file)
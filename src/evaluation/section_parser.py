@@ -1,64 +1,64 @@
+import functools
 import re
 
+# bump whenever a change to the parser can change its output,
+# so that section spans cached against older versions are recomputed
+PARSER_VERSION = 1
 
-def section_text(text):
-    """Splits text into sections.
-
-    Assumes text is in a radiology report format, e.g.:
+# section headers are all caps, on their own line, and followed by a colon
+_P_SECTION = re.compile(r'\n ([A-Z ()/,-]+):\s', re.DOTALL)
+# any non-whitespace character, used to test for empty sections in place
+_P_NONSPACE = re.compile(r'\S')
 
-        COMPARISON:  Chest radiograph dated XYZ.
 
-        IMPRESSION:  ABC...
+def section_spans(text):
+    """Splits text into sections without copying the text.
 
-    Given text like this, it will output text from each section, 
-    where the section type is determined by the all caps header.
+    Performs the same parse as `section_text`, but in a single pass with a
+    precompiled scanner, and only returns offsets into `text`.
 
-    Returns a three element tuple:
-        sections - list containing the text of each section
-        section_names - a normalized version of the section name
-        section_idx - list of start indices of the text in the section
+    Returns a list of (section_name, start, end) tuples, where
+    text[start:end] is the text of the section and section_name is the
+    normalized name. This includes the `last_paragraph` section created for
+    reports which have no impression or findings.
     """
-    p_section = re.compile(
-        r'\n ([A-Z ()/,-]+):\s', re.DOTALL)
+    names = list()
+    starts = list()
+    ends = list()
 
-    sections = list()
-    section_names = list()
-    section_idx = list()
-
-    idx = 0
-    s = p_section.search(text, idx)
+    s = _P_SECTION.search(text)
 
     if s:
-        sections.append(text[0:s.start(1)])
-        section_names.append('preamble')
-        section_idx.append(0)
+        names.append('preamble')
+        starts.append(0)
+        ends.append(s.start(1))
 
         while s:
             current_section = s.group(1).lower()
             # get the start of the text for this section
             idx_start = s.end()
             # skip past the first newline to avoid some bad parses
-            idx_skip = text[idx_start:].find('\n')
+            idx_skip = text.find('\n', idx_start)
             if idx_skip == -1:
-                idx_skip = 0
+                idx_skip = idx_start
 
-            s = p_section.search(text, idx_start + idx_skip)
+            s = _P_SECTION.search(text, idx_skip)
 
             if s is None:
                 idx_end = len(text)
             else:
                 idx_end = s.start()
 
-            sections.append(text[idx_start:idx_end])
-            section_names.append(current_section)
-            section_idx.append(idx_start)
+            names.append(current_section)
+            starts.append(idx_start)
+            ends.append(idx_end)
 
     else:
-        sections.append(text)
-        section_names.append('full report')
-        section_idx.append(0)
+        names.append('full report')
+        starts.append(0)
+        ends.append(len(text))
 
-    section_names = normalize_section_names(section_names)
+    names = normalize_section_names(names)
 
     # remove empty sections
     # this handles when the report starts with a finding-like statement
@@ -69,138 +69,231 @@ def section_text(text):
     #    INDICATION:   This is the actual section ....
     # it also helps when there are multiple findings sections
     # usually one is empty
-    for i in reversed(range(len(section_names))):
-        if section_names[i] in ('impression', 'findings'):
-            if sections[i].strip() == '':
-                sections.pop(i)
-                section_names.pop(i)
-                section_idx.pop(i)
-
-    if ('impression' not in section_names) & ('findings' not in section_names):
+    for i in reversed(range(len(names))):
+        if names[i] in ('impression', 'findings'):
+            if _P_NONSPACE.search(text, starts[i], ends[i]) is None:
+                names.pop(i)
+                starts.pop(i)
+                ends.pop(i)
+
+    if ('impression' not in names) & ('findings' not in names):
         # create a new section for the final paragraph
-        if '\n \n' in sections[-1]:
-            sections.append('\n \n'.join(sections[-1].split('\n \n')[1:]))
-            sections[-2] = sections[-2].split('\n \n')[0]
-            section_names.append('last_paragraph')
-            section_idx.append(section_idx[-1] + len(sections[-2]))
+        idx_para = text.find('\n \n', starts[-1], ends[-1])
+        if idx_para != -1:
+            names.append('last_paragraph')
+            starts.append(idx_para + 3)
+            ends.append(ends[-1])
+            ends[-2] = idx_para
 
-    return sections, section_names, section_idx
+    return list(zip(names, starts, ends))
 
 
-def normalize_section_names(section_names):
-    # first, lower case all
-    section_names = [s.lower().strip() for s in section_names]
-
-    frequent_sections = {
-        "preamble": "preamble",  # 227885
-        "impression": "impression",  # 187759
-        "comparison": "comparison",  # 154647
-        "indication": "indication",  # 153730
-        "findings": "findings",  # 149842
-        "examination": "examination",  # 94094
-        "technique": "technique",  # 81402
-        "history": "history",  # 45624
-        "comparisons": "comparison",  # 8686
-        "clinical history": "history",  # 7121
-        "reason for examination": "indication",  # 5845
-        "notification": "notification",  # 5749
-        "reason for exam": "indication",  # 4430
-        "clinical information": "history",  # 4024
-        "exam": "examination",  # 3907
-        "clinical indication": "indication",  # 1945
-        "conclusion": "impression",  # 1802
-        "chest, two views": "findings",  # 1735
-        "recommendation(s)": "recommendations",  # 1700
-        "type of examination": "examination",  # 1678
-        "reference exam": "comparison",  # 347
-        "patient history": "history",  # 251
-        "addendum": "addendum",  # 183
-        "comparison exam": "comparison",  # 163
-        "date": "date",  # 108
-        "comment": "comment",  # 88
-        "findings and impression": "impression",  # 87
-        "wet read": "wet read",  # 83
-        "comparison film": "comparison",  # 79
-        "recommendations": "recommendations",  # 72
-        "findings/impression": "impression",  # 47
-        "pfi": "history",
-        'recommendation': 'recommendations',
-        'wetread': 'wet read',
-        'ndication': 'impression',  # 1
-        'impresson': 'impression',  # 2
-        'imprression': 'impression',  # 1
-        'imoression': 'impression',  # 1
-        'impressoin': 'impression',  # 1
-        'imprssion': 'impression',  # 1
-        'impresion': 'impression',  # 1
-        'imperssion': 'impression',  # 1
-        'mpression': 'impression',  # 1
-        'impession': 'impression',  # 3
-        'findings/ impression': 'impression',  # ,1
-        'finding': 'findings',  # ,8
-        'findins': 'findings',
-        'findindgs': 'findings',  # ,1
-        'findgings': 'findings',  # ,1
-        'findngs': 'findings',  # ,1
-        'findnings': 'findings',  # ,1
-        'finidngs': 'findings',  # ,2
-        'idication': 'indication',  # ,1
-        'reference findings': 'findings',  # ,1
-        'comparision': 'comparison',  # ,2
-        'comparsion': 'comparison',  # ,1
-        'comparrison': 'comparison',  # ,1
-        'comparisions': 'comparison'  # ,1
-    }
+def section_text(text):
+    """Splits text into sections.
 
-    p_findings = [
-        'chest',
-        'portable',
-        'pa and lateral',
-        'lateral and pa',
-        'ap and lateral',
-        'lateral and ap',
-        'frontal and',
-        'two views',
-        'frontal view',
-        'pa view',
-        'ap view',
-        'one view',
-        'lateral view',
-        'bone window',
-        'frontal upright',
-        'frontal semi-upright',
-        'ribs',
-        'pa and lat'
-    ]
-    p_findings = re.compile('({})'.format('|'.join(p_findings)))
-
-    main_sections = [
-        'impression', 'findings', 'history', 'comparison',
-        'addendum'
-    ]
-    for i, s in enumerate(section_names):
-        if s in frequent_sections:
-            section_names[i] = frequent_sections[s]
-            continue
-
-        main_flag = False
-        for m in main_sections:
-            if m in s:
-                section_names[i] = m
-                main_flag = True
+    Assumes text is in a radiology report format, e.g.:
+
+        COMPARISON:  Chest radiograph dated XYZ.
+
+        IMPRESSION:  ABC...
+
+    Given text like this, it will output text from each section, 
+    where the section type is determined by the all caps header.
+
+    Returns a three element tuple:
+        sections - list containing the text of each section
+        section_names - a normalized version of the section name
+        section_idx - list of start indices of the text in the section
+    """
+    spans = section_spans(text)
+
+    sections = [text[start:end] for _, start, end in spans]
+    section_names = [name for name, _, _ in spans]
+    # the index of the last paragraph has always pointed at the
+    # paragraph break preceding it, rather than the start of its text
+    section_idx = [start - 3 if name == 'last_paragraph' else start
+                   for name, start, _ in spans]
+
+    return sections, section_names, section_idx
+
+
+_FREQUENT_SECTIONS = {
+    "preamble": "preamble",  # 227885
+    "impression": "impression",  # 187759
+    "comparison": "comparison",  # 154647
+    "indication": "indication",  # 153730
+    "findings": "findings",  # 149842
+    "examination": "examination",  # 94094
+    "technique": "technique",  # 81402
+    "history": "history",  # 45624
+    "comparisons": "comparison",  # 8686
+    "clinical history": "history",  # 7121
+    "reason for examination": "indication",  # 5845
+    "notification": "notification",  # 5749
+    "reason for exam": "indication",  # 4430
+    "clinical information": "history",  # 4024
+    "exam": "examination",  # 3907
+    "clinical indication": "indication",  # 1945
+    "conclusion": "impression",  # 1802
+    "chest, two views": "findings",  # 1735
+    "recommendation(s)": "recommendations",  # 1700
+    "type of examination": "examination",  # 1678
+    "reference exam": "comparison",  # 347
+    "patient history": "history",  # 251
+    "addendum": "addendum",  # 183
+    "comparison exam": "comparison",  # 163
+    "date": "date",  # 108
+    "comment": "comment",  # 88
+    "findings and impression": "impression",  # 87
+    "wet read": "wet read",  # 83
+    "comparison film": "comparison",  # 79
+    "recommendations": "recommendations",  # 72
+    "findings/impression": "impression",  # 47
+    "pfi": "history",
+    'recommendation': 'recommendations',
+    'wetread': 'wet read',
+    'ndication': 'impression',  # 1
+    'impresson': 'impression',  # 2
+    'imprression': 'impression',  # 1
+    'imoression': 'impression',  # 1
+    'impressoin': 'impression',  # 1
+    'imprssion': 'impression',  # 1
+    'impresion': 'impression',  # 1
+    'imperssion': 'impression',  # 1
+    'mpression': 'impression',  # 1
+    'impession': 'impression',  # 3
+    'findings/ impression': 'impression',  # ,1
+    'finding': 'findings',  # ,8
+    'findins': 'findings',
+    'findindgs': 'findings',  # ,1
+    'findgings': 'findings',  # ,1
+    'findngs': 'findings',  # ,1
+    'findnings': 'findings',  # ,1
+    'finidngs': 'findings',  # ,2
+    'idication': 'indication',  # ,1
+    'reference findings': 'findings',  # ,1
+    'comparision': 'comparison',  # ,2
+    'comparsion': 'comparison',  # ,1
+    'comparrison': 'comparison',  # ,1
+    'comparisions': 'comparison'  # ,1
+}
+
+# headers containing these are mapped to them, in order of priority
+_MAIN_SECTIONS = [
+    'impression', 'findings', 'history', 'comparison',
+    'addendum'
+]
+
+# headers containing these describe the entire study
+# and are equivalent to findings
+_FINDINGS_KEYWORDS = [
+    'chest',
+    'portable',
+    'pa and lateral',
+    'lateral and pa',
+    'ap and lateral',
+    'lateral and ap',
+    'frontal and',
+    'two views',
+    'frontal view',
+    'pa view',
+    'ap view',
+    'one view',
+    'lateral view',
+    'bone window',
+    'frontal upright',
+    'frontal semi-upright',
+    'ribs',
+    'pa and lat'
+]
+
+
+def _build_keyword_automaton(keywords):
+    """Builds an Aho-Corasick automaton over (keyword, value, priority) tuples.
+
+    Returns a tuple of:
+        goto - list of dicts, mapping a character to the next state
+        fail - list of failure links for each state
+        out - list of (priority, value) for the best keyword ending at each
+            state, or None
+    """
+    goto = [{}]
+    fail = [0]
+    out = [None]
+
+    for keyword, value, priority in keywords:
+        state = 0
+        for ch in keyword:
+            if ch not in goto[state]:
+                goto.append({})
+                fail.append(0)
+                out.append(None)
+                goto[state][ch] = len(goto) - 1
+            state = goto[state][ch]
+        if out[state] is None or priority < out[state][0]:
+            out[state] = (priority, value)
+
+    # breadth first, so failure links always point at shallower states
+    queue = list(goto[0].values())
+    for state in queue:
+        for ch, nxt in goto[state].items():
+            queue.append(nxt)
+            f = fail[state]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[nxt] = goto[f][ch] if ch in goto[f] and goto[f][ch] != nxt else 0
+            # a state also matches everything its failure link matches
+            if out[fail[nxt]] is not None and (
+                    out[nxt] is None or out[fail[nxt]][0] < out[nxt][0]):
+                out[nxt] = out[fail[nxt]]
+
+    return goto, fail, out
+
+
+def _match_keywords(automaton, text):
+    """Value of the highest priority keyword found in text, or None."""
+    goto, fail, out = automaton
+    best = None
+    state = 0
+    for ch in text:
+        while state and ch not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(ch, 0)
+        if out[state] is not None and (best is None or out[state][0] < best[0]):
+            best = out[state]
+            if best[0] == 0:
                 break
-        if main_flag:
-            continue
+    return None if best is None else best[1]
+
+
+# any main section name takes priority over the findings keywords
+_KEYWORD_AUTOMATON = _build_keyword_automaton(
+    [(m, m, i) for i, m in enumerate(_MAIN_SECTIONS)] +
+    [(p, 'findings', len(_MAIN_SECTIONS)) for p in _FINDINGS_KEYWORDS]
+)
 
-        m = p_findings.search(s)
-        if m is not None:
-            section_names[i] = 'findings'
 
-        # if it looks like it is describing the entire study
-        # it's equivalent to findings
-        # group similar phrasings for impression
+@functools.lru_cache(maxsize=4096)
+def normalize_section_name(section_name):
+    """Normalized version of a single raw section header."""
+    # first, lower case
+    s = section_name.lower().strip()
 
-    return section_names
+    if s in _FREQUENT_SECTIONS:
+        return _FREQUENT_SECTIONS[s]
+
+    # if it looks like it is describing the entire study
+    # it's equivalent to findings
+    # group similar phrasings for impression
+    m = _match_keywords(_KEYWORD_AUTOMATON, s)
+    if m is not None:
+        return m
+
+    return s
+
+
+def normalize_section_names(section_names):
+    return [normalize_section_name(s) for s in section_names]
 
 
 def custom_mimic_cxr_rules():
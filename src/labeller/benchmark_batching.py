@@ -0,0 +1,83 @@
+import sys
+import argparse
+import time
+
+import numpy as np
+import torch
+from transformers import BertConfig
+
+# local folder import
+import chexbert_model as cm
+
+parser = argparse.ArgumentParser(description=(
+    'Compare fixed-size batches with length-bucketed token-budget batches.'))
+parser.add_argument('-d', '--input_file', required=True,
+                    help='Labeller input CSV, e.g. input_chexbert.csv of the test set.')
+parser.add_argument('-c', '--checkpoint',
+                    help=('Path to the model checkpoint. Without one, a'
+                          ' randomly initialised bert-base model is timed.'))
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+parser.add_argument('--num_reports', type=int,
+                    help='Only time the first reports of the input.')
+parser.add_argument('--batch_size', type=int, default=18,
+                    help='Number of reports per fixed-size batch.')
+parser.add_argument('--max_tokens', type=int, nargs='+',
+                    default=[2048, 4096, 8192],
+                    help='Token budgets per length-bucketed batch.')
+parser.add_argument('--device',
+                    default='cuda' if torch.cuda.is_available() else 'cpu',
+                    help='Device to run the model on.')
+
+
+def padded_tokens(encoded, batches):
+    return sum(len(batch) * max(len(encoded[i]) for i in batch)
+               for batch in batches)
+
+
+def main(args):
+    args = parser.parse_args(args)
+    torch.manual_seed(0)
+
+    if args.checkpoint is not None:
+        model = cm.load_model(args.checkpoint, args.device)
+    else:
+        model = cm.ChexbertModel(BertConfig(), [4] * 13 + [2])
+        model.to(args.device)
+        model.eval()
+
+    reports = cm.load_reports(args.input_file)
+    if args.num_reports is not None:
+        reports = reports[:args.num_reports]
+    encoded = cm.encode_reports(reports, cm.load_tokenizer(args.tokenizer))
+    n_tokens = sum(len(ids) for ids in encoded)
+    print(f'{len(encoded)} reports, {n_tokens} tokens,'
+          f' {n_tokens / len(encoded):.0f} tokens per report on average.')
+
+    # warm up
+    cm.predict(model, encoded[:args.batch_size], args.batch_size, args.device)
+
+    start = time.time()
+    baseline = cm.predict(model, encoded, args.batch_size, args.device)
+    base_time = time.time() - start
+    batches = cm.fixed_batches(encoded, args.batch_size)
+    print(f'batch_size {args.batch_size}: {len(encoded) / base_time:.1f}'
+          f' reports/s, {n_tokens / padded_tokens(encoded, batches):.0%}'
+          f' of padded tokens are real')
+
+    for max_tokens in args.max_tokens:
+        start = time.time()
+        classes = cm.predict(model, encoded, args.batch_size, args.device,
+                             max_tokens)
+        run_time = time.time() - start
+        batches = cm.length_batches(encoded, max_tokens)
+        # padding is masked, so labels only differ by rounding
+        agreement = np.mean(classes == baseline)
+        print(f'max_tokens {max_tokens}: {len(encoded) / run_time:.1f}'
+              f' reports/s ({base_time / run_time:.2f}x), {len(batches)}'
+              f' batches, {n_tokens / padded_tokens(encoded, batches):.0%}'
+              f' of padded tokens are real, {agreement:.2%} of labels agree')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,417 @@
+import sys
+import argparse
+import csv
+import hashlib
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+# local folder import
+import chexbert_model as cm
+import token_cache as tc
+from compare_labels import METHODS, RULE_CONDITIONS, label_agreement, \
+    load_truth
+
+# head sizes of CheXbert, for labels written without a model
+CHEXBERT_HEAD_SIZES = [4] * 13 + [2]
+
+
+def predict_confidence(model, encoded, batch_size=18, device='cpu',
+                       max_tokens=None, precision='fp32'):
+    """Predictions as chexbert_model.predict, with the probability of each
+    predicted class, as two arrays of (reports, heads)."""
+    if max_tokens is None:
+        batches = cm.fixed_batches(encoded, batch_size)
+    else:
+        batches = cm.length_batches(encoded, max_tokens)
+
+    classes = np.zeros((len(encoded), len(model.head_sizes)), dtype=np.int64)
+    confidences = np.zeros(classes.shape, dtype=np.float32)
+    with torch.no_grad(), cm.autocast(precision, device):
+        for batch in batches:
+            input_ids, attention_mask = cm.pad_batch(
+                [encoded[i] for i in batch], device)
+            outputs = model(input_ids, attention_mask)
+            classes[batch] = cm.head_classes(outputs)
+            confidences[batch] = cm.head_confidences(outputs)
+    return classes, confidences
+
+
+def reports_digest(reports):
+    """SHA-1 of the text of reports, in order, to match saved first-stage
+    outputs to their input."""
+    digest = hashlib.sha1()
+    for report in reports.fillna(''):
+        digest.update(str(report).encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+def save_first_stage(path, classes, confidences, head_sizes, reports,
+                     seconds):
+    """Saves the classes and confidences of the first-stage model as an
+    .npz file, with its head sizes, the digest of the reports and the
+    seconds it took, so that a later run can reuse them."""
+    np.savez(path, classes=classes, confidences=confidences,
+             head_sizes=np.array(head_sizes), seconds=np.array(seconds),
+             digest=np.array(reports_digest(reports)))
+
+
+def load_first_stage(path, reports):
+    """Classes, confidences, head sizes and seconds of save_first_stage,
+    checked against the reports they are for."""
+    with np.load(path) as saved:
+        if str(saved['digest']) != reports_digest(reports):
+            raise ValueError(f'{path} was saved for another input')
+        return (saved['classes'], saved['confidences'],
+                saved['head_sizes'].tolist(), float(saved['seconds']))
+
+
+def _read_phrases(path):
+    with open(path) as fp:
+        return [line.strip().lower() for line in fp if line.strip()]
+
+
+def load_phrases(phrases_dir):
+    """Phrases of the CheXpert labeller, e.g. models/chexpert-labeler/phrases,
+    as a dict of condition to its (mention, unmention) phrases."""
+    phrases_dir = Path(phrases_dir)
+    phrases = {}
+    for path in sorted((phrases_dir / 'mention').glob('*.txt')):
+        condition = path.stem.replace('_', ' ').title()
+        condition = RULE_CONDITIONS.get(condition, condition)
+        unmention_path = phrases_dir / 'unmention' / path.name
+        unmention = _read_phrases(unmention_path) \
+            if unmention_path.exists() else []
+        phrases[condition] = (_read_phrases(path), unmention)
+    if not phrases:
+        raise FileNotFoundError(f'No mention phrases in {phrases_dir}/mention')
+    return phrases
+
+
+def _alternation(phrases):
+    if not phrases:
+        return None
+    # longest first, so overlapping phrases match as a whole
+    return re.compile('|'.join(
+        re.escape(p) for p in sorted(phrases, key=len, reverse=True)))
+
+
+class PhraseMatcher:
+    """The mention stage of the rule-based CheXpert labeller, without its
+    parsing: which conditions a report mentions.
+
+    Phrases are matched as lowercase substrings, once the unmention
+    phrases of the condition are removed. Substrings match more often
+    than the labeller's own matching, so a report without any match is
+    one the labeller finds no mention in.
+    """
+
+    def __init__(self, phrases):
+        self.patterns = {condition: (_alternation(mention),
+                                     _alternation(unmention))
+                         for condition, (mention, unmention)
+                         in phrases.items()}
+
+    def mentions(self, report):
+        text = ' '.join(str(report).lower().split())
+        found = []
+        for condition, (mention, unmention) in self.patterns.items():
+            if unmention is not None:
+                masked = unmention.sub(' ', text)
+            else:
+                masked = text
+            if mention is not None and mention.search(masked):
+                found.append(condition)
+        return found
+
+
+def no_finding_labels(reports, head_sizes=CHEXBERT_HEAD_SIZES):
+    """Labels of reports that mention no condition: No Finding positive,
+    and every other condition blank, or negative for binary heads."""
+    classes = np.zeros((len(reports), len(head_sizes)), dtype=np.int64)
+    classes[:, cm.CONDITIONS.index('No Finding')] = 1
+    return cm.labels_frame(classes, reports, head_sizes)
+
+
+def read_labels(labels_file, reports):
+    """Labeller output of labels_file, e.g. chexpert_labeled_1.csv, in the
+    order of reports, and whether each report has labels in the file."""
+    df = pd.read_csv(labels_file).rename(
+        columns={'Reports': 'Report Impression', **RULE_CONDITIONS})
+    df = df.drop_duplicates('Report Impression').set_index('Report Impression')
+    conditions = [c for c in cm.CONDITIONS if c in df.columns]
+    labels = df.reindex(reports.tolist())[conditions]
+    labels.insert(0, 'Report Impression', reports.tolist())
+    return labels.reset_index(drop=True), reports.isin(df.index).values
+
+
+def cascade_labels(first_stage, expensive, deferred):
+    """Labels of the first stage, replaced by the expensive labels for the
+    deferred reports. Both frames are labeller outputs of the same
+    reports, in the same order."""
+    labels = first_stage.copy()
+    for condition in cm.CONDITIONS:
+        if condition in labels.columns:
+            labels[condition] = np.where(deferred, expensive[condition],
+                                         labels[condition])
+    return labels
+
+
+def curve_point(labels, deferred, truth, rows, costs):
+    """Cost and micro F1 of each scoring method of cascade labels.
+
+    rows are the positions in labels of the reports of truth, and costs
+    the seconds per report of the first stage and the expensive path.
+    The cost is relative to the expensive path labelling every report.
+    """
+    first_cost, expensive_cost = costs
+    scores = label_agreement(truth, labels.iloc[rows])
+    point = {'deferred': deferred.mean(),
+             'relative_cost': (first_cost + deferred.mean() * expensive_cost)
+             / expensive_cost}
+    for method in METHODS:
+        point[f'{method}_f1'] = scores.loc[method, 'micro_f1']
+    return point
+
+
+def write_reports(path, reports, format='chexbert'):
+    """Writes reports as labeller input, for chexbert with a Report
+    Impression header, for chexpert as rows of an id and the report."""
+    with open(path, 'w', newline='') as fp:
+        csvwriter = csv.writer(fp, lineterminator='\n')
+        if format == 'chexbert':
+            csvwriter.writerow(['Report Impression'])
+            csvwriter.writerows([report] for report in reports)
+        else:
+            csvwriter.writerows(enumerate(reports))
+
+
+parser = argparse.ArgumentParser(description=(
+    'Label reports with a cascade: a cheap first stage labels the reports'
+    ' it is confident about, and the rest go to an expensive labeller.'))
+parser.add_argument('-d', '--input_file', required=True,
+                    help='Labeller input CSV, e.g. input_chexbert.csv.')
+parser.add_argument('-o', '--output_path', required=True,
+                    help='Folder to save the outputs to.')
+parser.add_argument('--mode', default='confidence',
+                    choices=['confidence', 'rules'],
+                    help=('First stage: a model, deferring reports with a head'
+                          ' below its confidence threshold, or the mention'
+                          ' phrases of the rule-based labeller, deferring'
+                          ' reports that mention any condition.'))
+parser.add_argument('-c', '--checkpoint',
+                    help=('First-stage model of the confidence mode, e.g.'
+                          ' CheXbert or a distilled student.'))
+parser.add_argument('--first_stage',
+                    help=('<prefix>_first_stage.npz of an earlier run of the'
+                          ' confidence mode on the same input, to reuse its'
+                          ' predictions instead of running --checkpoint.'))
+parser.add_argument('--thresholds', nargs='+', type=float, default=[0.9],
+                    help=('Confidence threshold of every head, or one per'
+                          ' head in the order of the conditions.'))
+parser.add_argument('--phrases_dir',
+                    help=('Phrases folder of the CheXpert labeller, for the'
+                          ' rules mode, e.g. models/chexpert-labeler/phrases.'))
+parser.add_argument('--expensive_checkpoint',
+                    help='Model checkpoint of the expensive path.')
+parser.add_argument('--expensive_labels',
+                    help=('Output of the expensive labeller on the deferred or'
+                          ' all reports, e.g. chexpert_labeled_1.csv.'))
+parser.add_argument('--expensive_cost', type=float,
+                    help=('Seconds per report of the expensive path. Measured'
+                          ' when it runs here.'))
+parser.add_argument('--deferred_format', default='chexbert',
+                    choices=['chexbert', 'chexpert'],
+                    help='Labeller input format of the deferred reports.')
+parser.add_argument('--true_labels',
+                    help=('Ground truth labels, to compute a cost/accuracy'
+                          ' curve. The expensive path then also labels the'
+                          ' test reports.'))
+parser.add_argument('--test_report_path',
+                    help='Test set reports CSV of the ground truth labels.')
+parser.add_argument('--curve_points', type=int, default=11,
+                    help='Number of thresholds of the curve.')
+parser.add_argument('--prefix', default='cascade',
+                    help='Outputs are written to <prefix>_*.csv.')
+parser.add_argument('--batch_size', type=int, default=18,
+                    help='Number of reports per forward pass.')
+parser.add_argument('--max_tokens', type=int,
+                    help='Token budget of length-bucketed batches.')
+parser.add_argument('--quantize', default='none', choices=['none', 'int8'],
+                    help='Dynamically quantize the first-stage model.')
+parser.add_argument('--precision', default='fp32',
+                    choices=['fp32', 'bf16', 'auto'],
+                    help='Run the first-stage model in bfloat16 where supported.')
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+parser.add_argument('--cache_dir',
+                    help='Folder of tokenized inputs, see token_cache.py.')
+parser.add_argument('--device', default='cpu',
+                    help='Device to run the models on.')
+
+
+def main(args):
+    args = parser.parse_args(args)
+    output_path = Path(args.output_path)
+    if not output_path.exists():
+        output_path.mkdir(parents=True)
+
+    reports = cm.load_reports(args.input_file)
+    tokenizer = None
+    encoded = None
+    if args.first_stage is not None and args.mode != 'confidence':
+        raise ValueError('--first_stage is only for the confidence mode')
+    if (args.mode == 'confidence' and args.first_stage is None) or \
+            args.expensive_checkpoint is not None:
+        tokenizer = cm.load_tokenizer(args.tokenizer)
+        if args.cache_dir is not None:
+            encoded = tc.encode_cached(args.input_file, tokenizer,
+                                       args.cache_dir)
+
+    truth = None
+    if args.true_labels is not None and args.test_report_path is not None:
+        truth = load_truth(args.true_labels, args.test_report_path)
+        position = {}
+        for i, report in enumerate(reports):
+            position.setdefault(report, i)
+        truth = truth[truth['text'].isin(position)]
+        rows = [position[text] for text in truth['text']]
+        scored = np.zeros(len(reports), dtype=bool)
+        scored[rows] = True
+
+    # first stage
+    if args.mode == 'confidence':
+        if args.checkpoint is None and args.first_stage is None:
+            raise ValueError('The confidence mode needs a --checkpoint or'
+                             ' --first_stage')
+        if args.first_stage is not None:
+            classes, confidences, head_sizes, first_time = \
+                load_first_stage(args.first_stage, reports)
+            print(f'Reusing the first stage of {args.first_stage}.')
+        else:
+            model = cm.load_model(args.checkpoint, args.device, args.quantize)
+            head_sizes = model.head_sizes
+            if encoded is None:
+                encoded = cm.encode_reports(reports, tokenizer)
+            start = time.time()
+            classes, confidences = predict_confidence(
+                model, encoded, args.batch_size, args.device, args.max_tokens,
+                cm.resolve_precision(args.precision, args.device))
+            first_time = time.time() - start
+            save_first_stage(output_path / f'{args.prefix}_first_stage.npz',
+                             classes, confidences, head_sizes, reports,
+                             first_time)
+        thresholds = np.array(args.thresholds)
+        if len(thresholds) not in (1, len(head_sizes)):
+            raise ValueError(f'Expected 1 or {len(head_sizes)} thresholds, got'
+                             f' {len(thresholds)}')
+        first_stage = cm.labels_frame(classes, reports, head_sizes)
+        deferred = (confidences < thresholds).any(axis=1)
+    else:
+        if args.phrases_dir is None:
+            raise ValueError('The rules mode needs a --phrases_dir')
+        matcher = PhraseMatcher(load_phrases(args.phrases_dir))
+        head_sizes = CHEXBERT_HEAD_SIZES
+        if args.expensive_checkpoint is not None:
+            expensive_model = cm.load_model(args.expensive_checkpoint,
+                                            args.device)
+            head_sizes = expensive_model.head_sizes
+        start = time.time()
+        deferred = np.array([bool(matcher.mentions(report))
+                             for report in reports])
+        first_stage = no_finding_labels(reports, head_sizes)
+        first_time = time.time() - start
+    print(f'First stage labelled {len(reports)} reports in {first_time:.1f}s,'
+          f' deferring {deferred.sum()} ({deferred.mean():.1%}).')
+
+    # the expensive path labels the deferred reports, and the test reports
+    # for the curve
+    needed = deferred if truth is None else deferred | scored
+    deferred_file = output_path / f'{args.prefix}_deferred.csv'
+    write_reports(deferred_file, reports[needed].fillna(''),
+                  args.deferred_format)
+
+    expensive_cost = args.expensive_cost
+    if args.expensive_labels is not None:
+        expensive, labelled = read_labels(args.expensive_labels, reports)
+        if not labelled[needed].all():
+            raise ValueError(f'{args.expensive_labels} does not label'
+                             f' {(needed & ~labelled).sum()} of the reports'
+                             f' needed')
+    elif args.expensive_checkpoint is not None:
+        if args.mode == 'confidence':
+            expensive_model = cm.load_model(args.expensive_checkpoint,
+                                            args.device)
+        indices = np.flatnonzero(needed)
+        if encoded is None:
+            subset = cm.encode_reports(reports.iloc[indices], tokenizer)
+        else:
+            subset = [encoded[i] for i in indices]
+        start = time.time()
+        classes = np.zeros((len(reports), len(expensive_model.head_sizes)),
+                           dtype=np.int64)
+        classes[indices] = cm.predict(expensive_model, subset,
+                                      args.batch_size, args.device,
+                                      args.max_tokens)
+        expensive_time = time.time() - start
+        if expensive_cost is None and len(indices) > 0:
+            expensive_cost = expensive_time / len(indices)
+        expensive = cm.labels_frame(classes, reports,
+                                    expensive_model.head_sizes)
+        print(f'Expensive path labelled {len(indices)} reports in'
+              f' {expensive_time:.1f}s.')
+    else:
+        first_stage['deferred'] = deferred.astype(int)
+        first_stage_file = output_path / f'{args.prefix}_first_stage.csv'
+        first_stage.to_csv(first_stage_file, index=False)
+        print(f'First-stage labels saved to {first_stage_file}. Label'
+              f' {deferred_file} with the expensive labeller, then pass its'
+              f' output as --expensive_labels.')
+        return
+
+    output_file = output_path / f'{args.prefix}_labeled_1.csv'
+    cascade_labels(first_stage, expensive, deferred).to_csv(output_file,
+                                                            index=False)
+    print(f'Cascade labels saved to {output_file}.')
+    if truth is None:
+        return
+
+    if expensive_cost is None:
+        print('No --expensive_cost given, assuming the first stage is free.')
+        costs = (0.0, 1.0)
+    else:
+        costs = (first_time / len(reports), expensive_cost)
+    truth = truth[[c for c in cm.CONDITIONS if c in truth.columns]]
+    points = []
+    if args.mode == 'confidence':
+        # a report is deferred when a head is below the threshold, so
+        # thresholds at quantiles of the lowest confidence of each report
+        lowest = confidences.min(axis=1)
+        curve_thresholds = np.unique(np.quantile(
+            lowest, np.linspace(0, 1, args.curve_points)))
+        for threshold in list(curve_thresholds) + [np.inf]:
+            curve_deferred = lowest < threshold
+            labels = cascade_labels(first_stage, expensive, curve_deferred)
+            points.append({'threshold': threshold, **curve_point(
+                labels, curve_deferred, truth, rows, costs)})
+    else:
+        everything = np.ones(len(reports), dtype=bool)
+        for name, curve_deferred in (('cascade', deferred),
+                                     ('expensive', everything)):
+            labels = cascade_labels(first_stage, expensive, curve_deferred)
+            points.append({'threshold': name, **curve_point(
+                labels, curve_deferred, truth, rows, costs)})
+    curve = pd.DataFrame(points)
+    curve_file = output_path / f'{args.prefix}_curve.csv'
+    curve.to_csv(curve_file, index=False)
+    print(f'Cost/accuracy curve on {len(truth)} test reports, saved to'
+          f' {curve_file}:')
+    print(curve.round(4).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,90 @@
+import json
+import struct
+
+import numpy as np
+import torch
+
+# tensors are stored in the safetensors layout: an 8 byte little-endian
+# header length, a JSON header, then the raw little-endian tensor data
+_DTYPES = {
+    torch.float32: ('F32', np.float32),
+    torch.float16: ('F16', np.float16),
+    # numpy has no bfloat16, so it is read as int16 and viewed as bfloat16
+    torch.bfloat16: ('BF16', np.int16),
+    torch.int64: ('I64', np.int64),
+    torch.int32: ('I32', np.int32),
+    torch.int16: ('I16', np.int16),
+    torch.int8: ('I8', np.int8),
+    torch.uint8: ('U8', np.uint8),
+    torch.bool: ('BOOL', np.bool_),
+}
+_TORCH_DTYPES = {code: dtype for dtype, (code, _) in _DTYPES.items()}
+_NUMPY_DTYPES = {code: np_dtype for code, np_dtype in _DTYPES.values()}
+
+# data is aligned to this many bytes, so memory-mapped tensors are aligned
+_ALIGN = 64
+
+
+def write_tensors(path, tensors, metadata=None):
+    """Writes a dict of tensors to path in the safetensors layout.
+
+    metadata is an optional dict of strings stored in the header.
+    """
+    header = {}
+    if metadata is not None:
+        header['__metadata__'] = {k: str(v) for k, v in metadata.items()}
+    offset = 0
+    arrays = []
+    for name, tensor in tensors.items():
+        tensor = tensor.detach().cpu().contiguous()
+        if tensor.dtype == torch.bfloat16:
+            array = tensor.view(torch.int16).numpy()
+        else:
+            array = tensor.numpy()
+        code = _DTYPES[tensor.dtype][0]
+        header[name] = {'dtype': code, 'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset + array.nbytes]}
+        arrays.append(array)
+        offset += array.nbytes
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # pad the header with spaces, to align the data
+    header_bytes += b' ' * (-(8 + len(header_bytes)) % _ALIGN)
+    with open(path, 'wb') as fp:
+        fp.write(struct.pack('<Q', len(header_bytes)))
+        fp.write(header_bytes)
+        for array in arrays:
+            fp.write(array.astype(array.dtype.newbyteorder('<'),
+                                  copy=False).tobytes())
+
+
+def read_header(path):
+    with open(path, 'rb') as fp:
+        (header_len,) = struct.unpack('<Q', fp.read(8))
+        header = json.loads(fp.read(header_len).decode('utf-8'))
+    return header, 8 + header_len
+
+
+def read_tensors(path):
+    """Tensors of a file written by write_tensors, memory-mapped.
+
+    The file is mapped copy-on-write, so the tensors share the page cache
+    with every other process mapping the same file until they are
+    written to. Returns the dict of tensors and the metadata dict.
+    """
+    header, data_start = read_header(path)
+    metadata = header.pop('__metadata__', {})
+    if not header:
+        return {}, metadata
+    data = np.memmap(str(path), dtype=np.uint8, mode='c', offset=data_start)
+
+    tensors = {}
+    for name, info in header.items():
+        start, end = info['data_offsets']
+        array = data[start:end].view(_NUMPY_DTYPES[info['dtype']]) \
+            .reshape(info['shape'])
+        tensor = torch.from_numpy(array)
+        if info['dtype'] == 'BF16':
+            tensor = tensor.view(torch.bfloat16)
+        tensors[name] = tensor
+    return tensors, metadata
@@ -0,0 +1,604 @@
+import re
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from transformers import BertConfig, BertModel, BertTokenizer
+
+# local folder import
+import checkpoint_format as cf
+
+# order of the linear heads of CheXbert-style checkpoints
+CONDITIONS = [
+    'Enlarged Cardiomediastinum', 'Cardiomegaly', 'Lung Opacity',
+    'Lung Lesion', 'Edema', 'Consolidation', 'Pneumonia', 'Atelectasis',
+    'Pneumothorax', 'Pleural Effusion', 'Pleural Other', 'Fracture',
+    'Support Devices', 'No Finding'
+]
+
+# suffix of checkpoints in the canonical format, see convert_checkpoint.py
+CANONICAL_SUFFIX = '.safetensors'
+
+# BERT's maximum input length, in tokens
+MAX_LENGTH = 512
+
+# class index of a head to label: blank, positive, negative, uncertain
+CLASS_LABELS = {0: np.nan, 1: 1, 2: 0, 3: -1}
+
+_P_LAYER = re.compile(r'^bert\.encoder\.layer\.(\d+)\.')
+
+
+class FusedHeads(nn.Module):
+    """The linear heads of every condition as one projection.
+
+    Computes all heads with a single (sum of head sizes) x hidden_size
+    matmul and splits the logits per head. Checkpoints with one
+    nn.Linear per head, linear_heads.<i>.weight and .bias, are fused when
+    loaded. The head sizes are kept in the state dict as sizes.
+    """
+
+    def __init__(self, hidden_size, head_sizes):
+        super(FusedHeads, self).__init__()
+        self.register_buffer('sizes', torch.tensor(head_sizes))
+        self.head_sizes = list(head_sizes)
+        self.weight = nn.Parameter(torch.empty(sum(head_sizes), hidden_size))
+        self.bias = nn.Parameter(torch.empty(sum(head_sizes)))
+        # initialised as separate nn.Linear heads would be
+        for weight, bias in zip(self.weight.data.split(head_sizes),
+                                self.bias.data.split(head_sizes)):
+            head = nn.Linear(hidden_size, weight.shape[0])
+            weight.copy_(head.weight.data)
+            bias.copy_(head.bias.data)
+
+    def __len__(self):
+        return len(self.head_sizes)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        if prefix + 'weight' not in state_dict and \
+                prefix + '0.weight' in state_dict:
+            # one nn.Linear per head
+            for name in ('weight', 'bias'):
+                keys = [f'{prefix}{i}.{name}' for i in range(len(self))]
+                state_dict[prefix + name] = torch.cat(
+                    [state_dict.pop(k) for k in keys])
+            state_dict[prefix + 'sizes'] = self.sizes.clone()
+        super(FusedHeads, self)._load_from_state_dict(
+            state_dict, prefix, *args, **kwargs)
+
+    def forward(self, hidden):
+        logits = nn.functional.linear(hidden, self.weight, self.bias)
+        return list(logits.split(self.head_sizes, dim=-1))
+
+
+class ChexbertModel(nn.Module):
+    """BERT with one linear head per condition on the [CLS] token, as in
+    CheXbert's bert_labeler.
+
+    head_sizes gives the number of classes of each head: 4 (blank,
+    positive, negative, uncertain) or 2 (blank, positive) for CheXbert,
+    or 1 for a binary head scored with a sigmoid, as in VisualCheXbert.
+    The heads are computed together, see FusedHeads.
+    """
+
+    def __init__(self, config, head_sizes, p=0.1):
+        super(ChexbertModel, self).__init__()
+        self.bert = BertModel(config)
+        self.dropout = nn.Dropout(p)
+        self.linear_heads = FusedHeads(config.hidden_size, head_sizes)
+
+    @property
+    def head_sizes(self):
+        return self.linear_heads.head_sizes
+
+    def forward(self, input_ids, attention_mask=None):
+        final_hidden = self.bert(input_ids, attention_mask=attention_mask)[0]
+        cls_hidden = self.dropout(final_hidden[:, 0, :])
+        return self.linear_heads(cls_hidden)
+
+
+def quantize_model(model, quantize='none'):
+    """Applies dynamic quantization to the linear layers of the BERT
+    encoder, for CPU inference.
+
+    With quantize='int8', the encoder's weights are stored as int8 and
+    its activations quantized on the fly; the embeddings and heads stay
+    in float32.
+    """
+    if quantize == 'none':
+        return model
+    if quantize == 'int8':
+        model.bert.encoder = torch.quantization.quantize_dynamic(
+            model.bert.encoder, {nn.Linear}, dtype=torch.qint8)
+        return model
+    raise ValueError(f'Unrecognized quantization {quantize}')
+
+
+def _select_linear(linear, index, dim):
+    """A copy of an nn.Linear keeping the rows (dim 0) or columns (dim 1)
+    of its weight at index."""
+    weight = linear.weight.data.index_select(dim, index).clone()
+    bias = linear.bias.data
+    if dim == 0:
+        bias = bias.index_select(0, index)
+    selected = nn.Linear(weight.shape[1], weight.shape[0])
+    selected.weight.data = weight
+    selected.bias.data = bias.clone()
+    return selected
+
+
+def keep_heads(attention, heads):
+    """Shrinks a BertAttention module to the given heads, removing the rows
+    of the query, key and value projections and the columns of the output
+    projection of every other head."""
+    self_attention = attention.self
+    size = self_attention.attention_head_size
+    heads = sorted(heads)
+    if not heads:
+        raise ValueError('Every layer needs at least one attention head')
+    index = torch.cat([torch.arange(h * size, (h + 1) * size) for h in heads])
+    for name in ('query', 'key', 'value'):
+        setattr(self_attention, name, _select_linear(
+            getattr(self_attention, name), index, dim=0))
+    attention.output.dense = _select_linear(attention.output.dense, index,
+                                            dim=1)
+    # used to split the projections into heads in older transformers
+    self_attention.num_attention_heads = len(heads)
+    self_attention.all_head_size = len(heads) * size
+
+
+def prune_heads(model, heads):
+    """Removes attention heads of the encoder, as BertModel.prune_heads.
+
+    heads is a dict of layer index to the indices of the heads to remove,
+    which are recorded in the config's pruned_heads. Layers can only be
+    pruned once.
+    """
+    config = model.bert.config
+    if not hasattr(config, 'pruned_heads'):
+        # no longer part of BertConfig in recent transformers
+        config.pruned_heads = {}
+    n_heads = config.num_attention_heads
+    for layer, layer_heads in heads.items():
+        if not layer_heads:
+            continue
+        if config.pruned_heads.get(layer):
+            raise ValueError(f'Layer {layer} is already pruned')
+        keep_heads(model.bert.encoder.layer[layer].attention,
+                   [h for h in range(n_heads) if h not in set(layer_heads)])
+        config.pruned_heads[layer] = sorted(layer_heads)
+
+
+def attention_heads(state_dict, config):
+    """Number of attention heads of each layer of a state dict, which is
+    less than the config's for pruned layers."""
+    size = config.hidden_size // config.num_attention_heads
+    return [state_dict[f'bert.encoder.layer.{i}.attention.self.query.weight']
+            .shape[0] // size for i in range(config.num_hidden_layers)]
+
+
+def cpu_supports_bf16():
+    """Whether the CPU has native bfloat16 matmuls, AVX512-BF16 or AMX.
+
+    Read from /proc/cpuinfo, so False where that is not available.
+    """
+    try:
+        with open('/proc/cpuinfo', 'r') as fp:
+            flags = set()
+            for line in fp:
+                if line.startswith('flags'):
+                    flags.update(line.split(':', 1)[1].split())
+    except OSError:
+        return False
+    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+
+
+def resolve_device(device='auto'):
+    """Device to run on: 'auto' is cuda where available, else cpu, and
+    any other device is returned as it is."""
+    if device == 'auto':
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    return device
+
+
+def resolve_precision(precision='fp32', device='cpu'):
+    """Precision to run at: 'fp32', or 'bf16' where the device supports it.
+
+    'auto' picks bf16 when supported. Asking for bf16 on a device without
+    it falls back to fp32, with a message.
+    """
+    if precision == 'fp32':
+        return 'fp32'
+    if precision not in ('bf16', 'auto'):
+        raise ValueError(f'Unrecognized precision {precision}')
+    if torch.device(device).type == 'cuda':
+        supported = torch.cuda.is_bf16_supported()
+    else:
+        supported = cpu_supports_bf16()
+    if supported:
+        return 'bf16'
+    if precision == 'bf16':
+        print(f'bfloat16 is not supported on {device}, running in float32.')
+    return 'fp32'
+
+
+def autocast(precision='fp32', device='cpu'):
+    """Context running the model at a precision from resolve_precision."""
+    if precision == 'bf16':
+        return torch.autocast(device_type=torch.device(device).type,
+                              dtype=torch.bfloat16)
+    return nullcontext()
+
+
+def read_state_dict(checkpoint_path):
+    """State dict of a checkpoint, without the module. prefix that
+    DataParallel training adds.
+
+    Canonical checkpoints already have the model's keys, and are
+    memory-mapped rather than read, see checkpoint_format.read_tensors.
+    """
+    if Path(checkpoint_path).suffix == CANONICAL_SUFFIX:
+        return cf.read_tensors(checkpoint_path)[0]
+    state_dict = torch.load(checkpoint_path, map_location='cpu')
+    if 'model_state_dict' in state_dict:
+        state_dict = state_dict['model_state_dict']
+    return {(k[len('module.'):] if k.startswith('module.') else k): v
+            for k, v in state_dict.items()}
+
+
+def unfused_state_dict(state_dict):
+    """A state dict with one linear_heads.<i>.weight and .bias per head,
+    as CheXbert's bert_labeler has, from one with fused heads.
+
+    For code building its own per-head model, e.g. the visualisation
+    notebooks. State dicts that are not fused are returned as they are.
+    """
+    if 'linear_heads.weight' not in state_dict:
+        return state_dict
+    state_dict = dict(state_dict)
+    head_sizes = state_dict.pop('linear_heads.sizes').tolist()
+    for name in ('weight', 'bias'):
+        for i, tensor in enumerate(
+                state_dict.pop(f'linear_heads.{name}').split(head_sizes)):
+            state_dict[f'linear_heads.{i}.{name}'] = tensor
+    return state_dict
+
+
+def config_from_state_dict(state_dict):
+    """BertConfig and head sizes matching the weights of a state dict."""
+    vocab_size, hidden_size = \
+        state_dict['bert.embeddings.word_embeddings.weight'].shape
+    n_layers = 1 + max(int(m.group(1)) for m in map(_P_LAYER.match, state_dict)
+                       if m is not None)
+    config = BertConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        num_hidden_layers=n_layers,
+        num_attention_heads=hidden_size // 64,
+        intermediate_size=state_dict[
+            'bert.encoder.layer.0.intermediate.dense.weight'].shape[0],
+        max_position_embeddings=state_dict[
+            'bert.embeddings.position_embeddings.weight'].shape[0],
+        type_vocab_size=state_dict[
+            'bert.embeddings.token_type_embeddings.weight'].shape[0],
+    )
+    if 'linear_heads.sizes' in state_dict:
+        # fused heads
+        head_sizes = state_dict['linear_heads.sizes'].tolist()
+    else:
+        n_heads = sum(1 for k in state_dict if k.startswith('linear_heads.')
+                      and k.endswith('.weight'))
+        head_sizes = [state_dict[f'linear_heads.{i}.weight'].shape[0]
+                      for i in range(n_heads)]
+    return config, head_sizes
+
+
+def build_model(config, head_sizes, layer_heads=None):
+    """A ChexbertModel whose weights are left uninitialised, to be loaded.
+
+    The model is built on the meta device, where building allocates and
+    initialises nothing, then given uninitialised CPU memory. The meta
+    device is only the default of the calling thread, within this
+    function. The buffers BERT and FusedHeads compute rather than load
+    are filled in; any other buffer must then be loaded. layer_heads is
+    the number of attention heads of each layer, for pruned checkpoints,
+    see attention_heads.
+    """
+    # torch.device is a context manager from torch 2.0
+    meta = torch.device('meta') if hasattr(torch.device, '__enter__') \
+        else nullcontext()
+    with meta:
+        model = ChexbertModel(config, head_sizes)
+        # pruned layers keep their first heads, the weights saved for them
+        for layer, n_heads in enumerate(layer_heads or []):
+            if n_heads < config.num_attention_heads:
+                keep_heads(model.bert.encoder.layer[layer].attention,
+                           range(n_heads))
+    model.to_empty(device='cpu')
+
+    with torch.no_grad():
+        model.linear_heads.sizes.copy_(torch.tensor(head_sizes))
+        embeddings = model.bert.embeddings
+        if hasattr(embeddings, 'position_ids'):
+            embeddings.position_ids.copy_(torch.arange(
+                embeddings.position_ids.shape[-1]).expand_as(
+                    embeddings.position_ids))
+        if hasattr(embeddings, 'token_type_ids'):
+            embeddings.token_type_ids.zero_()
+    filled = {'linear_heads.sizes', 'bert.embeddings.position_ids',
+              'bert.embeddings.token_type_ids'}
+    saved = set(model.state_dict())
+    unfilled = [name for name, _ in model.named_buffers()
+                if name not in saved and name not in filled]
+    if unfilled:
+        raise ValueError(f'Buffers {unfilled} are neither loaded nor filled in')
+    return model
+
+
+def share_weights(model, state_dict):
+    """Points the parameters and buffers of model at the tensors of
+    state_dict, without copying them. Returns the missing and unexpected
+    keys, as load_state_dict does."""
+    own = model.state_dict(keep_vars=True)
+    for name, tensor in own.items():
+        if name in state_dict:
+            if tensor.shape != state_dict[name].shape:
+                raise ValueError(f'{name} has shape {state_dict[name].shape},'
+                                 f' the model expects {tensor.shape}')
+            tensor.data = state_dict[name]
+    missing = [k for k in own if k not in state_dict]
+    unexpected = [k for k in state_dict if k not in own]
+    return missing, unexpected
+
+
+def load_model(checkpoint_path, device='cpu', quantize='none'):
+    """Loads a CheXbert-style checkpoint, e.g. chexbert.pth, for inference.
+
+    See quantize_model for quantize, which needs device='cpu'.
+    """
+    if quantize != 'none' and device != 'cpu':
+        raise ValueError('Quantized models only run on the CPU')
+    state_dict = read_state_dict(checkpoint_path)
+    config, head_sizes = config_from_state_dict(state_dict)
+    # every weight is loaded, or the checkpoint is rejected below
+    model = build_model(config, head_sizes,
+                        attention_heads(state_dict, config))
+
+    if Path(checkpoint_path).suffix == CANONICAL_SUFFIX:
+        # weights stay memory-mapped, shared with other processes
+        missing, unexpected = share_weights(model, state_dict)
+    else:
+        missing, unexpected = model.load_state_dict(state_dict, strict=False)
+    # position_ids is a buffer in some transformers versions, not a weight,
+    # filled in by build_model
+    missing = [k for k in missing if not k.endswith('position_ids')]
+    unexpected = [k for k in unexpected if not k.endswith('position_ids')]
+    if missing or unexpected:
+        raise ValueError(f'{checkpoint_path} does not match the model,'
+                         f' missing {missing}, unexpected {unexpected}')
+
+    model.to(device)
+    model.eval()
+    return quantize_model(model, quantize)
+
+
+def load_reports(csv_path):
+    """Report Impression column of labeller input, e.g. input_chexbert.csv."""
+    return pd.read_csv(csv_path)['Report Impression']
+
+
+def clean_reports(reports):
+    """Reports as CheXbert tokenizes them: stripped, with line breaks and
+    runs of whitespace replaced by single spaces."""
+    reports = reports.fillna('').str.strip()
+    reports = reports.replace('\n', ' ', regex=True)
+    reports = reports.replace(r'\s+', ' ', regex=True)
+    return reports.str.strip()
+
+
+def load_tokenizer(name_or_path='bert-base-uncased'):
+    return BertTokenizer.from_pretrained(name_or_path)
+
+
+def encode_reports(reports, tokenizer):
+    """Token ids of each report, with [CLS] and [SEP], truncated to
+    MAX_LENGTH tokens."""
+    encoded = []
+    for report in clean_reports(reports):
+        ids = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(report))
+        ids = [tokenizer.cls_token_id] + ids + [tokenizer.sep_token_id]
+        if len(ids) > MAX_LENGTH:
+            ids = ids[:MAX_LENGTH - 1] + [tokenizer.sep_token_id]
+        encoded.append(ids)
+    return encoded
+
+
+def pad_batch(batch, device='cpu'):
+    """Zero-padded input ids and attention mask of a list of token ids."""
+    lengths = [len(ids) for ids in batch]
+    input_ids = torch.zeros(len(batch), max(lengths), dtype=torch.long)
+    attention_mask = torch.zeros(len(batch), max(lengths), dtype=torch.long)
+    for i, ids in enumerate(batch):
+        input_ids[i, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[i, :len(ids)] = 1
+    return input_ids.to(device), attention_mask.to(device)
+
+
+def head_classes(outputs):
+    """Predicted class of each head, as an array of (batch, heads)."""
+    classes = []
+    for out in outputs:
+        if out.shape[1] == 1:
+            # binary head
+            classes.append((torch.sigmoid(out[:, 0]) >= 0.5).long())
+        else:
+            classes.append(out.argmax(dim=1))
+    return torch.stack(classes, dim=1).cpu().numpy()
+
+
+def head_confidences(outputs):
+    """Probability of the predicted class of each head, as an array of
+    (batch, heads)."""
+    confidences = []
+    for out in outputs:
+        if out.shape[1] == 1:
+            p = torch.sigmoid(out[:, 0].float())
+            confidences.append(torch.max(p, 1 - p))
+        else:
+            confidences.append(out.float().softmax(dim=1).max(dim=1)[0])
+    return torch.stack(confidences, dim=1).cpu().numpy()
+
+
+def fixed_batches(encoded, batch_size=18):
+    """Indices of consecutive batches of batch_size reports."""
+    return [list(range(start, min(start + batch_size, len(encoded))))
+            for start in range(0, len(encoded), batch_size)]
+
+
+def length_batches(encoded, max_tokens=8192, max_batch_size=256):
+    """Indices of batches of reports of similar length.
+
+    Reports are sorted by length, and each batch is filled while its
+    padded size (reports times longest report) stays within max_tokens,
+    with at most max_batch_size reports.
+    """
+    order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+    batches = []
+    batch = []
+    for i in order:
+        # sorted by length, so the new report is the longest in the batch
+        if batch and ((len(batch) + 1) * len(encoded[i]) > max_tokens or
+                      len(batch) == max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def predict(model, encoded, batch_size=18, device='cpu', max_tokens=None,
+            precision='fp32'):
+    """Predicted class of each head for each encoded report, in order.
+
+    Without max_tokens, reports are run in order in batches of
+    batch_size. With max_tokens, they are run in length_batches of at
+    most max_tokens padded tokens, and the predictions put back in order.
+    precision is 'fp32' or 'bf16', see resolve_precision.
+    """
+    if max_tokens is None:
+        batches = fixed_batches(encoded, batch_size)
+    else:
+        batches = length_batches(encoded, max_tokens)
+
+    classes = np.zeros((len(encoded), len(model.head_sizes)),
+                       dtype=np.int64)
+    with torch.no_grad(), autocast(precision, device):
+        for batch in batches:
+            input_ids, attention_mask = pad_batch(
+                [encoded[i] for i in batch], device)
+            classes[batch] = head_classes(model(input_ids, attention_mask))
+    return classes
+
+
+def timed_predict(model, encoded, batch_size=18, device='cpu',
+                  max_tokens=None, precision='fp32'):
+    """Predictions as predict, with the seconds each batch took, as an
+    array in the order the batches ran."""
+    if max_tokens is None:
+        batches = fixed_batches(encoded, batch_size)
+    else:
+        batches = length_batches(encoded, max_tokens)
+
+    classes = np.zeros((len(encoded), len(model.head_sizes)),
+                       dtype=np.int64)
+    batch_times = []
+    with torch.no_grad(), autocast(precision, device):
+        for batch in batches:
+            start = time.time()
+            input_ids, attention_mask = pad_batch(
+                [encoded[i] for i in batch], device)
+            classes[batch] = head_classes(model(input_ids, attention_mask))
+            batch_times.append(time.time() - start)
+    return classes, np.array(batch_times)
+
+
+def mc_predict(model, encoded, n_runs, batch_size=18, device='cpu',
+               max_tokens=None, precision='fp32', scope='heads'):
+    """Predicted classes of n_runs passes with dropout, as an array of
+    (runs, reports, heads), computed in one batched pass per batch.
+
+    With scope='heads', BERT runs once per batch and dropout is applied
+    n_runs times to the [CLS] vector before the heads. With scope='full',
+    the batch is replicated n_runs times and run with dropout in every
+    layer, each replica drawing its own masks; the replicas count against
+    batch_size and max_tokens, so the batches are n_runs times smaller.
+    """
+    if scope == 'full':
+        batch_size = max(1, batch_size // n_runs)
+        if max_tokens is not None:
+            max_tokens = max(1, max_tokens // n_runs)
+    if max_tokens is None:
+        batches = fixed_batches(encoded, batch_size)
+    else:
+        batches = length_batches(encoded, max_tokens)
+
+    classes = np.zeros((n_runs, len(encoded), len(model.head_sizes)),
+                       dtype=np.int64)
+    with torch.no_grad(), autocast(precision, device):
+        for batch in batches:
+            input_ids, attention_mask = pad_batch(
+                [encoded[i] for i in batch], device)
+            if scope == 'heads':
+                cls_hidden = model.bert(
+                    input_ids, attention_mask=attention_mask)[0][:, 0, :]
+                cls_hidden = nn.functional.dropout(
+                    cls_hidden.expand(n_runs, -1, -1), model.dropout.p,
+                    training=True)
+                outputs = model.linear_heads(
+                    cls_hidden.reshape(n_runs * len(batch), -1))
+            elif scope == 'full':
+                model.train()
+                try:
+                    outputs = model(input_ids.repeat(n_runs, 1),
+                                    attention_mask.repeat(n_runs, 1))
+                finally:
+                    model.eval()
+            else:
+                raise ValueError(f'Unrecognized dropout scope {scope}')
+            # replicas are stacked along the batch
+            classes[:, batch] = head_classes(outputs).reshape(
+                n_runs, len(batch), -1)
+    return classes
+
+
+def disagreement(classes):
+    """Per report, the fraction of runs whose label differs from the most
+    common label, averaged over the heads. classes is an array of (runs,
+    reports, heads), as returned by mc_predict."""
+    counts = np.stack([(classes == c).sum(axis=0)
+                       for c in range(classes.max() + 1)])
+    return 1 - counts.max(axis=0).mean(axis=1) / classes.shape[0]
+
+
+def labels_frame(classes, reports, head_sizes):
+    """Labeller output: the report followed by a label per condition.
+
+    Multi-class heads are labelled 1 (positive), 0 (negative), -1
+    (uncertain) or blank, and binary heads 1 or 0, as written by CheXbert
+    and VisualCheXbert's label.py.
+    """
+    df = pd.DataFrame({'Report Impression': reports.tolist()})
+    for i, (condition, size) in enumerate(zip(CONDITIONS, head_sizes)):
+        if size == 1:
+            df[condition] = classes[:, i]
+        else:
+            df[condition] = [CLASS_LABELS[c] for c in classes[:, i]]
+    return df
+
+
+def save_labels(classes, reports, head_sizes, output_file):
+    labels_frame(classes, reports, head_sizes).to_csv(output_file, index=False)
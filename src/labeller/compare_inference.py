@@ -0,0 +1,106 @@
+import sys
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+# local folder import
+import chexbert_model as cm
+import token_cache as tc
+from compare_labels import label_agreement, condition_agreement
+
+parser = argparse.ArgumentParser(description=(
+    'Compare the speed and labels of inference modes against float32.'))
+parser.add_argument('-d', '--input_file', required=True,
+                    help='Labeller input CSV, e.g. input_chexbert.csv of the test set.')
+parser.add_argument('-c', '--checkpoint', required=True,
+                    help='Path to the model checkpoint, e.g. chexbert.pth.')
+parser.add_argument('--modes', nargs='+', default=['int8'],
+                    choices=['int8', 'bf16'],
+                    help='Inference modes compared with float32.')
+parser.add_argument('--output_path',
+                    help='Optional folder to save the labels of each mode to.')
+parser.add_argument('--num_reports', type=int,
+                    help='Only label the first reports of the input.')
+parser.add_argument('--batch_size', type=int, default=18,
+                    help='Number of reports per forward pass.')
+parser.add_argument('--max_tokens', type=int,
+                    help='Token budget of length-bucketed batches.')
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+parser.add_argument('--cache_dir',
+                    help='Folder of tokenized inputs, see token_cache.py.')
+parser.add_argument('--max_f1_drop', type=float, default=0.01,
+                    help=('Largest drop in micro F1 against the float32'
+                          ' labels, for any method, to accept a mode.'))
+
+
+def load_mode(checkpoint, mode):
+    """Model and precision of an inference mode, on the CPU."""
+    if mode == 'int8':
+        return cm.load_model(checkpoint, 'cpu', quantize='int8'), 'fp32'
+    return cm.load_model(checkpoint, 'cpu'), mode
+
+
+def main(args):
+    args = parser.parse_args(args)
+
+    reports = cm.load_reports(args.input_file)
+    tokenizer = cm.load_tokenizer(args.tokenizer)
+    if args.cache_dir is not None:
+        encoded = tc.encode_cached(args.input_file, tokenizer, args.cache_dir)
+    else:
+        encoded = cm.encode_reports(reports, tokenizer)
+    if args.num_reports is not None:
+        reports = reports[:args.num_reports]
+        encoded = [encoded[i] for i in range(len(reports))]
+
+    modes = list(args.modes)
+    if 'bf16' in modes and cm.resolve_precision('bf16') != 'bf16':
+        # the message is printed by resolve_precision
+        modes.remove('bf16')
+
+    labels = {}
+    speed = {}
+    for mode in ['fp32'] + modes:
+        model, precision = load_mode(args.checkpoint, mode)
+        # warm up
+        # a list, as token caches are only indexed one report at a time
+        warm_up = [encoded[i]
+                   for i in range(min(args.batch_size, len(encoded)))]
+        cm.timed_predict(model, warm_up, args.batch_size, precision=precision)
+        start = time.time()
+        classes, batch_times = cm.timed_predict(
+            model, encoded, args.batch_size, max_tokens=args.max_tokens,
+            precision=precision)
+        total = time.time() - start
+        labels[mode] = cm.labels_frame(classes, reports, model.head_sizes)
+        speed[mode] = (len(encoded) / total,
+                       1000 * np.median(batch_times),
+                       1000 * np.percentile(batch_times, 95))
+        print(f'{mode}: {speed[mode][0]:.1f} reports/s, batch latency'
+              f' {speed[mode][1]:.0f}ms median, {speed[mode][2]:.0f}ms p95')
+        if args.output_path is not None:
+            output_path = Path(args.output_path)
+            if not output_path.exists():
+                output_path.mkdir(parents=True)
+            labels[mode].to_csv(output_path / f'{mode}_labeled.csv',
+                                index=False)
+
+    for mode in modes:
+        scores = label_agreement(labels['fp32'], labels[mode])
+        f1_drop = 1 - scores['micro_f1'].min()
+        verdict = 'ACCEPT' if f1_drop <= args.max_f1_drop else 'REJECT'
+        print()
+        print(f'{mode} against fp32: {speed[mode][0] / speed["fp32"][0]:.2f}x'
+              f' throughput, largest micro F1 drop {f1_drop:.4f} -> {verdict}')
+        print(scores.round(4))
+        print()
+        print(f'{mode} label agreement with fp32 per condition:')
+        print(condition_agreement(labels['fp32'], labels[mode]).round(4)
+              .to_string())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
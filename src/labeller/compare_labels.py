@@ -0,0 +1,80 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+
+# the scoring of src/evaluation
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'evaluation'))
+from eval_chexbert import evaluate_labels
+
+# local folder import
+import chexbert_model as cm
+
+METHODS = ['mention', 'uncertain', 'absence', 'presence']
+
+# names used by the rule-based CheXpert labeller and the test set labels,
+# where they differ from CheXbert's
+RULE_CONDITIONS = {'Airspace Opacity': 'Lung Opacity'}
+
+
+def label_agreement(reference, candidate, conditions=None):
+    """Scores candidate labels against reference labels, e.g. quantized
+    against float32 outputs of the same reports.
+
+    Both are labeller output frames, see chexbert_model.labels_frame. For
+    each evaluation method of eval_chexbert.py, the reference is taken as
+    the truth, and the micro, macro and lowest per-condition F1 are
+    returned with the fraction of identical labels, one row per method.
+    A condition neither labels as positive counts as an F1 of 1.
+    """
+    if conditions is None:
+        conditions = [c for c in cm.CONDITIONS if c in reference.columns]
+    reference = reference[conditions].astype(float)
+    candidate = candidate[conditions].astype(float)
+
+    rows = {}
+    for method in METHODS:
+        df, preds, targets = evaluate_labels(reference, candidate, method)
+        rows[method] = {
+            'micro_f1': metrics.f1_score(targets, preds, average='micro',
+                                         zero_division=1),
+            'macro_f1': metrics.f1_score(targets, preds, average='macro',
+                                         zero_division=1),
+            'min_f1': df['f1'].min(),
+            'agreement': np.mean(preds == targets),
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def condition_agreement(reference, candidate, conditions=None):
+    """Fraction of reports with the same label in reference and candidate,
+    for each condition. Blank labels agree with each other."""
+    if conditions is None:
+        conditions = [c for c in cm.CONDITIONS if c in reference.columns]
+    reference = reference[conditions].astype(float).fillna(-2)
+    candidate = candidate[conditions].astype(float).fillna(-2)
+    return pd.Series((reference.values == candidate.values).mean(axis=0),
+                     index=conditions)
+
+
+def condition_f1(reference, candidate, method='mention', conditions=None):
+    """F1 of candidate labels for each condition, with the reference labels
+    as the truth, for an evaluation method of eval_chexbert.py."""
+    if conditions is None:
+        conditions = [c for c in cm.CONDITIONS if c in reference.columns]
+    df, _, _ = evaluate_labels(reference[conditions].astype(float),
+                               candidate[conditions].astype(float), method)
+    return df['f1']
+
+
+def load_truth(true_labels, test_report_path):
+    """Ground truth labels of the test set, as read by eval_chexbert.py,
+    with the id and text of each report."""
+    reports = pd.read_csv(test_report_path, header=None, names=['id', 'text'])
+    reports['id'] = reports['id'].astype(str).str.lstrip('s')
+    truth = pd.read_csv(true_labels, header=0, index_col=0)
+    truth = truth.rename(columns=RULE_CONDITIONS)
+    truth.index = truth.index.astype(str)
+    return reports.merge(truth, left_on='id', right_index=True)
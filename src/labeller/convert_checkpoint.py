@@ -0,0 +1,71 @@
+import sys
+import argparse
+import json
+from pathlib import Path
+
+import torch
+
+# local folder import
+import chexbert_model as cm
+import checkpoint_format as cf
+
+# bump when the canonical keys change
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(model, output_file, source=None):
+    """Saves the weights of a ChexbertModel, in the canonical format if
+    output_file ends with .safetensors, else as a CheXbert .pth file.
+
+    The pruned heads of the model, if any, are saved with the weights,
+    though the shapes of the weights are enough to load them.
+    """
+    pruned_heads = {layer: heads for layer, heads
+                    in getattr(model.bert.config, 'pruned_heads', {}).items()
+                    if heads}
+    if Path(output_file).suffix == cm.CANONICAL_SUFFIX:
+        metadata = {'format': 'pt', 'checkpoint_version': CHECKPOINT_VERSION}
+        if source is not None:
+            metadata['source'] = Path(source).name
+        if pruned_heads:
+            metadata['pruned_heads'] = json.dumps(pruned_heads)
+        cf.write_tensors(output_file, model.state_dict(), metadata=metadata)
+    else:
+        checkpoint = {'model_state_dict': model.state_dict()}
+        if pruned_heads:
+            checkpoint['pruned_heads'] = pruned_heads
+        torch.save(checkpoint, output_file)
+
+
+parser = argparse.ArgumentParser(description=(
+    'Convert a CheXbert-style checkpoint to the canonical format, which'
+    ' loads without unpickling or remapping keys.'))
+parser.add_argument('-c', '--checkpoint', required=True,
+                    help='Path to the model checkpoint, e.g. chexbert.pth.')
+parser.add_argument('--output_file',
+                    help=('Path to the converted checkpoint. Defaults to the'
+                          ' checkpoint path with a .safetensors suffix.'))
+
+
+def main(args):
+    """Writes the weights of a checkpoint under the keys of ChexbertModel.
+
+    The checkpoint is loaded as by chexbert_model.load_model, which
+    unwraps model_state_dict, strips the module. prefix and fuses the
+    heads, and the resulting state dict is saved with
+    checkpoint_format.write_tensors.
+    """
+    args = parser.parse_args(args)
+    output_file = args.output_file
+    if output_file is None:
+        output_file = Path(args.checkpoint).with_suffix(cm.CANONICAL_SUFFIX)
+    if Path(output_file).suffix != cm.CANONICAL_SUFFIX:
+        raise ValueError(f'The output file must end with {cm.CANONICAL_SUFFIX}')
+
+    model = cm.load_model(args.checkpoint)
+    save_checkpoint(model, output_file, source=args.checkpoint)
+    print(f'Converted {args.checkpoint} to {output_file}.')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,304 @@
+import sys
+import argparse
+import copy
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+# local folder import
+import chexbert_model as cm
+import token_cache as tc
+from compare_labels import METHODS, condition_f1, label_agreement, load_truth
+from convert_checkpoint import save_checkpoint
+
+
+def in_test_set(reports, test_report_path):
+    """Whether each report's text is also one of the test set reports of
+    test_report_path, e.g. input_chexpert.csv, ignoring differences in
+    whitespace, so that those reports can be left out of training."""
+    def normalise(texts):
+        return texts.fillna('').astype(str).str.split().str.join(' ')
+
+    test_reports = pd.read_csv(test_report_path, header=None,
+                               names=['id', 'text'])
+    return normalise(reports).isin(set(normalise(test_reports['text']))) \
+        .values
+
+
+def student_layers(n_teacher, n_student):
+    """Teacher layers a student starts from, evenly spaced and ending with
+    the last layer, e.g. 2, 5, 8 and 11 for 4 of 12 layers."""
+    if not 0 < n_student <= n_teacher:
+        raise ValueError(f'A student of {n_student} layers cannot be'
+                         f' distilled from {n_teacher} layers')
+    return [(i + 1) * n_teacher // n_student - 1 for i in range(n_student)]
+
+
+def init_student(teacher, n_layers):
+    """A ChexbertModel with n_layers encoder layers, initialised from the
+    teacher's embeddings, heads and student_layers."""
+    config = copy.deepcopy(teacher.bert.config)
+    layers = student_layers(config.num_hidden_layers, n_layers)
+    config.num_hidden_layers = n_layers
+    student = cm.ChexbertModel(config, teacher.head_sizes, teacher.dropout.p)
+
+    teacher_state = teacher.state_dict()
+    state_dict = {}
+    for key in student.state_dict():
+        match = cm._P_LAYER.match(key)
+        if match is not None:
+            layer = layers[int(match.group(1))]
+            teacher_key = f'bert.encoder.layer.{layer}.' + key[match.end():]
+        else:
+            teacher_key = key
+        state_dict[key] = teacher_state[teacher_key].clone()
+    student.load_state_dict(state_dict)
+    return student
+
+
+def teacher_logits(model, encoded, max_tokens=8192, device='cpu'):
+    """Concatenated logits of every head for each report, as an array of
+    (reports, sum of head sizes)."""
+    logits = np.zeros((len(encoded), sum(model.head_sizes)), dtype=np.float32)
+    with torch.no_grad():
+        for batch in cm.length_batches(encoded, max_tokens):
+            input_ids, attention_mask = cm.pad_batch(
+                [encoded[i] for i in batch], device)
+            outputs = model(input_ids, attention_mask)
+            logits[batch] = torch.cat(outputs, dim=1).float().cpu().numpy()
+    return logits
+
+
+def logits_classes(logits, head_sizes):
+    """Predicted class of each head, from concatenated logits."""
+    return cm.head_classes(torch.from_numpy(logits).split(head_sizes, dim=1))
+
+
+def distillation_loss(outputs, targets, temperature=2.0):
+    """Soft cross-entropy of the student outputs against the teacher
+    logits targets, head by head, averaged over heads and scaled by
+    temperature squared."""
+    losses = []
+    for out, target in zip(outputs, targets):
+        if out.shape[1] == 1:
+            # binary head
+            losses.append(nn.functional.binary_cross_entropy_with_logits(
+                out / temperature, torch.sigmoid(target / temperature)))
+        else:
+            losses.append(nn.functional.kl_div(
+                nn.functional.log_softmax(out / temperature, dim=1),
+                nn.functional.softmax(target / temperature, dim=1),
+                reduction='batchmean'))
+    return temperature ** 2 * sum(losses) / len(losses)
+
+
+def train_epoch(student, optimizer, scheduler, encoded, logits, batches,
+                temperature=2.0, device='cpu'):
+    """One pass over batches of encoded reports, returning the mean loss."""
+    student.train()
+    losses = []
+    for batch in batches:
+        input_ids, attention_mask = cm.pad_batch(
+            [encoded[i] for i in batch], device)
+        targets = torch.from_numpy(logits[batch]).to(device).split(
+            student.head_sizes, dim=1)
+        loss = distillation_loss(student(input_ids, attention_mask), targets,
+                                 temperature)
+        optimizer.zero_grad()
+        loss.backward()
+        nn.utils.clip_grad_norm_(student.parameters(), 1.0)
+        optimizer.step()
+        scheduler.step()
+        losses.append(loss.item())
+    student.eval()
+    return np.mean(losses)
+
+
+def make_optimizer(model, n_steps, lr=5e-5, warmup=0.1):
+    """AdamW and a schedule warming the learning rate up linearly over a
+    warmup fraction of n_steps, then decaying it linearly to 0."""
+    n_warmup = int(warmup * n_steps)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr,
+                                  weight_decay=0.01)
+    scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lambda step: min(
+        (step + 1) / max(1, n_warmup),
+        max(0.0, (n_steps - step) / max(1, n_steps - n_warmup))))
+    return optimizer, scheduler
+
+
+def report_changes(models, reports, encoded, reference, name,
+                   max_tokens=8192, device='cpu'):
+    """Prints the speed of two models, e.g. a teacher and its student, on
+    encoded reports, and the F1 of both for each condition and method of
+    eval_chexbert.py, against reference labels.
+
+    models is a dict of the two models by name, the first one being the
+    baseline.
+    """
+    (base, _), (smaller, _) = models.items()
+    labels = {}
+    speed = {}
+    for model_name, model in models.items():
+        # warm up
+        cm.timed_predict(model, encoded[:8], device=device,
+                         max_tokens=max_tokens)
+        classes, batch_times = cm.timed_predict(model, encoded, device=device,
+                                                max_tokens=max_tokens)
+        labels[model_name] = cm.labels_frame(classes, reports,
+                                             model.head_sizes)
+        speed[model_name] = (batch_times.sum(),
+                             1000 * np.median(batch_times))
+        print(f'{model_name}: {len(encoded)} reports in'
+              f' {speed[model_name][0]:.1f}s, batch latency'
+              f' {speed[model_name][1]:.0f}ms median')
+    print(f'{smaller} is {speed[base][0] / speed[smaller][0]:.2f}x faster'
+          f' than {base}.')
+
+    for method in METHODS:
+        f1 = pd.DataFrame({model_name: condition_f1(reference,
+                                                    labels[model_name], method)
+                           for model_name in models})
+        f1['change'] = f1[smaller] - f1[base]
+        print()
+        print(f'{method.capitalize()} F1 against the {name}:')
+        print(f1.round(3).to_string())
+
+
+parser = argparse.ArgumentParser(description=(
+    'Distill a CheXbert-style teacher into a student with fewer encoder'
+    ' layers, on the soft labels of the teacher over unlabeled reports.'))
+parser.add_argument('-d', '--input_file', required=True,
+                    help=('Labeller input CSV of the reports to train on, e.g.'
+                          ' input_chexbert.csv of generate_input_chexbert.py.'))
+parser.add_argument('-c', '--checkpoint', required=True,
+                    help=('Teacher checkpoint, e.g. chexbert.pth or the'
+                          ' project model.'))
+parser.add_argument('-o', '--output_file', required=True,
+                    help=('Path to the student checkpoint, a .pth or'
+                          ' .safetensors file.'))
+parser.add_argument('--layers', type=int, default=6,
+                    help='Number of encoder layers of the student.')
+parser.add_argument('--epochs', type=int, default=3,
+                    help='Number of passes over the training reports.')
+parser.add_argument('--lr', type=float, default=5e-5,
+                    help='Peak learning rate.')
+parser.add_argument('--warmup', type=float, default=0.1,
+                    help='Fraction of the steps to warm the learning rate up.')
+parser.add_argument('--temperature', type=float, default=2.0,
+                    help='Softmax temperature of the soft labels.')
+parser.add_argument('--max_tokens', type=int, default=8192,
+                    help='Token budget of length-bucketed batches.')
+parser.add_argument('--val_fraction', type=float, default=0.05,
+                    help=('Fraction of the reports held out to pick the best'
+                          ' epoch and time the models.'))
+parser.add_argument('--teacher_logits',
+                    help=('Optional .npy file caching the teacher logits of'
+                          ' the input, computed when it does not exist.'))
+parser.add_argument('--true_labels',
+                    help='Ground truth labels, to report the F1 change per condition.')
+parser.add_argument('--test_report_path',
+                    help=('Test set reports CSV of the ground truth labels.'
+                          ' Reports of the input with the same text are not'
+                          ' trained on.'))
+parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed of the split, batch order and dropout.')
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+parser.add_argument('--cache_dir',
+                    help='Folder of tokenized inputs, see token_cache.py.')
+parser.add_argument('--device', default='auto',
+                    help='Device to train on, auto for cuda where available.')
+
+
+def main(args):
+    args = parser.parse_args(args)
+    args.device = cm.resolve_device(args.device)
+    torch.manual_seed(args.seed)
+    rng = np.random.RandomState(args.seed)
+
+    teacher = cm.load_model(args.checkpoint, args.device)
+    tokenizer = cm.load_tokenizer(args.tokenizer)
+    reports = cm.load_reports(args.input_file)
+    if args.cache_dir is not None:
+        encoded = tc.encode_cached(args.input_file, tokenizer, args.cache_dir)
+    else:
+        encoded = cm.encode_reports(reports, tokenizer)
+
+    if args.teacher_logits is not None and Path(args.teacher_logits).exists():
+        logits = np.load(args.teacher_logits)
+        if logits.shape != (len(encoded), sum(teacher.head_sizes)):
+            raise ValueError(f'{args.teacher_logits} does not match the input'
+                             f' and teacher')
+    else:
+        start = time.time()
+        logits = teacher_logits(teacher, encoded, args.max_tokens, args.device)
+        print(f'Computed the teacher logits of {len(encoded)} reports in'
+              f' {time.time() - start:.1f}s.')
+        if args.teacher_logits is not None:
+            np.save(args.teacher_logits, logits)
+
+    # the test reports are never trained on
+    usable = np.arange(len(encoded))
+    if args.test_report_path is not None:
+        test = in_test_set(reports, args.test_report_path)
+        usable = usable[~test]
+        print(f'Left out {test.sum()} reports of the test set.')
+    order = rng.permutation(usable)
+    n_val = max(1, int(len(usable) * args.val_fraction))
+    val_idx, train_idx = np.sort(order[:n_val]), order[n_val:]
+    train_encoded = [encoded[i] for i in train_idx]
+    train_logits = logits[train_idx]
+    val_encoded = [encoded[i] for i in val_idx]
+    val_reports = reports.iloc[val_idx].reset_index(drop=True)
+    teacher_val = cm.labels_frame(logits_classes(logits[val_idx],
+                                                 teacher.head_sizes),
+                                  val_reports, teacher.head_sizes)
+
+    student = init_student(teacher, args.layers).to(args.device)
+    batches = cm.length_batches(train_encoded, args.max_tokens)
+    optimizer, scheduler = make_optimizer(student, args.epochs * len(batches),
+                                          args.lr, args.warmup)
+
+    best = -1.0
+    for epoch in range(1, args.epochs + 1):
+        start = time.time()
+        rng.shuffle(batches)
+        loss = train_epoch(student, optimizer, scheduler, train_encoded,
+                           train_logits, batches, args.temperature,
+                           args.device)
+        classes = cm.predict(student, val_encoded, device=args.device,
+                             max_tokens=args.max_tokens)
+        scores = label_agreement(teacher_val, cm.labels_frame(
+            classes, val_reports, student.head_sizes))
+        f1 = scores['micro_f1'].min()
+        print(f'Epoch {epoch}: loss {loss:.4f}, lowest micro F1 against the'
+              f' teacher {f1:.4f}, in {time.time() - start:.1f}s.')
+        if f1 > best:
+            best = f1
+            save_checkpoint(student, args.output_file, source=args.checkpoint)
+    print(f'Saved the best student to {args.output_file}.')
+
+    # the saved student, through the same path as inference
+    student = cm.load_model(args.output_file, args.device)
+    if args.true_labels is not None and args.test_report_path is not None:
+        truth = load_truth(args.true_labels, args.test_report_path)
+        eval_reports = truth['text']
+        eval_encoded = cm.encode_reports(eval_reports, tokenizer)
+        reference = truth
+        name = 'ground truth'
+    else:
+        eval_reports, eval_encoded = val_reports, val_encoded
+        reference = teacher_val
+        name = 'teacher labels of the held out reports'
+
+    print()
+    report_changes({'teacher': teacher, 'student': student}, eval_reports,
+                   eval_encoded, reference, name, args.max_tokens, args.device)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,233 @@
+import sys
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+# local folder import
+import chexbert_model as cm
+import distill as ds
+import token_cache as tc
+from compare_labels import load_truth
+from convert_checkpoint import save_checkpoint
+
+
+def self_prediction_loss(outputs):
+    """Cross-entropy of each head against its own predicted class, summed
+    over heads, so head importance needs no labels."""
+    loss = 0
+    for out in outputs:
+        if out.shape[1] == 1:
+            # binary head
+            loss = loss + nn.functional.binary_cross_entropy_with_logits(
+                out[:, 0], (out[:, 0] >= 0).float().detach())
+        else:
+            loss = loss + nn.functional.cross_entropy(
+                out, out.argmax(dim=1).detach())
+    return loss
+
+
+def head_importance(model, encoded, max_tokens=8192, device='cpu'):
+    """Importance of every attention head, as an array of (layers, heads).
+
+    Each head's output is multiplied by a gate of 1, and the importance is
+    the absolute gradient of self_prediction_loss with respect to the
+    gate, summed over the reports, as in Michel et al., Are Sixteen Heads
+    Really Better than One? Scores are normalised to unit L2 norm in each
+    layer. The gates act on the input of each attention output
+    projection, so they work with any attention implementation.
+    """
+    layers = model.bert.encoder.layer
+    n_heads = model.bert.config.num_attention_heads
+    gates = torch.ones(len(layers), n_heads, device=device,
+                       requires_grad=True)
+    importance = torch.zeros(len(layers), n_heads)
+
+    def gate(layer, size):
+        def hook(module, inputs):
+            # the concatenated outputs of the heads
+            return (inputs[0] * gates[layer].repeat_interleave(size),)
+        return hook
+
+    hooks = [layer.attention.output.dense.register_forward_pre_hook(
+        gate(i, layer.attention.self.attention_head_size))
+        for i, layer in enumerate(layers)]
+    requires_grad = [p.requires_grad for p in model.parameters()]
+    for p in model.parameters():
+        p.requires_grad_(False)
+    try:
+        for batch in cm.length_batches(encoded, max_tokens):
+            input_ids, attention_mask = cm.pad_batch(
+                [encoded[i] for i in batch], device)
+            loss = self_prediction_loss(model(input_ids, attention_mask))
+            gates.grad = None
+            (loss * len(batch)).backward()
+            importance += gates.grad.abs().cpu()
+    finally:
+        for hook in hooks:
+            hook.remove()
+        for p, flag in zip(model.parameters(), requires_grad):
+            p.requires_grad_(flag)
+
+    importance = importance / importance.norm(dim=1, keepdim=True).clamp(
+        min=1e-20)
+    return importance.numpy()
+
+
+def least_important(importance, n_prune):
+    """The n_prune least important heads, as a dict of layer to heads,
+    keeping at least one head in every layer."""
+    n_layers, n_heads = importance.shape
+    remaining = [n_heads] * n_layers
+    heads = {}
+    for flat in np.argsort(importance, axis=None, kind='stable'):
+        if n_prune == 0:
+            break
+        layer, head = divmod(int(flat), n_heads)
+        if remaining[layer] == 1:
+            continue
+        heads.setdefault(layer, []).append(head)
+        remaining[layer] -= 1
+        n_prune -= 1
+    return heads
+
+
+parser = argparse.ArgumentParser(description=(
+    'Score the attention heads of a CheXbert-style model over a corpus,'
+    ' prune the least important, optionally fine-tune, and save the'
+    ' smaller model.'))
+parser.add_argument('-d', '--input_file', required=True,
+                    help=('Labeller input CSV of the reports to score heads'
+                          ' and fine-tune on, e.g. input_chexbert.csv.'))
+parser.add_argument('-c', '--checkpoint', required=True,
+                    help='Path to the model checkpoint, e.g. chexbert.pth.')
+parser.add_argument('-o', '--output_file', required=True,
+                    help=('Path to the pruned checkpoint, a .pth or'
+                          ' .safetensors file.'))
+parser.add_argument('--prune_fraction', type=float, default=0.25,
+                    help='Fraction of all attention heads to remove.')
+parser.add_argument('--num_reports', type=int, default=2000,
+                    help='Number of reports to score the heads on.')
+parser.add_argument('--importance_file',
+                    help='Optional CSV to save the importance of every head to.')
+parser.add_argument('--finetune_epochs', type=int, default=0,
+                    help=('Epochs of fine-tuning the pruned model on the soft'
+                          ' labels of the original, see distill.py.'))
+parser.add_argument('--lr', type=float, default=2e-5,
+                    help='Peak learning rate of the fine-tuning.')
+parser.add_argument('--temperature', type=float, default=2.0,
+                    help='Softmax temperature of the soft labels.')
+parser.add_argument('--max_tokens', type=int, default=8192,
+                    help='Token budget of length-bucketed batches.')
+parser.add_argument('--val_fraction', type=float, default=0.05,
+                    help=('Fraction of the reports held out to compare the'
+                          ' models on, without ground truth labels.'))
+parser.add_argument('--true_labels',
+                    help='Ground truth labels, to report the F1 change per condition.')
+parser.add_argument('--test_report_path',
+                    help=('Test set reports CSV of the ground truth labels.'
+                          ' Reports of the input with the same text are not'
+                          ' scored or fine-tuned on.'))
+parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed of the split, batch order and dropout.')
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+parser.add_argument('--cache_dir',
+                    help='Folder of tokenized inputs, see token_cache.py.')
+parser.add_argument('--device', default='auto',
+                    help=('Device to run the models on, auto for cuda where'
+                          ' available.'))
+
+
+def main(args):
+    args = parser.parse_args(args)
+    args.device = cm.resolve_device(args.device)
+    torch.manual_seed(args.seed)
+    rng = np.random.RandomState(args.seed)
+
+    original = cm.load_model(args.checkpoint, args.device)
+    model = cm.load_model(args.checkpoint, args.device)
+    tokenizer = cm.load_tokenizer(args.tokenizer)
+    reports = cm.load_reports(args.input_file)
+    if args.cache_dir is not None:
+        encoded = tc.encode_cached(args.input_file, tokenizer, args.cache_dir)
+    else:
+        encoded = cm.encode_reports(reports, tokenizer)
+
+    # the test reports are never scored or fine-tuned on
+    usable = np.arange(len(encoded))
+    if args.test_report_path is not None:
+        test = ds.in_test_set(reports, args.test_report_path)
+        usable = usable[~test]
+        print(f'Left out {test.sum()} reports of the test set.')
+    order = rng.permutation(usable)
+    n_val = max(1, int(len(usable) * args.val_fraction))
+    val_idx, train_idx = np.sort(order[:n_val]), order[n_val:]
+    train_encoded = [encoded[i] for i in train_idx]
+
+    start = time.time()
+    importance = head_importance(model, train_encoded[:args.num_reports],
+                                 args.max_tokens, args.device)
+    n_layers, n_heads = importance.shape
+    heads = least_important(importance,
+                            int(round(args.prune_fraction * importance.size)))
+    print(f'Scored {n_layers * n_heads} heads on'
+          f' {min(args.num_reports, len(train_encoded))} reports in'
+          f' {time.time() - start:.1f}s.')
+    for layer in range(n_layers):
+        print(f'Layer {layer}: pruning heads {sorted(heads.get(layer, []))}')
+    if args.importance_file is not None:
+        pd.DataFrame({
+            'layer': np.repeat(np.arange(n_layers), n_heads),
+            'head': np.tile(np.arange(n_heads), n_layers),
+            'importance': importance.ravel(),
+            'pruned': [int(h in heads.get(layer, []))
+                       for layer in range(n_layers) for h in range(n_heads)],
+        }).to_csv(args.importance_file, index=False)
+    cm.prune_heads(model, heads)
+
+    if args.finetune_epochs > 0:
+        logits = ds.teacher_logits(original, train_encoded, args.max_tokens,
+                                   args.device)
+        batches = cm.length_batches(train_encoded, args.max_tokens)
+        optimizer, scheduler = ds.make_optimizer(
+            model, args.finetune_epochs * len(batches), args.lr)
+        for epoch in range(1, args.finetune_epochs + 1):
+            start = time.time()
+            rng.shuffle(batches)
+            loss = ds.train_epoch(model, optimizer, scheduler, train_encoded,
+                                  logits, batches, args.temperature,
+                                  args.device)
+            print(f'Fine-tuning epoch {epoch}: loss {loss:.4f}, in'
+                  f' {time.time() - start:.1f}s.')
+
+    save_checkpoint(model, args.output_file, source=args.checkpoint)
+    print(f'Saved the pruned model to {args.output_file}.')
+
+    # the saved model, through the same path as inference
+    pruned = cm.load_model(args.output_file, args.device)
+    if args.true_labels is not None and args.test_report_path is not None:
+        truth = load_truth(args.true_labels, args.test_report_path)
+        eval_reports = truth['text']
+        eval_encoded = cm.encode_reports(eval_reports, tokenizer)
+        reference = truth
+        name = 'ground truth'
+    else:
+        eval_reports = reports.iloc[val_idx].reset_index(drop=True)
+        eval_encoded = [encoded[i] for i in val_idx]
+        reference = cm.labels_frame(
+            cm.predict(original, eval_encoded, device=args.device,
+                       max_tokens=args.max_tokens),
+            eval_reports, original.head_sizes)
+        name = 'original labels of the held out reports'
+    print()
+    ds.report_changes({'original': original, 'pruned': pruned}, eval_reports,
+                      eval_encoded, reference, name, args.max_tokens,
+                      args.device)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
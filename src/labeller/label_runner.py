@@ -0,0 +1,163 @@
+import sys
+import argparse
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import torch
+
+# local folder import
+import chexbert_model as cm
+import onnx_backend as ob
+import sharded_inference as si
+import token_cache as tc
+
+parser = argparse.ArgumentParser(description=(
+    'Label reports with a CheXbert-style model several times, loading the'
+    ' model and tokenizing the reports once.'))
+parser.add_argument('-d', '--input_file', required=True,
+                    help='Labeller input CSV, e.g. input_chexbert.csv.')
+parser.add_argument('-o', '--output_path', required=True,
+                    help='Output folder for the labeled CSV files.')
+parser.add_argument('-c', '--checkpoint', required=True,
+                    help='Path to the model checkpoint, e.g. chexbert.pth.')
+parser.add_argument('--prefix', default='chexbert',
+                    help='Outputs are written to <prefix>_labeled_<run>.csv.')
+parser.add_argument('--num_runs', type=int, default=1,
+                    help='Number of times to label the reports.')
+parser.add_argument('--mc_dropout', choices=['heads', 'full'],
+                    help=('Compute the --num_runs runs together as Monte-Carlo'
+                          ' dropout passes, over the heads only or the whole'
+                          ' model, and save a per-report disagreement score.'))
+parser.add_argument('--seed', type=int,
+                    help='Random seed of the dropout masks.')
+parser.add_argument('--batch_size', type=int, default=18,
+                    help='Number of reports per forward pass.')
+parser.add_argument('--max_tokens', type=int,
+                    help=('Batch reports of similar length, up to this many'
+                          ' padded tokens per batch, instead of --batch_size'
+                          ' reports in input order.'))
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+parser.add_argument('--cache_dir',
+                    help=('Folder of tokenized inputs, reused across runs'
+                          ' and models, see token_cache.py.'))
+parser.add_argument('--backend', default='torch', choices=['torch', 'onnx'],
+                    help='Run the model with PyTorch or ONNX Runtime.')
+parser.add_argument('--onnx_path',
+                    help=('ONNX graph for the onnx backend, exported from the'
+                          ' checkpoint if missing or out of date. Defaults to'
+                          ' the checkpoint path with an .onnx suffix.'))
+parser.add_argument('--quantize', default='none', choices=['none', 'int8'],
+                    help=('Dynamically quantize the BERT encoder, for CPU'
+                          ' inference, see compare_inference.py.'))
+parser.add_argument('--precision', default='fp32',
+                    choices=['fp32', 'bf16', 'auto'],
+                    help=('Run in bfloat16 where the device supports it (bf16),'
+                          ' falling back to float32, or whenever supported'
+                          ' (auto).'))
+parser.add_argument('--workers', type=int, default=1,
+                    help=('Number of CPU worker processes labelling shards of'
+                          ' the input, see sharded_inference.py.'))
+parser.add_argument('--threads', type=int,
+                    help='Number of torch threads per worker process.')
+parser.add_argument('--no_pin', action='store_true',
+                    help='Do not pin worker processes to cores.')
+parser.add_argument('--device',
+                    help=('Device to run the model on. Defaults to cuda where'
+                          ' available, else cpu, and to cpu with --workers or'
+                          ' --backend onnx.'))
+
+
+def main(args):
+    args = parser.parse_args(args)
+    # worker processes and ONNX Runtime only run on the CPU
+    cpu_only = args.workers > 1 or args.backend == 'onnx'
+    if args.workers > 1 and args.backend != 'torch':
+        parser.error('--workers needs the torch backend')
+    if cpu_only and args.device is not None and \
+            torch.device(args.device).type != 'cpu':
+        parser.error(f'--workers and --backend onnx run on the CPU, not'
+                     f' --device {args.device}')
+    if args.mc_dropout is not None and cpu_only:
+        parser.error('--mc_dropout needs the torch backend and a single'
+                     ' worker')
+    if args.device is None:
+        args.device = 'cpu' if cpu_only or not torch.cuda.is_available() \
+            else 'cuda'
+
+    output_path = Path(args.output_path)
+    if not output_path.exists():
+        output_path.mkdir(parents=True)
+
+    start = time.time()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    if args.workers > 1:
+        threads = args.threads
+        if threads is None:
+            threads = max(1, len(os.sched_getaffinity(0)) // args.workers)
+        model = si.ShardedLabeller(
+            args.checkpoint, args.workers, threads, not args.no_pin,
+            args.quantize, cm.resolve_precision(args.precision))
+    elif args.backend == 'onnx':
+        onnx_path = args.onnx_path
+        if onnx_path is None:
+            onnx_path = Path(args.checkpoint).with_suffix('.onnx')
+        model = ob.load_onnx(onnx_path, args.checkpoint)
+        precision = 'fp32'
+    else:
+        model = cm.load_model(args.checkpoint, args.device, args.quantize)
+        precision = cm.resolve_precision(args.precision, args.device)
+    reports = cm.load_reports(args.input_file)
+    tokenizer = cm.load_tokenizer(args.tokenizer)
+    if args.cache_dir is not None:
+        encoded = tc.encode_cached(args.input_file, tokenizer, args.cache_dir)
+    else:
+        encoded = cm.encode_reports(reports, tokenizer)
+    print(f'Loaded the model and tokenized {len(encoded)} reports in'
+          f' {time.time() - start:.1f}s.')
+
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+
+    if args.mc_dropout is not None:
+        start = time.time()
+        classes = cm.mc_predict(model, encoded, args.num_runs, args.batch_size,
+                                args.device, args.max_tokens, precision,
+                                args.mc_dropout)
+        for i in range(1, args.num_runs + 1):
+            cm.save_labels(classes[i - 1], reports, model.head_sizes,
+                           output_path / f'{args.prefix}_labeled_{i}.csv')
+        output_file = output_path / f'{args.prefix}_disagreement.csv'
+        disagreement = pd.DataFrame({'Report Impression': reports.tolist(),
+                                     'disagreement': cm.disagreement(classes)})
+        disagreement.to_csv(output_file, index=False)
+        print(f'{args.num_runs} Monte-Carlo runs completed in'
+              f' {time.time() - start:.1f}s. Outputs saved to {output_path},'
+              f' disagreement to {output_file}.')
+        return
+
+    run_times = []
+    for i in range(1, args.num_runs + 1):
+        start = time.time()
+        if args.workers > 1:
+            classes = model.predict(encoded, args.batch_size, args.max_tokens)
+        else:
+            classes = cm.predict(model, encoded, args.batch_size,
+                                 args.device, args.max_tokens, precision)
+        output_file = output_path / f'{args.prefix}_labeled_{i}.csv'
+        cm.save_labels(classes, reports, model.head_sizes, output_file)
+        run_times.append(time.time() - start)
+        print(f'Run {i} completed in {run_times[-1]:.1f}s.'
+              f' Output saved to {output_file}.')
+
+    if args.workers > 1:
+        model.close()
+    print(f'All runs completed, {sum(run_times) / len(run_times):.1f}s'
+          f' per run on average.')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
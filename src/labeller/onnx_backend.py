@@ -0,0 +1,207 @@
+import sys
+import argparse
+import inspect
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+# local folder import
+import chexbert_model as cm
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError('The onnx backend requires the onnxruntime package,'
+                          ' e.g. pip install onnx onnxruntime')
+    return onnxruntime
+
+
+class _LogitsModel(nn.Module):
+    """The logits of every head, concatenated, as a single graph output."""
+
+    def __init__(self, model):
+        super(_LogitsModel, self).__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return torch.cat(self.model(input_ids, attention_mask), dim=1)
+
+
+def checkpoint_stamp(checkpoint_path):
+    """Path, size and modification time of a checkpoint, saved in the
+    graphs exported from it to tell when they are out of date."""
+    st = os.stat(checkpoint_path)
+    return json.dumps({'path': str(Path(checkpoint_path).resolve()),
+                       'size': st.st_size, 'mtime_ns': st.st_mtime_ns},
+                      sort_keys=True)
+
+
+def export_onnx(checkpoint_path, onnx_path, opset=14):
+    """Exports a CheXbert-style checkpoint to an ONNX graph.
+
+    The checkpoint is loaded as by chexbert_model.load_model, so its keys
+    are remapped the same way. The graph takes input_ids and
+    attention_mask of any batch size and sequence length, and returns
+    the concatenated logits of all heads; the head sizes and the
+    checkpoint_stamp are saved in the graph's metadata.
+    """
+    model = cm.load_model(checkpoint_path, 'cpu')
+    # any ids in the vocabulary, with some padding
+    input_ids, attention_mask = cm.pad_batch([[1, 2, 3], [1, 3]])
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript exporter, as in older versions of torch
+        kwargs['dynamo'] = False
+    # in eval mode, which the export restores on the model afterwards
+    wrapper = _LogitsModel(model).eval()
+    torch.onnx.export(
+        wrapper, (input_ids, attention_mask), str(onnx_path),
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['logits'],
+        dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                      'attention_mask': {0: 'batch', 1: 'sequence'},
+                      'logits': {0: 'batch'}},
+        opset_version=opset, **kwargs)
+
+    import onnx
+    graph = onnx.load(str(onnx_path))
+    for key, value in (('head_sizes', json.dumps(model.head_sizes)),
+                       ('checkpoint', checkpoint_stamp(checkpoint_path))):
+        entry = graph.metadata_props.add()
+        entry.key = key
+        entry.value = value
+    onnx.save(graph, str(onnx_path))
+    return model
+
+
+class OnnxChexbertModel:
+    """An exported model run with ONNX Runtime, callable like ChexbertModel.
+
+    Takes and returns torch tensors, so chexbert_model.predict can run it
+    in place of the PyTorch model.
+    """
+
+    def __init__(self, onnx_path, threads=None):
+        ort = _import_onnxruntime()
+        options = ort.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(onnx_path), options, providers=['CPUExecutionProvider'])
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.head_sizes = json.loads(meta['head_sizes'])
+        # graphs exported before the stamp was saved have none
+        self.checkpoint_stamp = meta.get('checkpoint')
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        logits = self.session.run(['logits'], {
+            'input_ids': input_ids.cpu().numpy().astype(np.int64),
+            'attention_mask': attention_mask.cpu().numpy().astype(np.int64),
+        })[0]
+        return list(torch.from_numpy(logits).split(self.head_sizes, dim=1))
+
+
+def load_onnx(onnx_path, checkpoint_path=None):
+    """ONNX Runtime model of onnx_path, exported from checkpoint_path first
+    if it does not exist yet, or if it was exported from another version
+    of the checkpoint."""
+    if Path(onnx_path).exists():
+        onnx_model = OnnxChexbertModel(onnx_path)
+        if checkpoint_path is None or \
+                onnx_model.checkpoint_stamp == checkpoint_stamp(
+                    checkpoint_path):
+            return onnx_model
+        print(f'{onnx_path} is out of date with {checkpoint_path}.')
+    elif checkpoint_path is None:
+        raise FileNotFoundError(f'{onnx_path} does not exist')
+    export_onnx(checkpoint_path, onnx_path)
+    print(f'Exported {checkpoint_path} to {onnx_path}.')
+    return OnnxChexbertModel(onnx_path)
+
+
+def max_logit_difference(model, onnx_model, encoded, batch_size=18):
+    """Largest absolute difference between the logits of two models."""
+    largest = 0.0
+    with torch.no_grad():
+        for batch in cm.fixed_batches(encoded, batch_size):
+            input_ids, attention_mask = cm.pad_batch(
+                [encoded[i] for i in batch])
+            expected = torch.cat(model(input_ids, attention_mask), dim=1)
+            actual = torch.cat(onnx_model(input_ids, attention_mask), dim=1)
+            largest = max(largest, (expected - actual).abs().max().item())
+    return largest
+
+
+def time_calls(model, encoded, batches):
+    """Reports per second and median latency of a model over batches."""
+    latencies = []
+    with torch.no_grad():
+        for batch in batches:
+            input_ids, attention_mask = cm.pad_batch(
+                [encoded[i] for i in batch])
+            start = time.time()
+            model(input_ids, attention_mask)
+            latencies.append(time.time() - start)
+    return len(encoded) / sum(latencies), 1000 * np.median(latencies)
+
+
+parser = argparse.ArgumentParser(description=(
+    'Export a CheXbert-style checkpoint to ONNX, and check and time it'
+    ' against PyTorch.'))
+parser.add_argument('-c', '--checkpoint', required=True,
+                    help='Path to the model checkpoint, e.g. chexbert.pth.')
+parser.add_argument('--onnx_path', required=True,
+                    help='Path to the exported ONNX graph.')
+parser.add_argument('--opset', type=int, default=14,
+                    help='ONNX opset version.')
+parser.add_argument('-d', '--input_file',
+                    help=('Labeller input CSV to check and time the export on,'
+                          ' e.g. input_chexbert.csv of the test set.'))
+parser.add_argument('--num_reports', type=int, default=200,
+                    help='Number of reports to check and time.')
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+parser.add_argument('--max_tokens', type=int, default=4096,
+                    help='Token budget of the batched calls.')
+parser.add_argument('--atol', type=float, default=1e-4,
+                    help='Largest accepted difference in logits from PyTorch.')
+
+
+def main(args):
+    args = parser.parse_args(args)
+    model = export_onnx(args.checkpoint, args.onnx_path, args.opset)
+    print(f'Exported {args.checkpoint} to {args.onnx_path}.')
+    if args.input_file is None:
+        return
+
+    onnx_model = OnnxChexbertModel(args.onnx_path)
+    reports = cm.load_reports(args.input_file)[:args.num_reports]
+    encoded = cm.encode_reports(reports, cm.load_tokenizer(args.tokenizer))
+
+    difference = max_logit_difference(model, onnx_model, encoded)
+    print(f'Largest logit difference from PyTorch: {difference:.2e}'
+          f' ({"within" if difference <= args.atol else "above"}'
+          f' {args.atol:.0e}).')
+
+    single = [[i] for i in range(len(encoded))]
+    batched = cm.length_batches(encoded, args.max_tokens)
+    for name, batches in (('single report', single),
+                          (f'max_tokens {args.max_tokens}', batched)):
+        for backend, m in (('torch', model), ('onnx', onnx_model)):
+            throughput, latency = time_calls(m, encoded, batches)
+            print(f'{name}, {backend}: {throughput:.1f} reports/s,'
+                  f' {latency:.1f}ms median latency per call')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,233 @@
+import sys
+import argparse
+import os
+import time
+import traceback
+import multiprocessing as mp
+
+import numpy as np
+import torch
+
+# local folder import
+import chexbert_model as cm
+import token_cache as tc
+
+
+def _worker(rank, checkpoint, quantize, precision, threads, cores, jobs,
+            results):
+    try:
+        if cores is not None:
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(threads)
+        model = cm.load_model(checkpoint, 'cpu', quantize)
+        results.put((rank, None, model.head_sizes))
+        caches = {}
+        for job_id, shard, batch_size, max_tokens in iter(jobs.get, None):
+            if isinstance(shard, tuple):
+                # a range of a token cache, memory-mapped by this process
+                cache_path, start, end = shard
+                if cache_path not in caches:
+                    caches[cache_path] = tc.read_cache(cache_path)
+                shard = [caches[cache_path][i] for i in range(start, end)]
+            classes = cm.predict(model, shard, batch_size, 'cpu', max_tokens,
+                                 precision)
+            results.put((rank, job_id, classes))
+    except Exception:
+        results.put((rank, 'error', traceback.format_exc()))
+
+
+def split_by_tokens(encoded, n_shards):
+    """Boundaries of n_shards contiguous shards with about as many tokens
+    each, as a list of (start, end) report indices, or [] if there are no
+    reports."""
+    if len(encoded) == 0:
+        return []
+    cumulative = np.cumsum([len(encoded[i]) for i in range(len(encoded))])
+    targets = cumulative[-1] * np.arange(1, n_shards) / n_shards
+    cuts = [0] + list(np.searchsorted(cumulative, targets) + 1) + [len(encoded)]
+    return [(int(min(s, len(encoded))), int(min(e, len(encoded))))
+            for s, e in zip(cuts[:-1], cuts[1:])]
+
+
+class ShardedLabeller:
+    """Labels reports with a pool of CPU worker processes.
+
+    Each of the `workers` processes loads the model once, runs torch with
+    `threads` intra-op threads and, with pin set, is pinned to its own
+    `threads` cores. Reports are split into one contiguous shard per
+    worker, with about as many tokens each, and the predictions are merged
+    back in input order.
+
+    Canonical .safetensors checkpoints are memory-mapped, so the workers
+    share a single copy of the weights. Likewise, reports read from a
+    token cache, see token_cache.py, are not sent to the workers: each
+    worker memory-maps the cache and reads its shard from there. Other
+    reports are pickled to the workers.
+    """
+
+    def __init__(self, checkpoint, workers=2, threads=1, pin=True,
+                 quantize='none', precision='fp32'):
+        ctx = mp.get_context('spawn')
+        cores = sorted(os.sched_getaffinity(0)) \
+            if hasattr(os, 'sched_getaffinity') else []
+        if pin and len(cores) < workers * threads:
+            print(f'{workers} workers x {threads} threads need more than the'
+                  f' {len(cores)} available cores, not pinning workers.')
+            pin = False
+
+        self.results = ctx.Queue()
+        self.jobs = []
+        self.processes = []
+        self.n_jobs = 0
+        for rank in range(workers):
+            worker_cores = cores[rank * threads:(rank + 1) * threads] \
+                if pin else None
+            jobs = ctx.Queue()
+            process = ctx.Process(target=_worker, args=(
+                rank, checkpoint, quantize, precision, threads, worker_cores,
+                jobs, self.results), daemon=True)
+            process.start()
+            self.jobs.append(jobs)
+            self.processes.append(process)
+
+        # wait for every worker to load the model
+        for _ in range(workers):
+            _, _, self.head_sizes = self._get()
+
+    def _get(self):
+        rank, job_id, value = self.results.get()
+        if job_id == 'error':
+            self.close()
+            raise RuntimeError(f'Worker {rank} failed:\n{value}')
+        return rank, job_id, value
+
+    def predict(self, encoded, batch_size=18, max_tokens=None):
+        """Predictions as chexbert_model.predict, computed by the workers."""
+        shards = split_by_tokens(encoded, len(self.processes))
+        if not shards:
+            return np.zeros((0, len(self.head_sizes)), dtype=np.int64)
+        cache_path = getattr(encoded, 'cache_path', None)
+        job_id = self.n_jobs
+        self.n_jobs += 1
+        for jobs, (start, end) in zip(self.jobs, shards):
+            if cache_path is not None:
+                shard = (str(cache_path), start, end)
+            else:
+                shard = [encoded[i] for i in range(start, end)]
+            jobs.put((job_id, shard, batch_size, max_tokens))
+
+        parts = {}
+        while len(parts) < len(shards):
+            rank, _, classes = self._get()
+            parts[rank] = classes
+        return np.concatenate([parts[rank] for rank in range(len(shards))])
+
+    def close(self):
+        for jobs, process in zip(self.jobs, self.processes):
+            if process.is_alive():
+                jobs.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def default_layouts(n_cores):
+    """(workers, threads) layouts using all cores, from one process with
+    every core to one single-threaded process per core."""
+    layouts = []
+    workers = 1
+    while workers <= n_cores:
+        layouts.append((workers, n_cores // workers))
+        workers *= 2
+    if layouts[-1][0] != n_cores:
+        layouts.append((n_cores, 1))
+    return layouts
+
+
+def parse_layout(text):
+    workers, threads = text.lower().split('x')
+    return int(workers), int(threads)
+
+
+parser = argparse.ArgumentParser(description=(
+    'Time sharded CPU inference for different layouts of worker processes'
+    ' and threads.'))
+parser.add_argument('-d', '--input_file', required=True,
+                    help='Labeller input CSV, e.g. input_chexbert.csv.')
+parser.add_argument('-c', '--checkpoint', required=True,
+                    help=('Path to the model checkpoint, preferably a'
+                          ' .safetensors file, see convert_checkpoint.py.'))
+parser.add_argument('--layouts', nargs='+', type=parse_layout,
+                    help=('Layouts to time as <workers>x<threads>, e.g. 1x8'
+                          ' 8x1. Defaults to layouts using every core.'))
+parser.add_argument('--no_pin', action='store_true',
+                    help='Do not pin workers to cores.')
+parser.add_argument('--num_reports', type=int,
+                    help='Only label the first reports of the input.')
+parser.add_argument('--batch_size', type=int, default=18,
+                    help='Number of reports per forward pass.')
+parser.add_argument('--max_tokens', type=int,
+                    help='Token budget of length-bucketed batches.')
+parser.add_argument('--quantize', default='none', choices=['none', 'int8'],
+                    help='Dynamically quantize the BERT encoder.')
+parser.add_argument('--precision', default='fp32',
+                    choices=['fp32', 'bf16', 'auto'],
+                    help='Run in bfloat16 where supported.')
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+parser.add_argument('--cache_dir',
+                    help='Folder of tokenized inputs, see token_cache.py.')
+
+
+def main(args):
+    """Sweep of (workers x threads) layouts, reporting reports/s of each."""
+    args = parser.parse_args(args)
+    tokenizer = cm.load_tokenizer(args.tokenizer)
+    if args.cache_dir is not None:
+        encoded = tc.encode_cached(args.input_file, tokenizer, args.cache_dir)
+    else:
+        encoded = cm.encode_reports(cm.load_reports(args.input_file),
+                                    tokenizer)
+    n_reports = len(encoded) if args.num_reports is None \
+        else min(args.num_reports, len(encoded))
+    if n_reports < len(encoded):
+        encoded = [encoded[i] for i in range(n_reports)]
+
+    layouts = args.layouts
+    if layouts is None:
+        layouts = default_layouts(len(os.sched_getaffinity(0)))
+    precision = cm.resolve_precision(args.precision)
+
+    results = []
+    for workers, threads in layouts:
+        start = time.time()
+        with ShardedLabeller(args.checkpoint, workers, threads,
+                             not args.no_pin, args.quantize,
+                             precision) as labeller:
+            load_time = time.time() - start
+            # warm up
+            labeller.predict([encoded[i] for i in range(
+                min(n_reports, workers * args.batch_size))],
+                args.batch_size, args.max_tokens)
+            start = time.time()
+            labeller.predict(encoded, args.batch_size, args.max_tokens)
+            run_time = time.time() - start
+        results.append((workers, threads, n_reports / run_time))
+        print(f'{workers} workers x {threads} threads:'
+              f' {n_reports / run_time:.1f} reports/s'
+              f' (workers started in {load_time:.1f}s)')
+
+    workers, threads, best = max(results, key=lambda r: r[2])
+    print(f'Best layout: {workers} workers x {threads} threads,'
+          f' {best:.1f} reports/s.')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
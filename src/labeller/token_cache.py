@@ -0,0 +1,138 @@
+import sys
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+# local folder import
+import chexbert_model as cm
+
+# bump when the cache layout or the tokenization changes
+CACHE_VERSION = 1
+
+
+def file_hash(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def tokenizer_hash(tokenizer):
+    """Identity of a tokenizer: its class, casing and vocabulary."""
+    basic = getattr(tokenizer, 'basic_tokenizer', None)
+    identity = {
+        'class': type(tokenizer).__name__,
+        'do_lower_case': getattr(basic, 'do_lower_case',
+                                 getattr(tokenizer, 'do_lower_case', None)),
+        'vocab': sorted(tokenizer.get_vocab().items()),
+    }
+    return hashlib.sha256(json.dumps(identity).encode('utf-8')).hexdigest()
+
+
+def cache_key(input_file, tokenizer):
+    h = hashlib.sha256()
+    for part in (str(CACHE_VERSION), str(cm.MAX_LENGTH), file_hash(input_file),
+                 tokenizer_hash(tokenizer)):
+        h.update(part.encode('utf-8'))
+    return h.hexdigest()[:32]
+
+
+class EncodedReports:
+    """Token ids of each report, read from memory-mapped arrays.
+
+    Indexing gives a read-only view of one report's ids, without copying,
+    so processes loading the same cache share its pages. cache_path is the
+    folder the arrays were read from, for other processes to open.
+    """
+
+    def __init__(self, input_ids, offsets, lengths, cache_path=None):
+        self.input_ids = input_ids
+        self.offsets = offsets
+        self.lengths = lengths
+        self.cache_path = cache_path
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        start = self.offsets[i]
+        return self.input_ids[start:start + self.lengths[i]]
+
+
+def write_cache(cache_path, encoded):
+    """Writes token ids as input_ids.npy, offsets.npy and lengths.npy.
+
+    The files are written to a temporary folder which is then renamed, so
+    a cache folder is always complete.
+    """
+    cache_path = Path(cache_path)
+    tmp_path = cache_path.with_name(cache_path.name + f'.tmp{os.getpid()}')
+    if tmp_path.exists():
+        shutil.rmtree(str(tmp_path))
+    tmp_path.mkdir(parents=True)
+
+    lengths = np.array([len(ids) for ids in encoded], dtype=np.int32)
+    offsets = np.zeros(len(encoded), dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths[:-1])
+    input_ids = np.fromiter((i for ids in encoded for i in ids),
+                            dtype=np.int32, count=int(lengths.sum()))
+
+    np.save(str(tmp_path / 'input_ids.npy'), input_ids)
+    np.save(str(tmp_path / 'offsets.npy'), offsets)
+    np.save(str(tmp_path / 'lengths.npy'), lengths)
+    try:
+        os.rename(str(tmp_path), str(cache_path))
+    except OSError:
+        # written by another process in the meantime
+        shutil.rmtree(str(tmp_path))
+
+
+def read_cache(cache_path):
+    cache_path = Path(cache_path)
+    return EncodedReports(
+        *(np.load(str(cache_path / f'{name}.npy'), mmap_mode='r')
+          for name in ('input_ids', 'offsets', 'lengths')),
+        cache_path=cache_path)
+
+
+def encode_cached(input_file, tokenizer, cache_dir):
+    """Token ids of the reports of input_file, see chexbert_model.encode_reports.
+
+    The ids are cached under cache_dir, keyed by the hash of input_file and
+    the identity of the tokenizer, and memory-mapped from there on later
+    calls.
+    """
+    cache_path = Path(cache_dir) / cache_key(input_file, tokenizer)
+    if not cache_path.exists():
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        encoded = cm.encode_reports(cm.load_reports(input_file), tokenizer)
+        write_cache(cache_path, encoded)
+    return read_cache(cache_path)
+
+
+parser = argparse.ArgumentParser(description=(
+    'Tokenize labeller input into a memory-mapped cache.'))
+parser.add_argument('-d', '--input_file', required=True,
+                    help='Labeller input CSV, e.g. input_chexbert.csv.')
+parser.add_argument('--cache_dir', required=True,
+                    help='Folder of tokenized inputs.')
+parser.add_argument('--tokenizer', default='bert-base-uncased',
+                    help='Name or path of the BERT tokenizer.')
+
+
+def main(args):
+    args = parser.parse_args(args)
+    tokenizer = cm.load_tokenizer(args.tokenizer)
+    encoded = encode_cached(args.input_file, tokenizer, args.cache_dir)
+    print(f'{len(encoded)} reports, {len(encoded.input_ids)} tokens cached in'
+          f' {Path(args.cache_dir) / cache_key(args.input_file, tokenizer)}.')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
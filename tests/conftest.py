@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+# the scripts import their neighbours as local folder imports
+SRC = Path(__file__).resolve().parents[1] / 'src'
+for folder in ('data', 'labeller'):
+    sys.path.insert(0, str(SRC / folder))
+
+import pandas as pd
+import pytest
+
+TOY_WORDS = ['no', 'acute', 'cardiopulmonary', 'process', 'small', 'left',
+             'right', 'pleural', 'effusion', 'mild', 'pulmonary', 'edema',
+             'heart', 'size', 'is', 'normal', 'tube', 'in', 'place', '.',
+             ',']
+
+TOY_REPORTS = [
+    'No acute cardiopulmonary process.',
+    'Small left pleural effusion.\n Mild pulmonary edema.',
+    '',
+    'Heart size is normal, tube in place.',
+    'Right pleural effusion. ' * 20,
+    'No acute   cardiopulmonary process, unknownword.',
+]
+
+
+@pytest.fixture(scope='session')
+def toy_model(tmp_path_factory):
+    """A tiny CheXbert-style checkpoint, its tokenizer folder and an input
+    CSV of TOY_REPORTS, as (folder, tokenizer path, checkpoint, input)."""
+    pytest.importorskip('transformers')
+    import torch
+    from transformers import BertConfig
+
+    import chexbert_model as cm
+    from convert_checkpoint import save_checkpoint
+
+    tmp_path = tmp_path_factory.mktemp('toy_model')
+    tokenizer_path = tmp_path / 'tokenizer'
+    tokenizer_path.mkdir()
+    (tokenizer_path / 'vocab.txt').write_text(
+        '\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + TOY_WORDS))
+
+    torch.manual_seed(0)
+    # larger weights, so that the reports get different labels
+    config = BertConfig(vocab_size=5 + len(TOY_WORDS), hidden_size=64,
+                        num_hidden_layers=2, num_attention_heads=1,
+                        intermediate_size=128, max_position_embeddings=512,
+                        initializer_range=1.0)
+    model = cm.ChexbertModel(config, [4] * 13 + [2])
+    checkpoint = tmp_path / 'chexbert.pth'
+    save_checkpoint(model, checkpoint)
+
+    input_file = tmp_path / 'input_chexbert.csv'
+    pd.DataFrame({'Report Impression': TOY_REPORTS}).to_csv(input_file,
+                                                            index=False)
+    return tmp_path, tokenizer_path, checkpoint, input_file
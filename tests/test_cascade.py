@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cascade
+
+
+REPORTS = pd.Series(['No acute process.', 'Small left effusion.', None])
+
+
+def test_first_stage_round_trip(tmp_path):
+    classes = np.array([[1, 0], [2, 1], [0, 0]])
+    confidences = np.array([[0.9, 0.5], [0.7, 0.99], [1.0, 0.6]],
+                           dtype=np.float32)
+    path = tmp_path / 'cascade_first_stage.npz'
+    cascade.save_first_stage(path, classes, confidences, [4, 2], REPORTS,
+                             1.5)
+
+    loaded = cascade.load_first_stage(path, REPORTS)
+    assert np.array_equal(loaded[0], classes)
+    assert np.array_equal(loaded[1], confidences)
+    assert loaded[2:] == ([4, 2], 1.5)
+
+
+@pytest.mark.parametrize('reports', [
+    REPORTS[:2],
+    REPORTS.iloc[[1, 0, 2]],
+    pd.Series(['No acute process.', 'Small right effusion.', None]),
+])
+def test_first_stage_of_another_input(tmp_path, reports):
+    path = tmp_path / 'cascade_first_stage.npz'
+    cascade.save_first_stage(path, np.zeros((3, 2), dtype=np.int64),
+                             np.ones((3, 2), dtype=np.float32), [4, 2],
+                             REPORTS, 1.0)
+    with pytest.raises(ValueError):
+        cascade.load_first_stage(path, reports)
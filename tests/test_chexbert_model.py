@@ -0,0 +1,126 @@
+import threading
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+pytest.importorskip('transformers')
+
+import chexbert_model as cm
+
+HEAD_SIZES = [4] * 13 + [2]
+
+
+def toy_encoded(toy_model):
+    _, tokenizer_path, checkpoint, input_file = toy_model
+    return cm.encode_reports(cm.load_reports(input_file),
+                             cm.load_tokenizer(str(tokenizer_path)))
+
+
+def test_load_model_matches_the_checkpoint(toy_model):
+    _, _, checkpoint, _ = toy_model
+    state_dict = cm.read_state_dict(checkpoint)
+    model = cm.load_model(checkpoint)
+
+    for name, tensor in model.state_dict().items():
+        assert tensor.device.type == 'cpu'
+        if name in state_dict:
+            assert torch.equal(tensor, state_dict[name])
+    embeddings = model.bert.embeddings
+    assert torch.equal(embeddings.position_ids[0],
+                       torch.arange(embeddings.position_ids.shape[-1]))
+    assert model.linear_heads.sizes.tolist() == HEAD_SIZES
+
+
+def test_load_model_leaves_other_threads_alone(toy_model):
+    _, _, checkpoint, _ = toy_model
+    done = threading.Event()
+
+    def load():
+        while not done.is_set():
+            cm.load_model(checkpoint)
+
+    thread = threading.Thread(target=load)
+    thread.start()
+    try:
+        for _ in range(2000):
+            assert torch.zeros(64).uniform_().abs().sum() > 0
+            assert torch.zeros(64).normal_().abs().sum() > 0
+            assert nn.Linear(16, 16).weight.device.type == 'cpu'
+    finally:
+        done.set()
+        thread.join()
+    assert torch.empty(1).device.type == 'cpu'
+
+
+@pytest.mark.parametrize('kwargs, n_batches', [
+    ({'batch_size': 4}, 2),
+    ({'max_tokens': 10 ** 6}, 1),
+])
+def test_timed_predict_matches_predict(toy_model, kwargs, n_batches):
+    model = cm.load_model(toy_model[2])
+    encoded = toy_encoded(toy_model)
+    classes, batch_times = cm.timed_predict(model, encoded, **kwargs)
+    assert np.array_equal(classes, cm.predict(model, encoded, **kwargs))
+    assert len(batch_times) == n_batches
+
+
+@pytest.mark.parametrize('scope', ['heads', 'full'])
+def test_mc_predict(toy_model, scope):
+    model = cm.load_model(toy_model[2])
+    encoded = toy_encoded(toy_model)
+
+    torch.manual_seed(0)
+    classes = cm.mc_predict(model, encoded, 5, batch_size=4, scope=scope)
+    assert classes.shape == (5, len(encoded), len(HEAD_SIZES))
+    assert not model.training
+    torch.manual_seed(0)
+    assert np.array_equal(
+        cm.mc_predict(model, encoded, 5, batch_size=4, scope=scope), classes)
+
+
+def test_disagreement():
+    agreeing = np.tile(np.array([[1, 2], [0, 3]]), (4, 1, 1))
+    assert cm.disagreement(agreeing).tolist() == [0, 0]
+
+    # one run of three differs on one head of two of the first report
+    classes = np.array([[[1, 2], [0, 3]],
+                        [[1, 2], [0, 3]],
+                        [[1, 3], [0, 3]]])
+    assert np.allclose(cm.disagreement(classes), [1 / 6, 0])
+
+
+def test_bf16_falls_back_to_fp32(monkeypatch, capsys):
+    monkeypatch.setattr(cm, 'cpu_supports_bf16', lambda: False)
+    assert cm.resolve_precision('bf16', 'cpu') == 'fp32'
+    assert 'bfloat16 is not supported on cpu' in capsys.readouterr().out
+    # auto picks fp32 without a message
+    assert cm.resolve_precision('auto', 'cpu') == 'fp32'
+    assert capsys.readouterr().out == ''
+
+    monkeypatch.setattr(cm, 'cpu_supports_bf16', lambda: True)
+    assert cm.resolve_precision('bf16', 'cpu') == 'bf16'
+    assert cm.resolve_precision('auto', 'cpu') == 'bf16'
+    assert cm.resolve_precision('fp32', 'cpu') == 'fp32'
+
+
+def test_quantized_model_keeps_the_heads(toy_model):
+    encoded = toy_encoded(toy_model)
+    model = cm.load_model(toy_model[2])
+    quantized = cm.load_model(toy_model[2], quantize='int8')
+
+    assert isinstance(quantized.linear_heads, cm.FusedHeads)
+    assert quantized.head_sizes == model.head_sizes == HEAD_SIZES
+    assert not any(isinstance(m, nn.Linear)
+                   for m in quantized.bert.encoder.modules())
+    input_ids, attention_mask = cm.pad_batch(encoded[:2])
+    with torch.no_grad():
+        outputs = quantized(input_ids, attention_mask)
+    assert [out.shape for out in outputs] == \
+        [(2, size) for size in HEAD_SIZES]
+
+    classes = cm.predict(quantized, encoded, batch_size=4)
+    assert classes.shape == cm.predict(model, encoded, batch_size=4).shape
+    assert all(((0 <= c) & (c < size)).all()
+               for c, size in zip(classes.T, HEAD_SIZES))
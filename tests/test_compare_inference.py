@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip('transformers')
+
+import compare_inference
+
+
+@pytest.mark.parametrize('extra_args', [
+    [],
+    ['--cache_dir', 'CACHE'],
+    ['--cache_dir', 'CACHE', '--num_reports', '4', '--max_tokens', '64'],
+])
+def test_compare_inference_runs(toy_model, tmp_path, capsys, extra_args):
+    _, tokenizer_path, checkpoint, input_file = toy_model
+    extra_args = [str(tmp_path / 'cache') if a == 'CACHE' else a
+                  for a in extra_args]
+    output_path = tmp_path / 'output'
+    compare_inference.main(['-d', str(input_file), '-c', str(checkpoint),
+                            '--tokenizer', str(tokenizer_path),
+                            '--output_path', str(output_path),
+                            '--batch_size', '4'] + extra_args)
+
+    assert 'int8 against fp32' in capsys.readouterr().out
+    assert (output_path / 'fp32_labeled.csv').exists()
+    assert (output_path / 'int8_labeled.csv').exists()
@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+import torch
+
+pytest.importorskip('transformers')
+
+import chexbert_model as cm
+import distill as ds
+
+
+def test_in_test_set(tmp_path):
+    test_report_path = tmp_path / 'input_chexpert.csv'
+    pd.DataFrame([['s1', 'No acute process.'],
+                  ['s2', 'Small left  pleural\neffusion.']]).to_csv(
+        test_report_path, header=False, index=False)
+    reports = pd.Series(['No acute process.', 'No acute process',
+                         ' Small left pleural effusion. ', None,
+                         'Mild edema.'])
+    assert ds.in_test_set(reports, test_report_path).tolist() == \
+        [True, False, True, False, False]
+
+
+def test_resolve_device():
+    assert cm.resolve_device('auto') == \
+        ('cuda' if torch.cuda.is_available() else 'cpu')
+    assert cm.resolve_device('cpu') == 'cpu'
+    assert cm.resolve_device('cuda:1') == 'cuda:1'
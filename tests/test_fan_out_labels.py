@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+import fan_out_labels
+import output_writers as ow
+
+STUDIES = [
+    ('s50000001', 'No acute cardiopulmonary process.'),
+    ('s50000002', 'Small left pleural effusion.'),
+    ('s50000003', 'No acute cardiopulmonary process.'),
+    ('s50000004', ''),
+    ('s50000005', 'Small left pleural effusion.'),
+    ('s50000006', 'Mild pulmonary edema, "new".\nNo effusion.'),
+]
+
+
+def label(input_file, output_file):
+    """A deterministic stand-in for the labeller, writing its CSV format."""
+    reports = pd.read_csv(input_file)['Report Impression']
+    df = pd.DataFrame({'Report Impression': reports.tolist()})
+    df['Edema'] = [1.0 if 'edema' in str(r) else None for r in reports]
+    df['Pleural Effusion'] = [1.0 if 'effusion.' in str(r) else 0.0
+                              for r in reports]
+    df.to_csv(output_file, index=False)
+
+
+def write_inputs(tmp_path, studies):
+    with ow.CSVRowWriter(tmp_path, 'input_chexbert.csv',
+                         header=['Report Impression']) as writer, \
+            ow.UniqueTextWriter(tmp_path, 'input_chexbert',
+                                header=['Report Impression']) as unique:
+        for s_stem, text in studies:
+            writer.writerow([text])
+            unique.writerow(s_stem, text)
+
+
+def fan_out(tmp_path, *args):
+    label(tmp_path / 'input_chexbert_unique.csv',
+          tmp_path / 'unique_labeled.csv')
+    fan_out_labels.main([
+        '--labeled_file', str(tmp_path / 'unique_labeled.csv'),
+        '--map_file', str(tmp_path / 'input_chexbert_map.csv'),
+        '--output_file', str(tmp_path / 'labeled.csv')] + list(args))
+
+
+def test_round_trip_matches_labelling_every_study(tmp_path):
+    write_inputs(tmp_path, STUDIES)
+    label(tmp_path / 'input_chexbert.csv', tmp_path / 'expected.csv')
+
+    fan_out(tmp_path)
+    assert len(pd.read_csv(tmp_path / 'input_chexbert_unique.csv')) == 4
+    assert (tmp_path / 'labeled.csv').read_bytes() == \
+        (tmp_path / 'expected.csv').read_bytes()
+
+    fan_out(tmp_path, '--input_file', str(tmp_path / 'input_chexbert.csv'),
+            '--input_header', '--text_column', 'Report Impression')
+    assert (tmp_path / 'labeled.csv').read_bytes() == \
+        (tmp_path / 'expected.csv').read_bytes()
+
+
+def test_map_of_another_input_is_rejected(tmp_path):
+    write_inputs(tmp_path, STUDIES)
+    # the input is regenerated without --dedup, leaving the old map behind
+    with ow.CSVRowWriter(tmp_path, 'input_chexbert.csv',
+                         header=['Report Impression']) as writer:
+        for _, text in STUDIES[:4]:
+            writer.writerow([text])
+
+    with pytest.raises(ValueError, match='another input'):
+        fan_out(tmp_path, '--input_file',
+                str(tmp_path / 'input_chexbert.csv'), '--input_header')
@@ -0,0 +1,53 @@
+import csv
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import generate_input_chexbert
+import generate_input_chexpert
+import generate_input_visualchexbert
+
+STUDIES = [f's5000000{i}' for i in range(5)]
+
+
+def failing_extraction(n_rows):
+    """extract_reports yielding n_rows studies, then failing."""
+    def extract_reports(*args, **kwargs):
+        for s_stem in STUDIES[:n_rows]:
+            yield (s_stem, f'impression of {s_stem}',
+                   [s_stem, f'impression of {s_stem}', None, None, None])
+        raise RuntimeError('unreadable report')
+    return extract_reports
+
+
+@pytest.mark.parametrize('module, stem', [
+    (generate_input_chexbert, 'input_chexbert'),
+    (generate_input_visualchexbert, 'input_visualchexbert'),
+    (generate_input_chexpert, 'input_chexpert'),
+])
+def test_writers_are_closed_when_extraction_fails(tmp_path, monkeypatch,
+                                                  module, stem):
+    study_list = tmp_path / 'study_list.csv'
+    with open(study_list, 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['path'])
+        writer.writerows([f'files/p10/p10000032/{s}.txt'] for s in STUDIES)
+    monkeypatch.setattr(module.rx, 'extract_reports', failing_extraction(3))
+
+    output_path = tmp_path / 'output'
+    args = ['--reports_path', str(tmp_path), '--output_path',
+            str(output_path), '--study_list', str(study_list), '--no_split',
+            '--dedup']
+    if module is not generate_input_chexpert:
+        args += ['--sections_parquet', str(tmp_path / 'sections.parquet'),
+                 '--row_group_size', '2']
+    with pytest.raises(RuntimeError):
+        module.main(args)
+
+    # the rows written before the error are flushed to the closed files
+    with open(output_path / f'{stem}_map.csv') as fp:
+        assert [row[0] for row in csv.reader(fp)] == ['study'] + STUDIES[:3]
+    # the spilled sections are removed, and no incomplete file is written
+    assert not list(tmp_path.glob('*.tmp'))
+    assert not (tmp_path / 'sections.parquet').exists()
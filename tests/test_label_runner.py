@@ -0,0 +1,170 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+import torch.nn as nn
+
+transformers = pytest.importorskip('transformers')
+from transformers import BertConfig, BertModel, BertTokenizer
+
+import chexbert_model as cm
+import label_runner
+from convert_checkpoint import save_checkpoint
+
+WORDS = ['no', 'acute', 'cardiopulmonary', 'process', 'small', 'left',
+         'right', 'pleural', 'effusion', 'mild', 'pulmonary', 'edema',
+         'heart', 'size', 'is', 'normal', 'tube', 'in', 'place', '.', ',']
+
+REPORTS = [
+    'No acute cardiopulmonary process.',
+    'Small left pleural effusion.\n Mild pulmonary edema.',
+    '',
+    'Heart size is normal, tube in place.',
+    'Right pleural effusion. ' * 20,
+    'No acute   cardiopulmonary process, unknownword.',
+]
+
+
+class bert_labeler(nn.Module):
+    """CheXbert's model: 13 heads of 4 classes and a No Finding head of 2."""
+
+    def __init__(self, config):
+        super(bert_labeler, self).__init__()
+        self.bert = BertModel(config)
+        self.dropout = nn.Dropout(0.1)
+        hidden_size = self.bert.pooler.dense.in_features
+        self.linear_heads = nn.ModuleList(
+            [nn.Linear(hidden_size, 4, bias=True) for _ in range(13)])
+        self.linear_heads.append(nn.Linear(hidden_size, 2, bias=True))
+
+    def forward(self, source_padded, attention_mask):
+        final_hidden = self.bert(source_padded,
+                                 attention_mask=attention_mask)[0]
+        cls_hidden = self.dropout(final_hidden[:, 0, :].squeeze(dim=1))
+        return [head(cls_hidden) for head in self.linear_heads]
+
+
+def chexbert_label(model, tokenizer, csv_path, batch_size=18):
+    """The labels of CheXbert's label.py and save_preds, as a DataFrame."""
+    impressions = pd.read_csv(csv_path)['Report Impression']
+    impressions = impressions.fillna('').str.strip()
+    impressions = impressions.replace('\n', ' ', regex=True)
+    impressions = impressions.replace(r'\s+', ' ', regex=True).str.strip()
+    encoded = []
+    for imp in impressions:
+        # encode_plus(tokenizer.tokenize(imp)), which recent transformers
+        # removed
+        res = tokenizer(imp)['input_ids']
+        if len(res) > 512:
+            res = res[:511] + [tokenizer.sep_token_id]
+        encoded.append(torch.LongTensor(res))
+
+    y_pred = [[] for _ in range(len(cm.CONDITIONS))]
+    with torch.no_grad():
+        for start in range(0, len(encoded), batch_size):
+            batch = encoded[start:start + batch_size]
+            src_len = [len(t) for t in batch]
+            padded = nn.utils.rnn.pad_sequence(batch, batch_first=True,
+                                               padding_value=0)
+            attn_mask = torch.zeros(padded.shape, dtype=torch.long)
+            for i, n in enumerate(src_len):
+                attn_mask[i, :n] = 1
+            out = model(padded, attn_mask)
+            for j in range(len(out)):
+                y_pred[j].append(out[j].argmax(dim=1))
+    y_pred = np.array([torch.cat(p, dim=0).tolist() for p in y_pred]).T
+
+    df = pd.DataFrame(y_pred, columns=cm.CONDITIONS)
+    df['Report Impression'] = pd.read_csv(csv_path)['Report Impression'] \
+        .tolist()
+    df = df[['Report Impression'] + cm.CONDITIONS]
+    df.replace(0, np.nan, inplace=True)
+    df.replace(3, -1, inplace=True)
+    df.replace(2, 0, inplace=True)
+    return df
+
+
+@pytest.fixture(scope='module')
+def setup(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('labeller')
+    tokenizer_path = tmp_path / 'tokenizer'
+    tokenizer_path.mkdir()
+    (tokenizer_path / 'vocab.txt').write_text(
+        '\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + WORDS))
+    tokenizer = BertTokenizer.from_pretrained(str(tokenizer_path))
+
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=5 + len(WORDS), hidden_size=64,
+                        num_hidden_layers=2, num_attention_heads=1,
+                        intermediate_size=128, max_position_embeddings=512,
+                        initializer_range=1.0)
+    # larger weights, so that the reports get different labels
+    model = bert_labeler(config)
+    model.eval()
+    checkpoint = tmp_path / 'chexbert.pth'
+    # saved as CheXbert saved it, from a DataParallel model
+    torch.save({'model_state_dict': {'module.' + k: v for k, v
+                                     in model.state_dict().items()}},
+               checkpoint)
+
+    input_file = tmp_path / 'input_chexbert.csv'
+    pd.DataFrame({'Report Impression': REPORTS}).to_csv(input_file,
+                                                        index=False)
+    expected = chexbert_label(model, tokenizer, input_file)
+    return tmp_path, tokenizer_path, checkpoint, input_file, expected
+
+
+@pytest.mark.parametrize('extra_args', [
+    [],
+    ['--batch_size', '4'],
+    ['--max_tokens', '200'],
+    ['--num_runs', '2', '--cache_dir', 'CACHE'],
+    ['--workers', '2', '--cache_dir', 'CACHE'],
+])
+def test_label_runner_matches_chexbert(setup, extra_args):
+    tmp_path, tokenizer_path, checkpoint, input_file, expected = setup
+    output_path = tmp_path / 'output'
+    extra_args = [str(tmp_path / 'cache') if a == 'CACHE' else a
+                  for a in extra_args]
+    label_runner.main(['-d', str(input_file), '-o', str(output_path),
+                       '-c', str(checkpoint), '--tokenizer',
+                       str(tokenizer_path), '--device', 'cpu'] + extra_args)
+
+    expected_file = tmp_path / 'expected.csv'
+    expected.to_csv(expected_file, index=False)
+    n_runs = 2 if '--num_runs' in extra_args else 1
+    for i in range(1, n_runs + 1):
+        output_file = output_path / f'chexbert_labeled_{i}.csv'
+        assert output_file.read_bytes() == expected_file.read_bytes()
+    # the model predicts more than one class
+    assert expected[cm.CONDITIONS].nunique(dropna=False).max() > 1
+
+
+@pytest.mark.parametrize('extra_args', [
+    ['--workers', '2', '--backend', 'onnx'],
+    ['--workers', '2', '--device', 'cuda'],
+    ['--backend', 'onnx', '--device', 'cuda'],
+    ['--backend', 'onnx', '--mc_dropout', 'heads'],
+    ['--workers', '2', '--mc_dropout', 'heads'],
+])
+def test_label_runner_rejects_cpu_only_clashes(setup, extra_args):
+    tmp_path, tokenizer_path, checkpoint, input_file, _ = setup
+    with pytest.raises(SystemExit):
+        label_runner.main(['-d', str(input_file), '-o',
+                           str(tmp_path / 'output'), '-c', str(checkpoint),
+                           '--tokenizer', str(tokenizer_path)] + extra_args)
+
+
+def test_unfused_state_dict_matches_chexbert(setup, tmp_path):
+    _, _, checkpoint, _, _ = setup
+    original = cm.read_state_dict(checkpoint)
+    model = cm.load_model(checkpoint)
+    converted = tmp_path / 'chexbert.safetensors'
+    save_checkpoint(model, converted)
+
+    unfused = cm.unfused_state_dict(cm.read_state_dict(converted))
+    assert sorted(unfused) == sorted(original)
+    for key, tensor in original.items():
+        assert torch.equal(unfused[key], tensor)
@@ -0,0 +1,53 @@
+import csv
+
+import numpy as np
+import pandas as pd
+
+import fan_out_labels
+import near_duplicates as nd
+
+BASE = ('the heart size is normal the mediastinal and hilar contours are'
+        ' unremarkable the lungs are clear without focal consolidation no'
+        ' pleural effusion or pneumothorax is seen no acute cardiopulmonary'
+        ' process')
+
+
+def test_split_chained_clusters():
+    sig = np.zeros((4, 10), dtype=np.uint32)
+    sig[1, :1] = 1  # 0.9 similar to 0
+    sig[2, :2] = 1  # 0.9 similar to 1, 0.8 to 0
+    sig[3] = 5
+    cluster = nd.split_chained(sig, np.array([0, 0, 0, 1]),
+                               np.array([0, 3]), 0.9)
+    assert cluster.tolist() == [0, 0, 1, 2]
+
+
+def test_studies_keep_their_own_text(tmp_path):
+    studies = [
+        ('s50000001', BASE + '.'),
+        ('s50000002', BASE + '.'),
+        ('s50000003', BASE.upper() + '!'),
+        ('s50000004', 'Moderate pulmonary edema, worse since ___.'),
+    ]
+    input_file = tmp_path / 'input_chexpert.csv'
+    with open(input_file, 'w', newline='') as fp:
+        csv.writer(fp).writerows(studies)
+
+    nd.main(['--input_files', str(input_file), '--output_path',
+             str(tmp_path), '--stem', 'input_chexbert_neardup'])
+    unique = pd.read_csv(tmp_path / 'input_chexbert_neardup_unique.csv')
+    assert unique['Report Impression'].tolist() == [
+        BASE + '.', studies[3][1]]
+
+    labeled = unique.assign(Edema=[0.0, 1.0])
+    labeled.to_csv(tmp_path / 'labeled.csv', index=False)
+    fan_out_labels.main([
+        '--labeled_file', str(tmp_path / 'labeled.csv'),
+        '--map_file', str(tmp_path / 'input_chexbert_neardup_map.csv'),
+        '--output_file', str(tmp_path / 'chexbert_labeled_1.csv'),
+        '--input_file', str(input_file),
+        '--text_column', 'Report Impression'])
+
+    output = pd.read_csv(tmp_path / 'chexbert_labeled_1.csv')
+    assert output['Report Impression'].tolist() == [t for _, t in studies]
+    assert output['Edema'].tolist() == [0.0, 0.0, 0.0, 1.0]
@@ -0,0 +1,47 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('transformers')
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+import label_runner
+import onnx_backend as ob
+
+
+def run_labeller(toy_model, output_path, extra_args):
+    _, tokenizer_path, checkpoint, input_file = toy_model
+    label_runner.main(['-d', str(input_file), '-o', str(output_path),
+                       '-c', str(checkpoint), '--tokenizer',
+                       str(tokenizer_path)] + extra_args)
+    return pd.read_csv(output_path / 'chexbert_labeled_1.csv')
+
+
+def test_onnx_backend_matches_torch(toy_model, tmp_path):
+    expected = run_labeller(toy_model, tmp_path / 'torch', ['--device', 'cpu'])
+    labels = run_labeller(toy_model, tmp_path / 'onnx',
+                          ['--backend', 'onnx', '--onnx_path',
+                           str(tmp_path / 'chexbert.onnx')])
+    pd.testing.assert_frame_equal(labels, expected)
+
+
+def test_onnx_graph_is_exported_again_for_a_new_checkpoint(toy_model,
+                                                          tmp_path, capsys):
+    checkpoint = tmp_path / 'chexbert.pth'
+    shutil.copy(toy_model[2], checkpoint)
+    onnx_path = tmp_path / 'chexbert.onnx'
+
+    ob.load_onnx(onnx_path, checkpoint)
+    assert 'Exported' in capsys.readouterr().out
+    ob.load_onnx(onnx_path, checkpoint)
+    assert 'Exported' not in capsys.readouterr().out
+
+    # as if the checkpoint had been retrained
+    st = os.stat(checkpoint)
+    os.utime(checkpoint, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    model = ob.load_onnx(onnx_path, checkpoint)
+    assert 'out of date' in capsys.readouterr().out
+    assert model.checkpoint_stamp == ob.checkpoint_stamp(checkpoint)
@@ -0,0 +1,124 @@
+import csv
+import gzip
+import json
+import re
+
+import pytest
+
+import output_writers as ow
+
+ROWS = [
+    ['s50000001', 'No acute cardiopulmonary process.'],
+    ['s50000002', 'Small left pleural effusion, unchanged.'],
+    ['s50000003', ''],
+    ['s50000004', 'Quoted "NG tube" tip\nin the stomach.'],
+    ['s50000005', 's123, a line that looks like a study id'],
+    ['s50000006', 'Non-ASCII ° and trailing space '],
+]
+
+
+def legacy_input_chexbert(output_file, rows):
+    """The no-split input_chexbert.csv as written before CSVRowWriter: the
+    rows with their study ids, then rewritten by clean_csv."""
+    with open(output_file, 'w', newline='') as fp:
+        csvwriter = csv.writer(fp)
+        for row in rows:
+            csvwriter.writerow(row)
+
+    pattern = re.compile(r'^s\d+,')
+    with open(output_file, 'r') as infile:
+        rows = list(csv.reader(infile))
+    cleaned_rows = [['Report Impression']]
+    for row in rows:
+        cleaned_rows.append([re.sub(pattern, '', ','.join(row))])
+    with open(output_file, 'w', newline='') as outfile:
+        csv.writer(outfile).writerows(cleaned_rows)
+
+
+def test_input_chexbert_matches_legacy(tmp_path):
+    legacy_file = tmp_path / 'legacy.csv'
+    legacy_input_chexbert(legacy_file, ROWS)
+
+    with ow.CSVRowWriter(tmp_path, 'input_chexbert.csv',
+                         header=['Report Impression']) as writer:
+        for _, impression in ROWS:
+            writer.writerow([impression])
+
+    assert (tmp_path / 'input_chexbert.csv').read_bytes() == \
+        legacy_file.read_bytes()
+
+
+def test_rows_match_csv_writer(tmp_path):
+    with open(tmp_path / 'legacy.csv', 'w', newline='') as fp:
+        csv.writer(fp).writerows(ROWS)
+
+    with ow.CSVRowWriter(tmp_path, 'rows.csv') as writer:
+        for row in ROWS:
+            writer.writerow(row)
+
+    assert (tmp_path / 'rows.csv').read_bytes() == \
+        (tmp_path / 'legacy.csv').read_bytes()
+
+
+def test_gzip_matches_uncompressed(tmp_path):
+    for compression in ('none', 'gzip'):
+        with ow.CSVRowWriter(tmp_path, 'rows.csv',
+                             compression=compression) as writer:
+            for row in ROWS:
+                writer.writerow(row)
+
+    assert gzip.decompress((tmp_path / 'rows.csv.gz').read_bytes()) == \
+        (tmp_path / 'rows.csv').read_bytes()
+
+
+def test_no_rows_writes_no_file(tmp_path):
+    with ow.CSVRowWriter(tmp_path, 'rows.csv', header=['text']):
+        pass
+    assert not (tmp_path / 'rows.csv').exists()
+
+
+def write_shards(output_path, rows, **kwargs):
+    with ow.ShardedCSVWriter(output_path, 'mimic_cxr_{:02d}.csv',
+                             **kwargs) as writer:
+        for row in rows:
+            writer.writerow(row)
+
+
+def test_shards_match_legacy(tmp_path):
+    write_shards(tmp_path, ROWS, shard_rows=4)
+
+    for n_fn, n in enumerate(range(0, len(ROWS), 4)):
+        legacy_file = tmp_path / f'legacy_{n_fn:02d}.csv'
+        with open(legacy_file, 'w', newline='') as fp:
+            csv.writer(fp).writerows(ROWS[n:n + 4])
+        assert (tmp_path / f'mimic_cxr_{n_fn:02d}.csv').read_bytes() == \
+            legacy_file.read_bytes()
+
+    with open(tmp_path / 'shards.json') as fp:
+        manifest = json.load(fp)
+    assert manifest['total_rows'] == len(ROWS)
+    assert [s['rows'] for s in manifest['shards']] == [[0, 4], [4, 6]]
+
+
+def test_stale_shards_are_removed(tmp_path):
+    write_shards(tmp_path, ROWS, shard_rows=1, compression='gzip')
+    (tmp_path / 'mimic_cxr_sectioned.csv').write_text('kept')
+
+    write_shards(tmp_path, ROWS, shard_rows=4)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'mimic_cxr_00.csv', 'mimic_cxr_01.csv', 'mimic_cxr_sectioned.csv',
+        'shards.json']
+
+
+def test_no_manifest_after_an_error(tmp_path):
+    write_shards(tmp_path, ROWS, shard_rows=4)
+
+    with pytest.raises(RuntimeError):
+        with ow.ShardedCSVWriter(tmp_path, 'mimic_cxr_{:02d}.csv',
+                                 shard_rows=2) as writer:
+            for row in ROWS[:3]:
+                writer.writerow(row)
+            raise RuntimeError('interrupted')
+
+    assert not (tmp_path / 'shards.json').exists()
+    assert not list(tmp_path.glob('*.tmp'))
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+import report_extraction as rx
+import report_source as rs
+
+REPORTS = {
+    'files/p10/p10000001/s50000001.txt': (
+        '                                 FINAL REPORT\n'
+        ' EXAMINATION:  CHEST (PA AND LAT)\n\n'
+        ' FINDINGS:\n \n PA and lateral views of the chest.\n\n'
+        ' IMPRESSION:\n \n No acute cardiopulmonary process.\n'),
+    'files/p10/p10000002/s50000002.txt': (
+        '                                 FINAL REPORT\n'
+        ' FINDINGS:\n \n Small left pleural effusion.\n'),
+    'files/p10/p10000003/s50000003.txt': (
+        '                                 FINAL REPORT\n'
+        ' COMPARISON:  None.\n\n'
+        ' IMPRESSION:\n \n Mild pulmonary edema.\n'),
+}
+
+
+@pytest.fixture
+def reports_path(tmp_path):
+    reports_path = tmp_path / 'reports'
+    for path, text in REPORTS.items():
+        (reports_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (reports_path / path).write_text(text)
+    return reports_path
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Paths read from the reports folder."""
+    reads = []
+    read = rs.DirectorySource.read
+
+    def counting_read(self, path):
+        reads.append(path)
+        return read(self, path)
+
+    monkeypatch.setattr(rs.DirectorySource, 'read', counting_read)
+    return reads
+
+
+def extract(reports_path, manifest_path=None):
+    return list(rx.extract_reports(reports_path, REPORTS,
+                                   manifest_path=manifest_path))
+
+
+def test_manifest_output_matches(reports_path, tmp_path):
+    manifest_path = tmp_path / 'manifest.sqlite'
+    expected = extract(reports_path)
+    assert extract(reports_path, manifest_path) == expected
+    assert extract(reports_path, manifest_path) == expected
+
+
+def test_resume_skips_unchanged_reports(reports_path, tmp_path, reads):
+    manifest_path = tmp_path / 'manifest.sqlite'
+    expected = extract(reports_path, manifest_path)
+    assert len(reads) == len(REPORTS)
+
+    del reads[:]
+    assert extract(reports_path, manifest_path) == expected
+    assert reads == []
+
+
+def test_resume_rereads_changed_reports(reports_path, tmp_path, reads):
+    manifest_path = tmp_path / 'manifest.sqlite'
+    extract(reports_path, manifest_path)
+
+    changed = 'files/p10/p10000002/s50000002.txt'
+    report_file = reports_path / changed
+    report_file.write_text(REPORTS[changed].replace('left', 'right'))
+    st = os.stat(report_file)
+    os.utime(report_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    del reads[:]
+    rows = extract(reports_path, manifest_path)
+    assert reads == [changed]
+    assert rows[1][1] == 'Small right pleural effusion.'
+    assert rows == extract(reports_path)
+
+
+def test_interrupted_run_resumes(reports_path, tmp_path, reads):
+    manifest_path = tmp_path / 'manifest.sqlite'
+    expected = extract(reports_path)
+
+    # stop after the first chunk was committed
+    rows = rx.extract_reports(reports_path, REPORTS,
+                              manifest_path=manifest_path, commit_every=2)
+    for _ in range(2):
+        next(rows)
+    rows.close()
+
+    del reads[:]
+    assert extract(reports_path, manifest_path) == expected
+    assert reads == ['files/p10/p10000003/s50000003.txt']
@@ -0,0 +1,56 @@
+import random
+from pathlib import Path
+
+import pytest
+
+import section_parser as sp
+from benchmark_section_parser import (
+    legacy_normalize_section_names, legacy_section_text, synthetic_header,
+    synthetic_report)
+
+EDGE_CASES = [
+    '',
+    'no sections at all',
+    ' single paragraph\n \n second paragraph\n',
+    '                                 FINAL REPORT\n IMPRESSION:  \n',
+    '                                 FINAL REPORT\n'
+    ' CHEST, PA LATERAL:\n\n INDICATION:   Cough.\n \n Clear lungs.\n',
+    '                                 FINAL REPORT\n'
+    ' FINDINGS:\n \n FINDINGS:  Clear.\n IMPRESSION:',
+    '\n IMPRESSION: last line without a newline',
+]
+
+
+@pytest.mark.parametrize('text', EDGE_CASES)
+def test_section_text_matches_legacy_edge_cases(text):
+    assert sp.section_text(text) == legacy_section_text(text)
+
+
+def test_section_text_matches_legacy_synthetic_reports():
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = synthetic_report(rng)
+        assert sp.section_text(text) == legacy_section_text(text), text
+
+
+def test_section_spans_slice_the_legacy_sections():
+    rng = random.Random(1)
+    for _ in range(500):
+        text = synthetic_report(rng)
+        sections, names, _ = legacy_section_text(text)
+        spans = sp.section_spans(text)
+        assert [name for name, _, _ in spans] == names
+        assert [text[start:end] for _, start, end in spans] == sections
+
+
+def test_normalize_section_names_matches_legacy():
+    rng = random.Random(2)
+    headers = [synthetic_header(rng) for _ in range(5000)]
+    assert sp.normalize_section_names(headers) == \
+        legacy_normalize_section_names(headers)
+
+
+def test_evaluation_copy_is_identical():
+    src = Path(__file__).resolve().parents[1] / 'src'
+    assert (src / 'data' / 'section_parser.py').read_text() == \
+        (src / 'evaluation' / 'section_parser.py').read_text()
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+
+from sections_parquet import SectionsParquetWriter, read_sections
+
+
+def study_rows(n, seed=0):
+    """Sectioned rows in a shuffled study order, as in a study list."""
+    study_ids = random.Random(seed).sample(range(50000000, 60000000), n)
+    return [[f's{i}', f'impression {i}', None, None, f'comparison {i}']
+            for i in study_ids]
+
+
+def test_rows_are_sorted_by_study_id(tmp_path):
+    path = tmp_path / 'sections.parquet'
+    rows = study_rows(250)
+    with SectionsParquetWriter(path, row_group_size=40) as writer:
+        for row in rows:
+            writer.writerow(row)
+
+    table = pq.read_table(path)
+    assert table.column('study').to_pylist() == \
+        sorted((row[0] for row in rows), key=lambda s: int(s[1:]))
+    assert table.column('label_section').to_pylist() == ['impression'] * 250
+    assert not list(tmp_path.glob('*.tmp'))
+
+    # row groups cover disjoint study id ranges
+    metadata = pq.ParquetFile(path).metadata
+    ranges = [(metadata.row_group(i).column(0).statistics.min,
+               metadata.row_group(i).column(0).statistics.max)
+              for i in range(metadata.num_row_groups)]
+    assert all(hi < lo for (_, hi), (lo, _) in zip(ranges, ranges[1:]))
+
+
+def test_read_sections_skips_row_groups(tmp_path, monkeypatch):
+    path = tmp_path / 'sections.parquet'
+    rows = study_rows(250)
+    with SectionsParquetWriter(path, row_group_size=40) as writer:
+        for row in rows:
+            writer.writerow(row)
+
+    read = []
+    read_row_groups = pq.ParquetFile.read_row_groups
+
+    def counting_read(self, row_groups, *args, **kwargs):
+        read.extend(row_groups)
+        return read_row_groups(self, row_groups, *args, **kwargs)
+
+    monkeypatch.setattr(pq.ParquetFile, 'read_row_groups', counting_read)
+    ids = sorted(int(row[0][1:]) for row in rows)
+    table = read_sections(path, ['impression'], ids[45], ids[60])
+    assert table.column('study_id').to_pylist() == ids[45:61]
+    assert read == [1]
+
+
+def test_no_file_after_an_error(tmp_path):
+    path = tmp_path / 'sections.parquet'
+    with pytest.raises(RuntimeError):
+        with SectionsParquetWriter(path, row_group_size=40) as writer:
+            for row in study_rows(100):
+                writer.writerow(row)
+            raise RuntimeError('interrupted')
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import sharded_inference as si
+import token_cache as tc
+
+
+def encoded_reports(lengths):
+    return [list(range(n)) for n in lengths]
+
+
+def test_split_by_tokens_empty():
+    assert si.split_by_tokens([], 4) == []
+
+
+@pytest.mark.parametrize('lengths, n_shards', [
+    ([10] * 8, 4),
+    ([100, 1, 1, 1, 1, 1, 1, 1], 2),
+    ([5, 7, 9], 1),
+    ([5, 7], 4),
+    ([3] * 1000, 7),
+])
+def test_split_by_tokens_covers_every_report(lengths, n_shards):
+    shards = si.split_by_tokens(encoded_reports(lengths), n_shards)
+    assert len(shards) == n_shards
+    assert shards[0][0] == 0 and shards[-1][1] == len(lengths)
+    assert all(end == start for (_, end), (start, _)
+               in zip(shards, shards[1:]))
+    assert all(start <= end for start, end in shards)
+
+
+def test_split_by_tokens_balances_tokens():
+    lengths = np.random.RandomState(0).randint(10, 300, 2000)
+    shards = si.split_by_tokens(encoded_reports(lengths), 8)
+    tokens = [lengths[start:end].sum() for start, end in shards]
+    assert max(tokens) - min(tokens) <= 2 * lengths.max()
+
+
+def test_split_by_tokens_of_a_token_cache(tmp_path):
+    lengths = [4, 9, 2, 7, 7, 3]
+    tc.write_cache(tmp_path / 'cache', encoded_reports(lengths))
+    cached = tc.read_cache(tmp_path / 'cache')
+    assert si.split_by_tokens(cached, 3) == \
+        si.split_by_tokens(encoded_reports(lengths), 3)
+
+
+class FakeQueue:
+    def __init__(self, items=()):
+        self.items = list(items)
+
+    def put(self, item):
+        self.items.append(item)
+
+    def get(self):
+        return self.items.pop(0)
+
+
+def fake_labeller(n_workers, results):
+    labeller = si.ShardedLabeller.__new__(si.ShardedLabeller)
+    labeller.processes = [None] * n_workers
+    labeller.jobs = [FakeQueue() for _ in range(n_workers)]
+    labeller.results = FakeQueue(results)
+    labeller.n_jobs = 0
+    labeller.head_sizes = [4, 2]
+    return labeller
+
+
+def test_cached_reports_are_sent_as_ranges(tmp_path):
+    tc.write_cache(tmp_path / 'cache', encoded_reports([4, 9, 2, 7]))
+    cached = tc.read_cache(tmp_path / 'cache')
+    labeller = fake_labeller(2, [(1, 0, np.ones((2, 2))),
+                                 (0, 0, np.zeros((2, 2)))])
+
+    classes = labeller.predict(cached)
+    assert classes.tolist() == [[0, 0], [0, 0], [1, 1], [1, 1]]
+    shards = [jobs.items[0][1] for jobs in labeller.jobs]
+    assert shards == [(str(tmp_path / 'cache'), 0, 2),
+                      (str(tmp_path / 'cache'), 2, 4)]
+
+
+def test_no_reports_sends_no_jobs():
+    labeller = fake_labeller(2, [])
+    assert labeller.predict([]).shape == (0, 2)
+    assert all(not jobs.items for jobs in labeller.jobs)
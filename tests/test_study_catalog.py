@@ -0,0 +1,46 @@
+import os
+
+import study_catalog as sc
+
+STUDY_LIST = (
+    'subject_id,study_id,path\n'
+    '10000001,50000001,files/p10/p10000001/s50000001.txt\n'
+    '10000001,50000002,files/p10/p10000001/s50000002.txt\n'
+    '10000002,50000003,files/p10/p10000002/s50000003.txt\n'
+)
+
+
+def test_catalog_is_rebuilt_when_the_study_list_changes(tmp_path):
+    study_list = tmp_path / 'cxr-study-list.csv'
+    study_list.write_text(STUDY_LIST)
+    catalog_path = tmp_path / 'study-catalog.db'
+
+    catalog = sc.open_catalog(catalog_path, study_list)
+    assert [row[1] for row in catalog.by_study_ids([50000003])] == [50000003]
+    catalog.close()
+
+    study_list.write_text(STUDY_LIST.replace('50000003', '50000004'))
+    st = os.stat(study_list)
+    os.utime(study_list, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    catalog = sc.open_catalog(catalog_path, study_list)
+    assert catalog.by_study_ids([50000003]) == []
+    assert [row[1] for row in catalog.by_study_ids([50000004])] == [50000004]
+    catalog.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'cxr-study-list.csv', 'study-catalog.db']
+
+
+def test_unchanged_catalog_is_not_rebuilt(tmp_path, monkeypatch):
+    study_list = tmp_path / 'cxr-study-list.csv'
+    study_list.write_text(STUDY_LIST)
+    catalog_path = tmp_path / 'study-catalog.db'
+    sc.open_catalog(catalog_path, study_list).close()
+
+    def fail(self, study_list_path):
+        raise AssertionError('catalog rebuilt')
+
+    monkeypatch.setattr(sc.StudyCatalog, 'load', fail)
+    catalog = sc.open_catalog(catalog_path, study_list)
+    assert len(catalog) == 3
+    catalog.close()